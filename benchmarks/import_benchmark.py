@@ -0,0 +1,121 @@
+"""
+Benchmark of cold start (import time) of simulation modules, each measured in a fresh interpreter. Fails if median
+import time exceeds the budget or modules which should be loaded lazily are imported on start.
+Run from the directory containing this package, e.g.:
+    python -m hmse_simulations.benchmarks.import_benchmark --budget-ms 300 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+_PACKAGE = __package__.rsplit(".", 1)[0]
+
+DEFAULT_MODULES = [
+    f"{_PACKAGE}.simulation.simulation_worker",
+    f"{_PACKAGE}.simulation_service",
+]
+
+# Modules which must not be imported on start - they are loaded on first use
+LAZY_MODULES = [
+    f"{_PACKAGE}.simulation.tasks.configuration_tasks",
+    f"{_PACKAGE}.simulation.tasks.data_tasks",
+    f"{_PACKAGE}.simulation.tasks.simulation_tasks",
+    f"{_PACKAGE}.hmse_projects.project_dao",
+    f"{_PACKAGE}.hmse_projects.hmse_hydrological_models.processing.task_logic",
+    "numpy",
+]
+
+
+def measure_import(module: str, runs: int) -> Dict:
+    """
+    Import the module in fresh interpreters and measure wall time of the import and its slowest dependencies.
+    """
+    wall_times = []
+    import_times = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, cwd=os.getcwd())
+        wall_times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed: {result.stderr[-2000:]}")
+        for name, cumulative_us in _parse_importtime(result.stderr).items():
+            import_times.setdefault(name, []).append(cumulative_us)
+
+    slowest = sorted(((statistics.median(times), name) for name, times in import_times.items()), reverse=True)
+    return {
+        "module": module,
+        "import_time_ms": statistics.median(import_times.get(module, [0])) / 1000,
+        "process_wall_time_ms": statistics.median(wall_times) * 1000,
+        "slowest_imports": [{"module": name, "cumulative_ms": us / 1000} for us, name in slowest[:15]],
+        "eagerly_loaded_lazy_modules": find_loaded_lazy_modules(module)
+    }
+
+
+def find_loaded_lazy_modules(module: str) -> List[str]:
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    loaded = json.loads(result.stdout)
+    return [lazy for lazy in LAZY_MODULES if any(name == lazy or name.startswith(f"{lazy}.") for name in loaded)]
+
+
+def _parse_importtime(stderr: str) -> Dict[str, int]:
+    # Lines have format "import time: self [us] | cumulative | imported package"
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def run_benchmarks(args) -> Dict:
+    results = [measure_import(module, args.runs) for module in args.modules]
+    registry_differences = []
+    if not args.skip_registry_check:
+        from ..simulation.tasks.task_registry import verify_task_registry
+        registry_differences = verify_task_registry()
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time()
+        },
+        "parameters": vars(args),
+        "imports": results,
+        "task_registry_differences": registry_differences,
+        "passed": not registry_differences and all(
+            result["import_time_ms"] <= args.budget_ms and not result["eagerly_loaded_lazy_modules"]
+            for result in results)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of HMSE simulation modules import time")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument("--runs", type=int, default=10, help="Number of fresh interpreters per module")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="Maximal median import time of a module")
+    parser.add_argument("--skip-registry-check", action="store_true",
+                        help="Don't compare static task registry with task declarations")
+    parser.add_argument("--output", help="File to write JSON results to (stdout by default)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    if not results["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
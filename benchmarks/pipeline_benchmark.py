@@ -0,0 +1,263 @@
+"""
+Benchmark of simulation pipeline overhead using synthetic projects and no-op or sleeping tasks.
+Run from the directory containing this package, e.g.:
+    python -m hmse_simulations.benchmarks.pipeline_benchmark --steps 100 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from ..hmse_projects.hmse_hydrological_models.processing.modflow.modflow_step import ModflowStepType
+from ..hmse_projects.project_metadata import ProjectMetadata
+from ..hmse_projects.simulation_mode import SimulationMode
+from ..simulation import simulation_configurator
+from ..simulation.simulation import Simulation
+from ..simulation.simulation_chapter import CHAPTER_TO_TASK_MAPPING, SimulationChapter
+from ..simulation.simulation_executor import SimulationExecutor
+from ..simulation.tasks import hmse_task
+from ..simulation_service import SimulationService
+
+
+class BenchmarkSimulation(Simulation):
+    """
+    Simulation which does not persist metadata of synthetic projects.
+    """
+
+    def _complete_simulation(self) -> None:
+        self.project_metadata.finished = True
+
+
+def make_synthetic_metadata(project_id: str, steps: int, shapes: int, weather_mappings: int) -> ProjectMetadata:
+    """
+    Create metadata of a feedback simulation with given number of Modflow steps (one steady state step followed by
+    transient ones), shapes (each with its own Hydrus model) and Hydrus models with weather data assigned.
+    Only fields used by simulation pipeline are filled in.
+    """
+    metadata = ProjectMetadata.__new__(ProjectMetadata)
+    metadata.project_id = project_id
+    metadata.name = project_id
+    metadata.finished = False
+    metadata.simulation_mode = SimulationMode.WITH_FEEDBACK
+    step_types = [ModflowStepType.STEADY_STATE] + [ModflowStepType.TRANSIENT] * (steps - 1)
+    metadata.modflow_metadata = SimpleNamespace(steps_info=[SimpleNamespace(type=t) for t in step_types])
+    metadata.shapes_to_hydrus = {f"shape_{i}": f"hydrus_{i}" for i in range(shapes)}
+    metadata.hydrus_to_weather = {f"hydrus_{i}": f"weather_{i}" for i in range(min(weather_mappings, shapes))}
+    return metadata
+
+
+def make_benchmark_task(task: Callable, task_duration: float) -> Callable:
+    """
+    Create a task with the same stage name and declarations as the given one, which only sleeps.
+    """
+    def benchmark_task(project_metadata: ProjectMetadata) -> None:
+        if task_duration > 0:
+            time.sleep(task_duration)
+
+    benchmark_task.__name__ = f"benchmark_{task.__name__}"
+    resources = hmse_task.get_task_resources(task)
+    reads, writes = resources if resources is not None else (None, None)
+    return hmse_task.hmse_task(stage_name=hmse_task.get_stage_name(task), reads=reads, writes=writes,
+                               cache_key_fields=hmse_task.get_cache_key_fields(task),
+                               prefetchable=hmse_task.is_prefetchable(task))(benchmark_task)
+
+
+@contextmanager
+def benchmark_tasks(task_duration: float):
+    """
+    Replace tasks of all chapters with sleeping (or no-op if duration is 0) ones for the duration of the context.
+    """
+    original_mapping = {chapter: list(tasks) for chapter, tasks in CHAPTER_TO_TASK_MAPPING.items()}
+    for chapter, tasks in original_mapping.items():
+        CHAPTER_TO_TASK_MAPPING[chapter] = [make_benchmark_task(task, task_duration) for task in tasks]
+    SimulationChapter.clear_execution_plans()
+    try:
+        yield
+    finally:
+        CHAPTER_TO_TASK_MAPPING.update(original_mapping)
+        SimulationChapter.clear_execution_plans()
+
+
+def configure_benchmark_simulation(metadata: ProjectMetadata) -> Simulation:
+    return simulation_configurator.configure_simulation(metadata, simulation_class=BenchmarkSimulation)
+
+
+def expected_duration(simulation: Simulation, task_duration: float) -> float:
+    """
+    @return: Duration of the critical path of all chapters, assuming each task takes task_duration
+    """
+    total = 0.0
+    for chapter_status in simulation.get_simulation_status():
+        finish_times = []
+        for dependencies in chapter_status.plan.dependencies:
+            finish_times.append(max((finish_times[d] for d in dependencies), default=0.0) + task_duration)
+        total += max(finish_times, default=0.0)
+    return total
+
+
+def benchmark_orchestration_overhead(args) -> Dict:
+    simulation = configure_benchmark_simulation(
+        make_synthetic_metadata("overhead", args.steps, args.shapes, args.weather_mappings))
+    chapters = len(simulation.get_simulation_status())
+
+    start = time.perf_counter()
+    simulation.run_simulation()
+    wall_time = time.perf_counter() - start
+
+    overhead = wall_time - expected_duration(simulation, args.task_duration)
+    return {
+        "chapters": chapters,
+        "wall_time": wall_time,
+        "overhead_total": overhead,
+        "overhead_per_chapter": overhead / chapters
+    }
+
+
+def benchmark_configuration(args) -> Dict:
+    metadata = make_synthetic_metadata("configuration", args.steps, args.shapes, args.weather_mappings)
+    start = time.perf_counter()
+    configure_benchmark_simulation(metadata)
+    return {"configuration_time": time.perf_counter() - start}
+
+
+def benchmark_status_polling(args) -> Dict:
+    service = SimulationService(executor=SimulationExecutor(max_workers=1))
+    simulation = configure_benchmark_simulation(
+        make_synthetic_metadata("polling", args.steps, args.shapes, args.weather_mappings))
+    service.register_simulation_if_necessary(simulation)
+    full_latencies: List[float] = []
+    delta_latencies: List[float] = []
+    stop = threading.Event()
+
+    def poll():
+        seq = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            [chapter.to_json(i) for i, chapter in enumerate(simulation.get_simulation_status())]
+            full_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            seq = service.get_status_changes("polling", seq)["seq"]
+            delta_latencies.append(time.perf_counter() - start)
+
+    pollers = [threading.Thread(target=poll) for _ in range(args.pollers)]
+    for poller in pollers:
+        poller.start()
+    service.executor.submit(simulation)
+    while not simulation.status_events.closed:
+        time.sleep(0.01)
+    stop.set()
+    for poller in pollers:
+        poller.join()
+    service.executor.shutdown()
+
+    return {
+        "pollers": args.pollers,
+        "full_status": _latency_summary(full_latencies),
+        "status_changes": _latency_summary(delta_latencies)
+    }
+
+
+def benchmark_memory(args) -> Dict:
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    service = SimulationService()
+    for i in range(args.registered_simulations):
+        metadata = make_synthetic_metadata(f"memory_{i}", args.steps, args.shapes, args.weather_mappings)
+        service.register_simulation_if_necessary(configure_benchmark_simulation(metadata))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "registered_simulations": args.registered_simulations,
+        "bytes_per_simulation": (current - baseline) / args.registered_simulations,
+        "peak_bytes": peak - baseline
+    }
+
+
+def benchmark_scaling(args) -> Dict:
+    results = []
+    projects = 1
+    while projects <= args.max_projects:
+        executor = SimulationExecutor(max_workers=projects)
+        simulations = [configure_benchmark_simulation(
+            make_synthetic_metadata(f"scaling_{i}", args.steps, args.shapes, args.weather_mappings))
+            for i in range(projects)]
+        start = time.perf_counter()
+        for simulation in simulations:
+            executor.submit(simulation)
+        while not all(simulation.status_events.closed for simulation in simulations):
+            time.sleep(0.01)
+        wall_time = time.perf_counter() - start
+        executor.shutdown()
+        results.append({
+            "projects": projects,
+            "wall_time": wall_time,
+            "simulations_per_second": projects / wall_time
+        })
+        projects *= 2
+    return {"runs": results}
+
+
+def _latency_summary(latencies: List[float]) -> Dict:
+    if not latencies:
+        return {"count": 0}
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max": latencies[-1]
+    }
+
+
+def run_benchmarks(args) -> Dict:
+    with benchmark_tasks(args.task_duration):
+        return {
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "timestamp": time.time()
+            },
+            "parameters": vars(args),
+            "configuration": benchmark_configuration(args),
+            "orchestration_overhead": benchmark_orchestration_overhead(args),
+            "status_polling": benchmark_status_polling(args),
+            "memory": benchmark_memory(args),
+            "scaling": benchmark_scaling(args)
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of HMSE simulation pipeline")
+    parser.add_argument("--steps", type=int, default=50, help="Number of Modflow steps of synthetic project")
+    parser.add_argument("--shapes", type=int, default=10, help="Number of shapes with Hydrus models")
+    parser.add_argument("--weather-mappings", type=int, default=10, help="Number of Hydrus models with weather data")
+    parser.add_argument("--task-duration", type=float, default=0.0,
+                        help="Duration of each task in seconds (0 - no-op tasks)")
+    parser.add_argument("--pollers", type=int, default=4, help="Number of threads polling simulation status")
+    parser.add_argument("--registered-simulations", type=int, default=100,
+                        help="Number of simulations registered for memory measurement")
+    parser.add_argument("--max-projects", type=int, default=16, help="Maximal number of concurrent projects")
+    parser.add_argument("--output", help="File to write JSON results to (stdout by default)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
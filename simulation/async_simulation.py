@@ -0,0 +1,102 @@
+import asyncio
+import inspect
+import time
+from concurrent.futures import Executor
+from functools import partial
+from typing import List, Tuple, Optional
+from .simulation import Simulation
+from .simulation_enums import SimulationStageStatus
+from .simulation_error import SimulationError, SimulationCancelled
+from .simulation_status import ChapterStatus
+from .tasks import hmse_task
+
+
+class AsyncSimulation(Simulation):
+    """
+    Simulation driven by an asyncio event loop. Coroutine tasks (solver stages) are awaited directly, synchronous
+    tasks are bridged to the bridge executor. Stage statuses behave the same as in Simulation.
+    """
+    __CACHE_KEY_POLL_INTERVAL = 0.05
+    # Executor of synchronous tasks, set by AsyncSimulationExecutor (each stage gets a thread of its own otherwise)
+    bridge_executor: Optional[Executor] = None
+
+    def run_simulation(self):
+        asyncio.run(self.run_simulation_async())
+
+    async def run_simulation_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._open_workspace)
+        await loop.run_in_executor(None, self._open_output)
+        try:
+            for chapter_idx in range(self.completed_chapters, len(self.chapter_statuses)):
+                self.cancellation_token.raise_if_cancelled()
+                await self.__run_chapter(chapter_idx)
+                await loop.run_in_executor(None, self._complete_chapter, chapter_idx)
+        except SimulationCancelled:
+            self.cancel_pending_stages()
+            raise
+        await loop.run_in_executor(None, self._complete_simulation)
+
+    async def __run_chapter(self, chapter_idx: int) -> None:
+        stages, dependencies = self._plan_pipeline(chapter_idx)
+        try:
+            await self.task_scheduler.run_async(dependencies, partial(self.__run_pipeline_stage, chapter_idx, stages))
+        except SimulationError:
+            self._roll_back_prefetched_stages(chapter_idx)
+            raise
+
+    async def __run_pipeline_stage(self, chapter_idx: int, stages: List[Tuple[ChapterStatus, int]], i: int) -> None:
+        chapter_status, stage_idx = stages[i]
+        await self.__run_stage(chapter_status.chapter_idx, chapter_status, stage_idx)
+        self._mark_prefetched(chapter_idx, chapter_status, stage_idx)
+
+    async def __run_stage(self, chapter_idx: int, chapter_status: ChapterStatus, stage_idx: int) -> None:
+        loop = asyncio.get_running_loop()
+        workflow_task = chapter_status.plan.tasks[stage_idx]
+        chapter_status.set_stage_status(SimulationStageStatus.RUNNING, stage_idx=stage_idx)
+
+        try:
+            cache_key = await loop.run_in_executor(None, self._get_cache_key, workflow_task, chapter_idx)
+            # Key is polled, so waiting stages don't occupy threads needed by the stage holding it
+            while not self._acquire_cache_key(cache_key, blocking=False):
+                self.cancellation_token.raise_if_cancelled()
+                await asyncio.sleep(self.__CACHE_KEY_POLL_INTERVAL)
+        except Exception as error:
+            self._fail_stage(chapter_status, stage_idx, error)
+        try:
+            if await loop.run_in_executor(None, self._restore_cached_stage,
+                                          cache_key, workflow_task, chapter_status, stage_idx):
+                return
+
+            # Launch and monitor stage
+            with self._stage_context(chapter_status, stage_idx):
+                demand = None
+                if self.resource_scheduler is not None:
+                    # Admission is polled as well, so waiting stages don't occupy bridge threads
+                    waiting_since = time.monotonic()
+                    while (demand := self._acquire_stage_resources(chapter_status, stage_idx, waiting_since,
+                                                                   blocking=False)) is None:
+                        hmse_task.check_cancelled()
+                        await asyncio.sleep(self.__CACHE_KEY_POLL_INTERVAL)
+                # Time limit counts from admission, waiting for resources doesn't time the stage out
+                with self._stage_cancellation(chapter_status, stage_idx):
+                    if inspect.iscoroutinefunction(hmse_task.resolve_task(workflow_task)):
+                        # Task copies the context, so the coroutine reports progress and metrics of this stage
+                        stage_run = asyncio.ensure_future(workflow_task(self.project_metadata))
+                    else:
+                        stage_run = hmse_task.start_stage(workflow_task, self.project_metadata, self.bridge_executor)
+                    succeeded = False
+                    try:
+                        await hmse_task.await_stage_async(stage_run)
+                        await loop.run_in_executor(None, self._check_workspace_quota)
+                        succeeded = True
+                    finally:
+                        self._release_stopped_stage_resources(stage_run, demand, chapter_status, stage_idx,
+                                                              succeeded)
+
+            await loop.run_in_executor(None, self._complete_stage,
+                                       cache_key, workflow_task, chapter_status, stage_idx)
+        except Exception as error:
+            self._fail_stage(chapter_status, stage_idx, error)
+        finally:
+            self._release_cache_key(cache_key)
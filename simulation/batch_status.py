@@ -0,0 +1,78 @@
+from collections import Counter
+from dataclasses import dataclass
+from typing import List
+
+from .simulation import Simulation
+from .simulation_enums import SimulationStageStatus
+from ..hmse_projects.typing_help import ProjectID
+
+
+@dataclass
+class ProjectProgress:
+    project_id: ProjectID
+    status: SimulationStageStatus
+    completed_stages: int
+    total_stages: int
+    deduplicated_stages: int
+
+    def to_json(self):
+        return {
+            "project_id": self.project_id,
+            "status": self.status,
+            "completed_stages": self.completed_stages,
+            "total_stages": self.total_stages,
+            "deduplicated_stages": self.deduplicated_stages
+        }
+
+
+class BatchStatus:
+    """
+    Progress of a batch of simulations. Deduplicated stages are the ones whose outputs were restored
+    from result cache instead of being executed, while another project of the batch has a stage with the same
+    cache key (cache hits of outputs of unrelated simulations are not counted).
+    """
+
+    def __init__(self, batch_id: str, simulations: List[Simulation]):
+        self.batch_id = batch_id
+        # Number of projects of the batch with a stage of each cache key
+        key_projects = Counter(cache_key for simulation in simulations
+                               for cache_key in set(simulation.status_store.cache_keys.values()))
+        self.projects = [BatchStatus.__get_project_progress(simulation, key_projects) for simulation in simulations]
+
+    def get_finished_projects(self) -> int:
+        return sum(1 for project in self.projects if project.status.is_finished())
+
+    def get_failed_projects(self) -> int:
+        return sum(1 for project in self.projects
+                   if project.status in (SimulationStageStatus.ERROR, SimulationStageStatus.TIMED_OUT))
+
+    def to_json(self):
+        return {
+            "batch_id": self.batch_id,
+            "total_projects": len(self.projects),
+            "finished_projects": self.get_finished_projects(),
+            "failed_projects": self.get_failed_projects(),
+            "completed_stages": sum(project.completed_stages for project in self.projects),
+            "total_stages": sum(project.total_stages for project in self.projects),
+            "deduplicated_stages": sum(project.deduplicated_stages for project in self.projects),
+            "projects": [project.to_json() for project in self.projects]
+        }
+
+    @staticmethod
+    def __get_project_progress(simulation: Simulation, key_projects: Counter) -> ProjectProgress:
+        store = simulation.status_store
+        completed = store.count_status(SimulationStageStatus.SUCCESS)
+        total = len(store.codes)
+        failed = [failed_status for failed_status in (SimulationStageStatus.ERROR, SimulationStageStatus.TIMED_OUT,
+                                                      SimulationStageStatus.CANCELLED)
+                  if store.count_status(failed_status) > 0]
+        if failed:
+            status = failed[0]
+        elif completed == total:
+            status = SimulationStageStatus.SUCCESS
+        elif completed > 0 or store.count_status(SimulationStageStatus.RUNNING) > 0:
+            status = SimulationStageStatus.RUNNING
+        else:
+            status = SimulationStageStatus.PENDING
+        deduplicated = sum(1 for position in store.cached if key_projects[store.cache_keys.get(position)] > 1)
+        return ProjectProgress(simulation.project_metadata.project_id, status, completed, total, deduplicated)
@@ -0,0 +1,50 @@
+import threading
+from typing import Optional
+
+from .simulation_error import SimulationCancelled
+
+# Interval of checking cancellation while waiting for sub-tasks and coroutine stages
+CANCELLATION_POLL_INTERVAL = 0.5
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation of a simulation. Stages are not interrupted from outside, running tasks check the token
+    between units of work (see hmse_task.check_cancelled) and stop by raising SimulationCancelled.
+    """
+
+    def __init__(self, event=None, reason: Optional[str] = None):
+        """
+        @param event: Event set on cancellation, threading.Event by default
+        @param reason: Description of SimulationCancelled raised by cancelled tasks
+        """
+        self.reason = reason
+        self.__event = event or threading.Event()
+        self.__lock = threading.Lock()
+
+    def __reduce__(self):
+        # Only events shared between processes (see share_with_processes) reach copies in other processes
+        return CancellationToken, (self.__event, self.reason)
+
+    def cancel(self, reason: Optional[str] = None) -> None:
+        with self.__lock:
+            if not self.__event.is_set():
+                self.reason = reason
+                self.__event.set()
+
+    def is_cancelled(self) -> bool:
+        return self.__event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self.__event.is_set():
+            raise SimulationCancelled(description=self.reason or SimulationCancelled.description)
+
+    def share_with_processes(self, event) -> None:
+        """
+        Replace the event with one shared between processes (e.g. created by multiprocessing Manager),
+        so the token sent to a worker process is cancelled along with this one.
+        """
+        with self.__lock:
+            if self.__event.is_set():
+                event.set()
+            self.__event = event
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import uuid
+from enum import auto
+from typing import Callable, Optional
+
+import numpy as np
+from strenum import StrEnum
+
+from .tasks import hmse_task
+
+__DIGEST_CHUNK_SIZE = 1024 * 1024
+
+class ExchangeArray(StrEnum):
+    """
+    Kinds of arrays passed between Hydrus and Modflow stages.
+    """
+    # Bottom flux of each zone's Hydrus model (per time step), written by Hydrus -> Modflow passing
+    ZONE_RECHARGE = auto()
+    # Recharge of Modflow grid cells (per time step), computed from zone recharge
+    GRID_RECHARGE = auto()
+    # Modflow heads of a layer (rows x cols), written by Modflow -> Hydrus passing
+    LAYER_HEADS = auto()
+    # Water table depth of each zone, used to set initial conditions of per zone Hydrus models
+    ZONE_WATER_TABLE = auto()
+
+
+class CouplingExchange:
+    """
+    Binary exchange of coupling data between Hydrus and Modflow stages of a project. Each array (of a zone
+    or a layer) is kept as a .npy file which is memory-mapped when read, so passing stages don't parse and
+    serialize text model files on every feedback iteration. Text files are materialized only when a solver
+    needs them (see materialize).
+    """
+
+    def __init__(self, exchange_dir: str):
+        """
+        @param exchange_dir: Directory of the exchanged arrays (e.g. inside project's simulation directory)
+        """
+        self.exchange_dir = exchange_dir
+        os.makedirs(exchange_dir, exist_ok=True)
+
+    def get_path(self, kind: ExchangeArray, key: str) -> str:
+        return os.path.join(self.exchange_dir, f"{kind}-{key}.npy")
+
+    def has_array(self, kind: ExchangeArray, key: str) -> bool:
+        return os.path.exists(self.get_path(kind, key))
+
+    def write_array(self, kind: ExchangeArray, key: str, array: np.ndarray) -> None:
+        """
+        Store an array atomically, readers never see a partially written file.
+        @param key: ID of the zone (shape) or number of the layer
+        """
+        path = self.get_path(kind, key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        mapped = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=array.dtype, shape=array.shape)
+        try:
+            mapped[...] = array
+            mapped.flush()
+        finally:
+            del mapped
+        os.replace(tmp_path, path)
+
+    def read_array(self, kind: ExchangeArray, key: str) -> np.ndarray:
+        """
+        @return: Read-only array memory-mapped from the exchange file (data is loaded lazily on access)
+        """
+        return np.load(self.get_path(kind, key), mmap_mode="r")
+
+    def materialize(self, kind: ExchangeArray, key: str, target_path: str,
+                    writer: Callable[[np.ndarray, str], None]) -> bool:
+        """
+        Write model file (e.g. Modflow RCH package or Hydrus profile) from an exchanged array, unless the file
+        was already written from the same array. Digest of the array the file was written from is kept next to it
+        (timestamps can't tell, arrays restored from the result cache or cloned to a workspace keep old ones).
+        Called by solver stages right before the solver runs.
+        @param writer: Function serializing the array to given path in the solver's text format
+        @return: Whether the file was written
+        """
+        digest = _digest_file(self.get_path(kind, key))
+        digest_path = f"{target_path}.sha256"
+        if os.path.exists(target_path) and _read_digest(digest_path) == digest:
+            return False
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+        writer(self.read_array(kind, key), tmp_path)
+        os.replace(tmp_path, target_path)
+        # Digest is written last, a file interrupted before that is written again
+        with open(digest_path, "w") as f:
+            f.write(digest)
+        return True
+
+
+def get_stage_exchange() -> Optional[CouplingExchange]:
+    """
+    @return: Exchange of the chapter of the executed stage, None if the stage runs apart from its simulation
+    """
+    exchange_dir = hmse_task.get_stage_exchange_dir()
+    return CouplingExchange(exchange_dir) if exchange_dir is not None else None
+
+
+def _digest_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(__DIGEST_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _read_digest(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def zone_recharge_to_grid(zone_masks: np.ndarray, zone_recharge: np.ndarray,
+                          default_recharge: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Spread recharge of zones over Modflow grid cells covered by them.
+    @param zone_masks: Boolean masks of zones over the grid (zones x rows x cols)
+    @param zone_recharge: Recharge of each zone (zones) or of each zone in each time step (zones x steps)
+    @param default_recharge: Recharge of cells outside all zones (rows x cols or steps x rows x cols), 0 if not given
+    @return: Grid recharge (rows x cols or steps x rows x cols), cells covered by more zones get their sum
+    """
+    masks = zone_masks.astype(zone_recharge.dtype, copy=False)
+    # Sum over zones of recharge of the zone times its mask, in a single BLAS call
+    grid = np.tensordot(zone_recharge, masks, axes=([0], [0]))
+    if default_recharge is not None:
+        covered = zone_masks.any(axis=0)
+        grid = np.where(covered, grid, default_recharge)
+    return grid
+
+
+def grid_heads_to_zone_water_table(zone_masks: np.ndarray, heads: np.ndarray, surface: np.ndarray,
+                                   hdry: float = -1e30, hnoflo: float = -999.99) -> np.ndarray:
+    """
+    Compute water table depth of each zone as the mean depth below surface of the zone's cells.
+    @param zone_masks: Boolean masks of zones over the grid (zones x rows x cols)
+    @param heads: Modflow heads of the top layer (rows x cols)
+    @param surface: Elevation of the top of the top layer (rows x cols)
+    @param hdry: Head of dry cells (HDRY of the Modflow model), such cells are not included in the mean
+    @param hnoflo: Head of inactive cells (HNOFLO of the Modflow model), such cells are not included in the mean
+    @return: Water table depth of each zone, NaN for zones without active cells
+    """
+    # Heads are compared with tolerance, they may be stored in single precision
+    active = np.isfinite(heads) & ~np.isclose(heads, hdry, rtol=1e-6, atol=0.0) \
+        & ~np.isclose(heads, hnoflo, rtol=1e-6, atol=0.0)
+    masks = zone_masks & active
+    depth = np.where(active, surface - heads, 0.0)
+    cells = masks.sum(axis=(1, 2))
+    depth_sums = np.tensordot(masks.astype(depth.dtype, copy=False), depth, axes=([1, 2], [0, 1]))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(cells > 0, depth_sums / cells, np.nan)
@@ -0,0 +1,65 @@
+import time
+import uuid
+from typing import Callable, Optional
+
+from .job_queue import JobQueue, StageJob, StageJobState
+from .simulation import Simulation
+from .simulation_enums import SimulationStageStatus
+from .simulation_error import SimulationError, StageTimedOut
+from .simulation_status import ChapterStatus
+from .tasks import hmse_task
+from ..hmse_projects.project_metadata import ProjectMetadata
+
+
+class DistributedSimulation(Simulation):
+    """
+    Simulation coordinated in the service process, with stages executed by simulation workers pulling jobs
+    from a job queue. Caching, checkpoints and stage statuses are handled the same way as in Simulation.
+    """
+    job_queue: Optional[JobQueue] = None
+    poll_interval: float = 0.5
+    # Workers may run on other hosts than the service, so stages work in the project store instead of
+    # scratch storage local to the service
+    uses_scratch_workspace = False
+
+    def _execute_stage(self, workflow_task: Callable[[ProjectMetadata], None],
+                       chapter_status: ChapterStatus, stage_idx: int) -> None:
+        if self.job_queue is None:
+            raise RuntimeError("Distributed simulation requires a job queue!")
+
+        job = StageJob(job_id=uuid.uuid4().hex,
+                       project_metadata=self.project_metadata,
+                       chapter=chapter_status.chapter,
+                       chapter_idx=chapter_status.chapter_idx,
+                       stage_idx=stage_idx,
+                       task_id=hmse_task.get_task_id(workflow_task),
+                       time_limit=self.stage_timeouts.get(chapter_status.stages[stage_idx]),
+                       output_dir=self.output_writer.output_dir if self.output_writer is not None else None)
+        self.job_queue.put(job)
+        try:
+            with self._stage_cancellation(chapter_status, stage_idx):
+                state = self.__await_job(job, chapter_status)
+        finally:
+            self.job_queue.remove(job.job_id)
+
+        if state.metrics is not None:
+            chapter_status.set_stage_metrics(state.metrics, stage_idx=stage_idx)
+        if state.status == SimulationStageStatus.TIMED_OUT:
+            raise StageTimedOut(description=state.error or StageTimedOut.description)
+        if state.status != SimulationStageStatus.SUCCESS:
+            raise SimulationError(description=state.error or SimulationError.description)
+
+    def __await_job(self, job: StageJob, chapter_status: ChapterStatus) -> StageJobState:
+        progress = (0, 0)
+        while True:
+            state = self.job_queue.get_state(job.job_id)
+            if state is None:
+                raise SimulationError(description=f"Job of stage {chapter_status.stages[job.stage_idx]} was lost!")
+            if state.total_subtasks > 0 and (state.completed_subtasks, state.total_subtasks) != progress:
+                progress = (state.completed_subtasks, state.total_subtasks)
+                chapter_status.set_stage_progress(*progress, stage_idx=job.stage_idx)
+            if state.status.is_finished():
+                return state
+            # Job of a cancelled or timed out stage is removed from the queue, its worker result is ignored
+            hmse_task.check_cancelled()
+            time.sleep(self.poll_interval)
@@ -0,0 +1,188 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from .simulation_chapter import SimulationChapter
+from .simulation_enums import SimulationStageStatus
+from .stage_metrics import StageMetrics
+from ..hmse_projects.project_metadata import ProjectMetadata
+
+
+@dataclass
+class StageJob:
+    """
+    Single stage of a chapter to be executed by a simulation worker.
+    """
+    job_id: str
+    project_metadata: ProjectMetadata
+    chapter: SimulationChapter
+    chapter_idx: int
+    stage_idx: int
+    task_id: str
+    # Wall-clock time limit of the stage in seconds, enforced by the worker as well as by the coordinator
+    time_limit: Optional[float] = None
+    # Directory of incremental output of the simulation (see StepOutputWriter), on storage shared with workers
+    output_dir: Optional[str] = None
+
+
+@dataclass
+class StageJobState:
+    status: SimulationStageStatus
+    completed_subtasks: int = 0
+    total_subtasks: int = 0
+    metrics: Optional[StageMetrics] = None
+    error: Optional[str] = None
+
+
+class JobQueue(ABC):
+    """
+    Queue of stage jobs shared by the coordinator (SimulationService) and stateless simulation workers.
+    Workers scale horizontally when the queue is backed by a message broker shared by many hosts.
+    """
+
+    @abstractmethod
+    def put(self, job: StageJob) -> None:
+        ...
+
+    @abstractmethod
+    def take(self, worker_id: str) -> Optional[StageJob]:
+        """
+        Claim the oldest pending job.
+        @return: Claimed job or None if there are no pending jobs
+        """
+        ...
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str) -> None:
+        """
+        Extend lease of a claimed job, jobs whose lease expires are given to another worker.
+        """
+        ...
+
+    @abstractmethod
+    def report_progress(self, job_id: str, worker_id: str, completed: int, total: int) -> None:
+        ...
+
+    @abstractmethod
+    def finish(self, job_id: str, worker_id: str, status: SimulationStageStatus,
+               metrics: Optional[StageMetrics] = None, error: Optional[str] = None) -> None:
+        """
+        Record result of a job, ignored if the job was meanwhile given to another worker.
+        """
+        ...
+
+    @abstractmethod
+    def get_state(self, job_id: str) -> Optional[StageJobState]:
+        """
+        @return: State of the job or None if there is no such job
+        """
+        ...
+
+    @abstractmethod
+    def remove(self, job_id: str) -> None:
+        ...
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Job queue stored in a SQLite database, shared by processes of a single host (or hosts sharing
+    a local-semantics file system).
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float = 300.0):
+        """
+        @param db_path: Path of the database file, created if necessary
+        @param lease_seconds: Time without heartbeat after which a claimed job is considered abandoned
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.__local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self.__transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                       "job_id TEXT PRIMARY KEY, created_at REAL NOT NULL, payload BLOB NOT NULL, "
+                       "status TEXT NOT NULL, worker_id TEXT, heartbeat_at REAL, "
+                       "completed_subtasks INTEGER NOT NULL DEFAULT 0, total_subtasks INTEGER NOT NULL DEFAULT 0, "
+                       "metrics BLOB, error TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+
+    def __reduce__(self):
+        # Connections are not shared, a copy sent to another process opens its own
+        return SqliteJobQueue, (self.db_path, self.lease_seconds)
+
+    def put(self, job: StageJob) -> None:
+        with self.__transaction() as db:
+            db.execute("INSERT INTO jobs (job_id, created_at, payload, status) VALUES (?, ?, ?, ?)",
+                       (job.job_id, time.time(), pickle.dumps(job), str(SimulationStageStatus.PENDING)))
+
+    def take(self, worker_id: str) -> Optional[StageJob]:
+        now = time.time()
+        with self.__transaction() as db:
+            db.execute("UPDATE jobs SET status = ?, worker_id = NULL WHERE status = ? AND heartbeat_at < ?",
+                       (str(SimulationStageStatus.PENDING), str(SimulationStageStatus.RUNNING),
+                        now - self.lease_seconds))
+            row = db.execute("SELECT job_id, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                             (str(SimulationStageStatus.PENDING),)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = ?, worker_id = ?, heartbeat_at = ? WHERE job_id = ?",
+                       (str(SimulationStageStatus.RUNNING), worker_id, now, row[0]))
+        return pickle.loads(row[1])
+
+    def heartbeat(self, job_id: str, worker_id: str) -> None:
+        with self.__transaction() as db:
+            db.execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND worker_id = ?",
+                       (time.time(), job_id, worker_id))
+
+    def report_progress(self, job_id: str, worker_id: str, completed: int, total: int) -> None:
+        with self.__transaction() as db:
+            db.execute("UPDATE jobs SET completed_subtasks = ?, total_subtasks = ?, heartbeat_at = ? "
+                       "WHERE job_id = ? AND worker_id = ?", (completed, total, time.time(), job_id, worker_id))
+
+    def finish(self, job_id: str, worker_id: str, status: SimulationStageStatus,
+               metrics: Optional[StageMetrics] = None, error: Optional[str] = None) -> None:
+        with self.__transaction() as db:
+            db.execute("UPDATE jobs SET status = ?, metrics = ?, error = ? WHERE job_id = ? AND worker_id = ?",
+                       (str(status), pickle.dumps(metrics) if metrics is not None else None, error,
+                        job_id, worker_id))
+
+    def get_state(self, job_id: str) -> Optional[StageJobState]:
+        row = self.__get_connection().execute(
+            "SELECT status, completed_subtasks, total_subtasks, metrics, error FROM jobs WHERE job_id = ?",
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, completed, total, metrics, error = row
+        return StageJobState(SimulationStageStatus(status), completed, total,
+                             pickle.loads(metrics) if metrics is not None else None, error)
+
+    def remove(self, job_id: str) -> None:
+        with self.__transaction() as db:
+            db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def __get_connection(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared between threads
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.__local.connection = connection
+        return connection
+
+    @contextmanager
+    def __transaction(self):
+        db = self.__get_connection()
+        # Write lock is taken upfront, so concurrent workers never claim the same job
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
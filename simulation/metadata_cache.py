@@ -0,0 +1,168 @@
+import atexit
+import copy
+import logging
+import os
+import time
+from threading import Condition, Thread
+from typing import Dict, Optional, Tuple
+
+from ..hmse_projects.project_metadata import ProjectMetadata
+from ..hmse_projects.typing_help import ProjectID
+
+# Maximal time of waiting for pending writes when the process exits
+EXIT_FLUSH_TIMEOUT = 30.0
+
+
+class MetadataWriteBehindCache:
+    """
+    Write-behind cache in front of project_dao. Saved metadata is kept in memory and written to the project store
+    by a background thread, so simulation threads never wait for metadata I/O. Repeated saves of a project
+    between flushes are coalesced into a single write of its latest version.
+    """
+
+    def __init__(self, dao=None, flush_interval: float = 1.0):
+        """
+        @param dao: Project store with read_metadata and save_or_update_metadata methods (project_dao by default,
+                    imported on first use)
+        @param flush_interval: Maximal time between saving metadata and writing it to the project store
+        """
+        self.dao = dao
+        self.flush_interval = flush_interval
+        self.__metadata: Dict[ProjectID, ProjectMetadata] = {}
+        self.__dirty: Dict[ProjectID, float] = {}
+        # Number of saves of each project, and of them the last one written and the last one attempted to write
+        self.__versions: Dict[ProjectID, int] = {}
+        self.__written: Dict[ProjectID, int] = {}
+        self.__attempted: Dict[ProjectID, int] = {}
+        self.__urgent = False
+        self.__flushing = 0
+        self.__condition = Condition()
+        self.__thread: Optional[Thread] = None
+        if hasattr(os, "register_at_fork"):  # Not available on Windows, where workers are spawned
+            os.register_at_fork(after_in_child=self.__reset_after_fork)
+
+    def get(self, project_id: ProjectID) -> Optional[ProjectMetadata]:
+        """
+        @return: Latest saved metadata of the project (also if not written yet) or None if it was not saved
+        """
+        with self.__condition:
+            return self.__metadata.get(project_id)
+
+    def load(self, project_id: ProjectID) -> ProjectMetadata:
+        """
+        Read metadata of the project through the cache: latest saved metadata if it was saved by this process,
+        otherwise it is read from the project store.
+        @return: Copy of the metadata, changes of it are not saved
+        """
+        metadata = self.get(project_id)
+        if metadata is not None:
+            return copy.deepcopy(metadata)
+        self.__ensure_dao()
+        return self.dao.read_metadata(project_id)
+
+    def save(self, metadata: ProjectMetadata, flush: bool = False, timeout: Optional[float] = None) -> bool:
+        """
+        Save metadata, without waiting for the project store unless flush is requested.
+        @param metadata: Metadata to save, it is copied, so further changes of it are not saved
+        @param flush: Whether to write it right away instead of after flush_interval and wait until the write
+                      completes (e.g. simulation finished). Write of the dao itself is not atomic.
+        @param timeout: Maximal time of waiting for the write
+        @return: Whether the metadata was written, when flush is requested (failed write is retried later)
+        """
+        snapshot = copy.deepcopy(metadata)
+        project_id = snapshot.project_id
+        with self.__condition:
+            self.__metadata[project_id] = snapshot
+            self.__dirty.setdefault(project_id, time.monotonic())
+            version = self.__versions[project_id] = self.__versions.get(project_id, 0) + 1
+            self.__urgent = self.__urgent or flush
+            self.__ensure_thread()
+            self.__condition.notify_all()
+            if not flush:
+                return False
+            self.__condition.wait_for(lambda: self.__attempted.get(project_id, 0) >= version, timeout)
+            return self.__written.get(project_id, 0) >= version
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Write all saved metadata and wait until it is written (e.g. on shutdown).
+        @return: Whether everything was written within timeout
+        """
+        with self.__condition:
+            if self.__thread is None:
+                return not self.__dirty
+            self.__urgent = True
+            self.__condition.notify_all()
+            return self.__condition.wait_for(lambda: not self.__dirty and not self.__flushing, timeout)
+
+    def __reset_after_fork(self) -> None:
+        # Forked process (e.g. process backend worker) inherits state of the cache, but not its writing thread.
+        # Metadata pending in the parent is written by the parent.
+        self.__metadata = {}
+        self.__dirty = {}
+        self.__versions = {}
+        self.__written = {}
+        self.__attempted = {}
+        self.__urgent = False
+        self.__flushing = 0
+        self.__condition = Condition()
+        self.__thread = None
+
+    def __ensure_thread(self) -> None:
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__thread = Thread(target=self.__run, name="metadata-write-behind", daemon=True)
+            self.__thread.start()
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(self.__has_due_writes, self.__get_wait_time())
+                if not self.__has_due_writes():
+                    continue
+                batch = {project_id: (self.__metadata[project_id], self.__versions[project_id])
+                         for project_id in self.__dirty}
+                self.__dirty.clear()
+                self.__urgent = False
+                self.__flushing += 1
+            try:
+                self.__write(batch)
+            finally:
+                with self.__condition:
+                    self.__flushing -= 1
+                    self.__condition.notify_all()
+
+    def __write(self, batch: Dict[ProjectID, Tuple[ProjectMetadata, int]]) -> None:
+        self.__ensure_dao()
+        for project_id, (metadata, version) in batch.items():
+            try:
+                self.dao.save_or_update_metadata(metadata)
+                written = True
+            except Exception as error:
+                logging.error(f"Saving metadata of project {project_id} failed, it will be retried: {error}")
+                written = False
+            with self.__condition:
+                if written:
+                    self.__written[project_id] = max(self.__written.get(project_id, 0), version)
+                else:
+                    self.__dirty.setdefault(project_id, time.monotonic())
+                self.__attempted[project_id] = max(self.__attempted.get(project_id, 0), version)
+                self.__condition.notify_all()
+
+    def __ensure_dao(self) -> None:
+        if self.dao is None:
+            from ..hmse_projects.project_dao import project_dao
+            self.dao = project_dao
+
+    def __has_due_writes(self) -> bool:
+        if not self.__dirty:
+            return False
+        return self.__urgent or time.monotonic() - min(self.__dirty.values()) >= self.flush_interval
+
+    def __get_wait_time(self) -> Optional[float]:
+        if not self.__dirty:
+            return None
+        return max(self.flush_interval - (time.monotonic() - min(self.__dirty.values())), 0.0)
+
+
+metadata_cache = MetadataWriteBehindCache()
+atexit.register(metadata_cache.flush, EXIT_FLUSH_TIMEOUT)
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+STEPS_FILE_NAME = "steps.jsonl"
+INDEX_FILE_NAME = "index.json"
+# File in project's output directory with ID of the run whose output is current (see StepOutputWriter.publish)
+CURRENT_RUN_FILE_NAME = "current_run"
+
+
+def get_run_output_dir(output_dir: str, project_id: str, run_id: str) -> str:
+    """
+    @return: Directory of incremental output of a single run of the project's simulation in the configured
+             output directory
+    """
+    return os.path.join(output_dir, project_id, run_id)
+
+
+def get_current_output_dir(output_dir: str, project_id: str) -> Optional[str]:
+    """
+    @return: Directory of output of the last published run of the project's simulation, None if there is none
+    """
+    project_dir = os.path.join(output_dir, project_id)
+    run_id = _read_current_run(project_dir)
+    return os.path.join(project_dir, run_id) if run_id is not None else None
+
+
+class StepOutputWriter:
+    """
+    Incremental JSON output of a simulation. Results of each simulation step are appended as a single line
+    of a JSON-lines file as soon as the step (feedback iteration) finishes, so memory used by the extraction
+    is bounded by one step and results can be read while the simulation runs. The final stage only writes
+    an index of step offsets (see finalize).
+    Each run of a simulation writes to its own directory (see get_run_output_dir), so a run which is still
+    stopping can't append to (or finalize) output of the run replacing it; its writes are dropped instead.
+    """
+
+    def __init__(self, output_dir: str):
+        """
+        @param output_dir: Directory of output of the simulation run, named by ID of the run
+        """
+        self.output_dir = output_dir
+        self.run_id = os.path.basename(output_dir)
+        self.project_dir = os.path.dirname(output_dir)
+        self.steps_path = os.path.join(output_dir, STEPS_FILE_NAME)
+        self.index_path = os.path.join(output_dir, INDEX_FILE_NAME)
+        os.makedirs(output_dir, exist_ok=True)
+
+    def publish(self) -> None:
+        """
+        Make output of the run current output of the project (see get_current_output_dir) and remove output
+        of previous runs, called when the simulation starts or is resumed. Writers of previous runs are fenced
+        off from then on.
+        """
+        current_path = os.path.join(self.project_dir, CURRENT_RUN_FILE_NAME)
+        tmp_path = f"{current_path}.{self.run_id}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.run_id)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, current_path)
+        for entry in os.scandir(self.project_dir):
+            if entry.is_dir() and entry.name != self.run_id:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def is_current(self) -> bool:
+        """
+        @return: Whether the run was not replaced by another run of the project
+        """
+        return _read_current_run(self.project_dir) in (self.run_id, None)
+
+    def append_step(self, step_idx: int, results: Dict[str, Any]) -> None:
+        """
+        Append results of a step. Step written again (e.g. after resuming from a checkpoint) replaces
+        its previous results when read.
+        @param step_idx: Index of the simulation step (chapter)
+        @param results: JSON serializable results of the step
+        """
+        if not self.__check_current():
+            return
+        line = json.dumps({"step": step_idx, "results": results}, separators=(",", ":")) + "\n"
+        try:
+            with open(self.steps_path, "ab") as f:
+                # Line left incomplete by a crash is dropped, so it doesn't corrupt the appended one
+                complete_size = _get_complete_size(self.steps_path)
+                if complete_size != f.tell():
+                    f.truncate(complete_size)
+                    f.seek(complete_size)
+                f.write(line.encode())
+                f.flush()
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            # Output directory was removed by a run which has just replaced this one
+            if self.__check_current():
+                raise
+            return
+        if os.path.isfile(self.index_path):
+            os.remove(self.index_path)
+
+    def get_written_steps(self) -> Set[int]:
+        """
+        @return: Indices of steps whose results were appended (completely)
+        """
+        return {step_idx for step_idx, _, _ in _iter_lines(self.steps_path)}
+
+    def finalize(self, summary: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Write index of the output: offset of the last results of each step and optional summary of the run.
+        Index is replaced atomically.
+        """
+        if not self.__check_current():
+            return
+        offsets = {step_idx: offset for step_idx, offset, _ in _iter_lines(self.steps_path)}
+        index = {
+            "steps_file": STEPS_FILE_NAME,
+            "steps": [{"step": step_idx, "offset": offsets[step_idx]} for step_idx in sorted(offsets)],
+            "summary": summary
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+        except FileNotFoundError:
+            if self.__check_current():
+                raise
+
+    def __check_current(self) -> bool:
+        if self.is_current():
+            return True
+        logging.warning(f"Output of run {self.run_id} was replaced by another run, its results are dropped")
+        return False
+
+
+def read_steps(output_dir: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Read results of steps written so far, one step at a time (also while the simulation is still running).
+    @return: Step index and results, in order of steps; only the last results of a step written more times
+    """
+    steps_path = os.path.join(output_dir, STEPS_FILE_NAME)
+    offsets = {step_idx: offset for step_idx, offset, _ in _iter_lines(steps_path)}
+    if not offsets:
+        return
+    with open(steps_path, "rb") as f:
+        for step_idx in sorted(offsets):
+            f.seek(offsets[step_idx])
+            yield step_idx, json.loads(f.readline())["results"]
+
+
+def read_step(output_dir: str, step_idx: int) -> Optional[Dict[str, Any]]:
+    """
+    Read results of a single step, using the index if the output is finalized.
+    @return: Results of the step or None if it was not written yet
+    """
+    index_path = os.path.join(output_dir, INDEX_FILE_NAME)
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            offsets = {step["step"]: step["offset"] for step in json.load(f)["steps"]}
+        if step_idx not in offsets:
+            return None
+        with open(os.path.join(output_dir, STEPS_FILE_NAME), "rb") as f:
+            f.seek(offsets[step_idx])
+            return json.loads(f.readline())["results"]
+    return next((results for idx, results in read_steps(output_dir) if idx == step_idx), None)
+
+
+def _read_current_run(project_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(project_dir, CURRENT_RUN_FILE_NAME)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _iter_lines(steps_path: str) -> Iterator[Tuple[int, int, int]]:
+    """
+    @return: Step index, offset and length of each complete line (only its header is parsed)
+    """
+    if not os.path.isfile(steps_path):
+        return
+    with open(steps_path, "rb") as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            # Lines start with '{"step":<idx>,', so results don't have to be parsed
+            header_end = line.index(b",")
+            yield int(line[len(b'{"step":'):header_end]), offset, len(line)
+            offset += len(line)
+
+
+def _get_complete_size(steps_path: str, chunk_size: int = 64 * 1024) -> int:
+    """
+    @return: Size of the file up to (and including) its last line break
+    """
+    with open(steps_path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - chunk_size, 0)
+            f.seek(start)
+            last_break = f.read(end - start).rfind(b"\n")
+            if last_break >= 0:
+                return start + last_break + 1
+            end = start
+    return 0
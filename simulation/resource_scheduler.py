@@ -0,0 +1,247 @@
+import atexit
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from threading import Condition
+from typing import Dict, Optional, List, Tuple
+
+from .simulation_enums import SimulationStageName, SimulationStage
+from .simulation_status import ChapterStatus
+
+
+@dataclass
+class StageDemand:
+    """
+    Resources needed by a stage: CPU cores, memory and wall-clock duration.
+    """
+    cpus: float
+    memory_bytes: int
+    duration: float
+
+    def to_json(self):
+        return {
+            "cpus": self.cpus,
+            "memory_bytes": self.memory_bytes,
+            "duration": self.duration
+        }
+
+
+DEFAULT_STAGE_DEMAND = StageDemand(cpus=1.0, memory_bytes=256 * 1024 ** 2, duration=1.0)
+
+
+class StageHistory:
+    """
+    Learned resource demand of each stage kind, exponentially weighted average of measured executions.
+    Stages without history use configured (or default) demand.
+    """
+
+    def __init__(self, smoothing: float = 0.3, initial_demands: Optional[Dict[SimulationStageName, StageDemand]] = None,
+                 history_path: Optional[str] = None, save_interval: float = 30.0):
+        """
+        @param smoothing: Weight of the latest execution in the average
+        @param initial_demands: Demand of stages before they are measured (e.g. Hydrus warmup needs lots of memory)
+        @param history_path: JSON file the history is loaded from and saved to, so it survives restarts
+        @param save_interval: Minimal time between writes of the history file, changes are saved in batches
+        """
+        self.smoothing = smoothing
+        self.initial_demands = initial_demands or {}
+        self.history_path = history_path
+        self.save_interval = save_interval
+        self.__demands: Dict[SimulationStageName, StageDemand] = {}
+        self.__unsaved = False
+        self.__last_save = time.monotonic()
+        if history_path is not None:
+            if os.path.isfile(history_path):
+                self.__load()
+            # Changes made since the last write are saved when the service exits
+            atexit.register(self.save, True)
+
+    def estimate(self, stage_name: SimulationStageName) -> StageDemand:
+        return self.__demands.get(stage_name) or self.initial_demands.get(stage_name) or DEFAULT_STAGE_DEMAND
+
+    def record(self, stage: SimulationStage, max_cpus: float) -> None:
+        """
+        Add measured execution of a stage to its history.
+        @param max_cpus: Number of cores the stage could use (sub-tasks beyond it wait for a core)
+        """
+        metrics = stage.metrics
+        if metrics is None or metrics.wall_time <= 0:
+            return
+        # CPU time of sub-tasks running in other processes is not measured, each running sub-task takes a core
+        cpus = max(metrics.cpu_time / metrics.wall_time, min(stage.total_subtasks, max_cpus), 1.0)
+        # Memory which could not be measured keeps its learned (or configured) estimate
+        memory_bytes = metrics.memory_bytes if metrics.memory_bytes is not None \
+            else self.estimate(stage.name).memory_bytes
+        measured = StageDemand(cpus=cpus, memory_bytes=memory_bytes, duration=metrics.wall_time)
+        previous = self.__demands.get(stage.name)
+        if previous is not None:
+            weight = self.smoothing
+            measured = StageDemand(cpus=weight * measured.cpus + (1 - weight) * previous.cpus,
+                                   memory_bytes=int(weight * measured.memory_bytes
+                                                    + (1 - weight) * previous.memory_bytes),
+                                   duration=weight * measured.duration + (1 - weight) * previous.duration)
+        self.__demands[stage.name] = measured
+        self.__unsaved = True
+
+    def save(self, force: bool = False) -> None:
+        """
+        Write the history to history_path (replaced atomically), if it changed and save_interval has passed
+        since the last write.
+        @param force: Whether to write changes right away (e.g. on shutdown)
+        """
+        if self.history_path is None or not self.__unsaved:
+            return
+        if not force and time.monotonic() - self.__last_save < self.save_interval:
+            return
+        self.__unsaved = False
+        self.__last_save = time.monotonic()
+        tmp_path = f"{self.history_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({str(name): demand.to_json() for name, demand in dict(self.__demands).items()}, f)
+        os.replace(tmp_path, self.history_path)
+
+    def to_json(self):
+        return {str(name): self.estimate(name).to_json() for name in SimulationStageName}
+
+    def __load(self) -> None:
+        with open(self.history_path) as f:
+            stored = json.load(f)
+        known_names = {str(name) for name in SimulationStageName}
+        self.__demands = {SimulationStageName(name): StageDemand(**demand) for name, demand in stored.items()
+                          if name in known_names}
+
+
+class ResourceAwareScheduler:
+    """
+    Admits stages of all simulations of the service so that their estimated demand (see StageHistory) fits
+    into CPU and memory budgets of the node. Small stages may overtake a waiting large one, unless it has
+    waited longer than max_overtake_time. Stage is always admitted when nothing else runs, even if it exceeds
+    the budget.
+    """
+
+    def __init__(self, cpu_budget: Optional[float] = None, memory_budget_bytes: Optional[int] = None,
+                 history: Optional[StageHistory] = None, max_overtake_time: float = 30.0):
+        """
+        @param cpu_budget: Number of cores stages can use (number of CPUs by default)
+        @param memory_budget_bytes: Memory stages can use (physical memory by default)
+        @param history: Learned demand of stages
+        @param max_overtake_time: Time after which a waiting stage can't be overtaken by stages admitted later
+        """
+        self.cpu_budget = cpu_budget or float(os.cpu_count() or 1)
+        self.memory_budget_bytes = memory_budget_bytes or _get_physical_memory()
+        self.history = history or StageHistory()
+        self.max_overtake_time = max_overtake_time
+        self.__used_cpus = 0.0
+        self.__used_memory = 0
+        self.__running = 0
+        self.__waiting: Dict[int, float] = {}
+        self.__next_ticket = 0
+        self.__condition = Condition()
+
+    def __reduce__(self):
+        # Budget is accounted per process, a copy sent to another process starts with nothing running
+        return ResourceAwareScheduler, (self.cpu_budget, self.memory_budget_bytes, self.history,
+                                        self.max_overtake_time)
+
+    def acquire(self, stage_name: SimulationStageName, blocking: bool = True, timeout: Optional[float] = None,
+                waiting_since: Optional[float] = None) -> Optional[StageDemand]:
+        """
+        Wait until the stage fits into the budgets and reserve its estimated demand.
+        Must be followed by release if acquired.
+        @param blocking: Whether to wait or return immediately if the stage doesn't fit
+        @param timeout: Maximal time of waiting (None for no limit)
+        @param waiting_since: time.monotonic() when the stage started waiting, if acquire is retried
+        @return: Reserved demand or None if the stage was not admitted
+        """
+        demand = self.history.estimate(stage_name)
+        with self.__condition:
+            ticket = self.__next_ticket
+            self.__next_ticket += 1
+            self.__waiting[ticket] = waiting_since if waiting_since is not None else time.monotonic()
+            try:
+                admitted = self.__condition.wait_for(lambda: self.__can_admit(ticket, demand),
+                                                     timeout if blocking else 0)
+                if not admitted:
+                    return None
+                self.__used_cpus += demand.cpus
+                self.__used_memory += demand.memory_bytes
+                self.__running += 1
+                return demand
+            finally:
+                del self.__waiting[ticket]
+                self.__condition.notify_all()
+
+    def release(self, demand: StageDemand, stage: Optional[SimulationStage] = None) -> None:
+        """
+        Return demand reserved by acquire.
+        @param stage: Finished stage whose measured metrics are added to the history (None if it failed)
+        """
+        with self.__condition:
+            self.__used_cpus -= demand.cpus
+            self.__used_memory -= demand.memory_bytes
+            self.__running -= 1
+            if stage is not None:
+                self.history.record(stage, self.cpu_budget)
+            self.__condition.notify_all()
+        if stage is not None:
+            self.history.save()
+
+    def get_usage(self):
+        with self.__condition:
+            return {
+                "cpu_budget": self.cpu_budget,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "used_cpus": self.__used_cpus,
+                "used_memory_bytes": self.__used_memory,
+                "running_stages": self.__running,
+                "waiting_stages": len(self.__waiting)
+            }
+
+    def estimate_chapters(self, chapter_statuses: List[ChapterStatus]) -> List[Tuple[float, float]]:
+        """
+        Estimate remaining time of each chapter from learned stage durations. Chapter takes as long as the longest
+        path of its unfinished stages in the dependency graph, chapters run one after another.
+        @return: Remaining time of each chapter and time (since now) when it is expected to finish
+        """
+        estimates = []
+        finish_in = 0.0
+        for chapter_status in chapter_statuses:
+            stages = chapter_status.get_stages_statuses()
+            path_times: List[float] = []
+            for stage_idx, stage in enumerate(stages):
+                remaining = self.__estimate_remaining(stage)
+                dependencies = chapter_status.plan.dependencies[stage_idx]
+                path_times.append(remaining + max((path_times[dep] for dep in dependencies), default=0.0))
+            remaining = max(path_times, default=0.0)
+            finish_in += remaining
+            estimates.append((remaining, finish_in))
+        return estimates
+
+    def __estimate_remaining(self, stage: SimulationStage) -> float:
+        if stage.status.is_finished():
+            return 0.0
+        duration = self.history.estimate(stage.name).duration
+        if stage.total_subtasks > 0:
+            duration *= 1 - stage.completed_subtasks / stage.total_subtasks
+        return duration
+
+    def __can_admit(self, ticket: int, demand: StageDemand) -> bool:
+        if self.__running == 0:
+            return True
+        now = time.monotonic()
+        own_waiting_since = self.__waiting[ticket]
+        # Stage waiting too long reserves the budget, stages which started waiting later don't overtake it
+        if any(waiting_since < own_waiting_since and now - waiting_since > self.max_overtake_time
+               for waiting_since in self.__waiting.values()):
+            return False
+        return self.__used_cpus + demand.cpus <= self.cpu_budget and \
+            self.__used_memory + demand.memory_bytes <= self.memory_budget_bytes
+
+
+def _get_physical_memory() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):  # Windows (desktop deployment)
+        return 8 * 1024 ** 3
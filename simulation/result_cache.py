@@ -0,0 +1,264 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from enum import Enum
+from typing import Callable, List, Optional, Dict, Tuple
+
+from .simulation_enums import SimulationResource
+from .tasks import hmse_task
+from ..hmse_projects.project_metadata import ProjectMetadata
+
+ResourcePathResolver = Callable[[ProjectMetadata, SimulationResource], List[str]]
+
+__DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+class ResultCache:
+    """
+    Content addressed cache of task outputs. Key of a task execution is a hash of the task's metadata fields
+    (declared with hmse_task decorator) and digests of all files of resources read by the task.
+    Files of resources written by the task are stored under that key and restored on cache hit.
+    Size and last use of entries are kept in an index updated by store and restore, so eviction doesn't walk
+    the cache directory.
+    """
+    # Entries written by other processes sharing the cache directory are counted once the index is rebuilt
+    __INDEX_RESCAN_INTERVAL = 300.0
+
+    def __init__(self, cache_dir: str, path_resolver: ResourcePathResolver,
+                 max_size_bytes: int = 10 * 1024 ** 3, max_age_seconds: float = 7 * 24 * 3600):
+        """
+        @param cache_dir: Directory for cached outputs
+        @param path_resolver: Function returning all files/directories of a resource in given project
+        @param max_size_bytes: Total size of cache above which least recently used entries are evicted
+        @param max_age_seconds: Age of entry (since last use) after which it is evicted
+        """
+        self.cache_dir = cache_dir
+        self.path_resolver = path_resolver
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.__key_locks: Dict[str, Tuple[threading.Lock, List[int]]] = {}
+        self.__key_locks_guard = threading.Lock()
+        # Key -> (time of last use, size in bytes), built from the cache directory on first use
+        self.__index: Optional[Dict[str, Tuple[float, int]]] = None
+        self.__index_scanned_at = 0.0
+        self.__index_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __reduce__(self):
+        # Key locks are not shared with other processes, a copy sent to another process has its own
+        return ResultCache, (self.cache_dir, self.path_resolver, self.max_size_bytes, self.max_age_seconds)
+
+    def acquire_key(self, key: str, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until no other simulation in this process computes output for the key, so identical stages
+        of concurrently running projects (e.g. of a batch) are executed once and restored by the others.
+        Must be followed by release_key if acquired.
+        @param blocking: Whether to wait for the key or return immediately if it is taken
+        @param timeout: Longest time (in seconds) to wait for the key if blocking, None for no limit
+        @return: Whether the key was acquired
+        """
+        with self.__key_locks_guard:
+            lock, users = self.__key_locks.setdefault(key, (threading.Lock(), [0]))
+            users[0] += 1
+        if lock.acquire(blocking, timeout if blocking and timeout is not None else -1):
+            return True
+        with self.__key_locks_guard:
+            users[0] -= 1
+            if users[0] == 0:
+                del self.__key_locks[key]
+        return False
+
+    def release_key(self, key: str) -> None:
+        with self.__key_locks_guard:
+            lock, users = self.__key_locks[key]
+            users[0] -= 1
+            if users[0] == 0:
+                del self.__key_locks[key]
+        lock.release()
+
+    def compute_key(self, task: Callable[[ProjectMetadata], None], metadata: ProjectMetadata,
+                    chapter_idx: int, path_resolver: Optional[ResourcePathResolver] = None) -> Optional[str]:
+        """
+        @param path_resolver: Resolver used instead of the cache's one (e.g. of simulation's scratch workspace)
+        @return: Cache key of task execution or None if task is not cacheable
+        """
+        key_fields = hmse_task.get_cache_key_fields(task)
+        resources = hmse_task.get_task_resources(task)
+        if key_fields is None or resources is None:
+            return None
+
+        reads, _ = resources
+        hasher = hashlib.sha256()
+        hasher.update(f"{hmse_task.get_stage_name(task)}:{chapter_idx}".encode())
+        for key_field in sorted(key_fields):
+            value = json.dumps(getattr(metadata, key_field), sort_keys=True, default=_to_json_compatible)
+            hasher.update(f"{key_field}={value}".encode())
+        path_resolver = path_resolver or self.path_resolver
+        for resource in sorted(reads):
+            for path in path_resolver(metadata, resource):
+                hasher.update(f"{resource}:{_digest_path(path)}".encode())
+        return hasher.hexdigest()
+
+    def restore(self, key: str, task: Callable[[ProjectMetadata], None], metadata: ProjectMetadata,
+                path_resolver: Optional[ResourcePathResolver] = None) -> bool:
+        """
+        Restore outputs of a task from cache.
+        @param path_resolver: Resolver used instead of the cache's one (e.g. of simulation's scratch workspace)
+        @return: True if outputs were found and restored, False otherwise
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            return False
+
+        path_resolver = path_resolver or self.path_resolver
+        _, writes = hmse_task.get_task_resources(task)
+        try:
+            for resource in sorted(writes):
+                for i, path in enumerate(path_resolver(metadata, resource)):
+                    _replace_path(os.path.join(entry_dir, resource, str(i)), path)
+            os.utime(entry_dir)
+        except FileNotFoundError as error:
+            # Entry was evicted meanwhile (by another process sharing the cache), the task is executed instead
+            logging.warning(f"Cached output of {task.__name__} disappeared while restored: {error}")
+            return False
+        self.__update_index(key, last_used=time.time())
+        return True
+
+    def store(self, key: str, task: Callable[[ProjectMetadata], None], metadata: ProjectMetadata,
+              path_resolver: Optional[ResourcePathResolver] = None) -> None:
+        """
+        Store outputs of a task under the key (unless they are already stored).
+        @param path_resolver: Resolver used instead of the cache's one (e.g. of simulation's scratch workspace)
+        """
+        path_resolver = path_resolver or self.path_resolver
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_dir):
+            return
+
+        # Entry is prepared aside and renamed, so a partially written entry is never visible
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        _, writes = hmse_task.get_task_resources(task)
+        try:
+            for resource in sorted(writes):
+                for i, path in enumerate(path_resolver(metadata, resource)):
+                    _replace_path(path, os.path.join(tmp_dir, resource, str(i)))
+            os.makedirs(tmp_dir, exist_ok=True)
+            size = _get_size(tmp_dir)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as error:
+            logging.warning(f"Failed to cache output of {task.__name__}: {error}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.__update_index(key, last_used=time.time(), size=size)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove entries unused for longer than max_age_seconds and least recently used entries above max_size_bytes.
+        Entries whose key is acquired (being restored or computed in this process) are skipped.
+        """
+        now = time.time()
+        with self.__index_lock:
+            index = self.__get_index()
+            entries = sorted((last_used, key) for key, (last_used, _) in index.items())
+            total_size = sum(size for _, size in index.values())
+            victims = []
+            for last_used, key in entries:
+                if now - last_used <= self.max_age_seconds and total_size <= self.max_size_bytes:
+                    break
+                victims.append(key)
+                total_size -= index[key][1]
+
+        for key in victims:
+            if not self.acquire_key(key, blocking=False):
+                continue
+            try:
+                shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+                with self.__index_lock:
+                    if self.__index is not None:
+                        self.__index.pop(key, None)
+            finally:
+                self.release_key(key)
+
+    def clear(self) -> None:
+        with self.__index_lock:
+            for entry in os.scandir(self.cache_dir):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            self.__index = None
+
+    def __update_index(self, key: str, last_used: float, size: Optional[int] = None) -> None:
+        with self.__index_lock:
+            index = self.__get_index()
+            if size is None:
+                if key not in index:
+                    return
+                size = index[key][1]
+            index[key] = (last_used, size)
+
+    def __get_index(self) -> Dict[str, Tuple[float, int]]:
+        # Must be called with index lock acquired
+        if self.__index is None or time.monotonic() - self.__index_scanned_at > self.__INDEX_RESCAN_INTERVAL:
+            index = {}
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    index[entry.name] = (entry.stat().st_mtime, _get_size(entry.path))
+                except FileNotFoundError:
+                    # Removed meanwhile by another process
+                    continue
+            self.__index = index
+            self.__index_scanned_at = time.monotonic()
+        return self.__index
+
+
+def _to_json_compatible(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, Enum):
+        return value.value
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    if hasattr(value, "__dict__"):
+        return vars(value)
+    return str(value)
+
+
+def _digest_path(path: str) -> str:
+    hasher = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                hasher.update(os.path.relpath(file_path, path).encode())
+                hasher.update(_digest_path(file_path).encode())
+    elif os.path.isfile(path):
+        with open(path, "rb") as f:
+            while chunk := f.read(__DIGEST_CHUNK_SIZE):
+                hasher.update(chunk)
+    else:
+        hasher.update(b"<missing>")
+    return hasher.hexdigest()
+
+
+def _replace_path(src: str, dst: str) -> None:
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    elif os.path.isfile(src):
+        shutil.copy2(src, dst)
+
+
+def _get_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
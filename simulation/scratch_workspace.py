@@ -0,0 +1,328 @@
+import logging
+import os
+import shutil
+import uuid
+from functools import partial
+from typing import Callable, Optional, Set, Tuple, List
+
+from .simulation_enums import SimulationResource
+from .simulation_error import WorkspaceQuotaExceeded
+from ..hmse_projects.project_metadata import ProjectMetadata
+
+try:
+    import fcntl
+except ImportError:  # Windows (desktop deployment) - files are hardlinked or copied
+    fcntl = None
+
+ProjectDirResolver = Callable[[ProjectMetadata], str]
+# Same as result_cache.ResourcePathResolver
+PathResolver = Callable[[ProjectMetadata, SimulationResource], List[str]]
+
+# ioctl cloning a file into another one sharing its extents (copy-on-write), supported e.g. by Btrfs and XFS
+__FICLONE = 0x40049409
+
+# Directories of a workspace: working copy of the project and directories of feedback iterations
+PROJECT_DIR_NAME = "project"
+ITERATIONS_DIR_NAME = "iterations"
+COUPLING_DIR_NAME = "coupling"
+
+
+class ScratchWorkspace:
+    """
+    Working copy of a project on scratch storage, one per simulation run. Project files are cloned from the project
+    store once, when the simulation starts, and written back by sync when it finishes. Directory of each feedback iteration is built
+    from links to files of the previous iteration, so files are duplicated only when a stage writes them.
+    Linked files are shared with the previous iteration: stages modifying a file in place must call materialize
+    first, files replaced as a whole (written to a new file and renamed) don't need it.
+    """
+
+    def __init__(self, workspace_dir: str, project_store_dir: str, quota_bytes: Optional[int] = None,
+                 min_free_bytes: int = 0):
+        """
+        @param workspace_dir: Directory of the workspace on scratch storage
+        @param project_store_dir: Directory of the project in the project store
+        @param quota_bytes: Maximal disk usage of the workspace (None for no limit)
+        @param min_free_bytes: Free space which must remain on scratch storage
+        """
+        self.workspace_dir = workspace_dir
+        self.project_store_dir = project_store_dir
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+
+    @property
+    def project_dir(self) -> str:
+        """
+        @return: Working copy of the project directory, used by stages instead of the project store
+        """
+        return os.path.join(self.workspace_dir, PROJECT_DIR_NAME)
+
+    def open(self, resume: bool = False) -> None:
+        """
+        Clone the project from the project store. Project files are cloned (copy-on-write) or copied, never
+        hardlinked, so stages can't modify the project store before the workspace is synced.
+        @param resume: Whether the simulation is resumed from a checkpoint - existing workspace (with iterations
+                       of completed chapters) is reused, otherwise it is cloned again
+        """
+        if resume and os.path.isdir(self.project_dir):
+            self.check_quota()
+            return
+        self.remove()
+        os.makedirs(self.workspace_dir)
+        tmp_dir = f"{self.project_dir}.{uuid.uuid4().hex}.tmp"
+        try:
+            if os.path.isdir(self.project_store_dir):
+                clone_tree(self.project_store_dir, tmp_dir, allow_hardlinks=False)
+            else:
+                os.makedirs(tmp_dir)
+            os.rename(tmp_dir, self.project_dir)
+        except BaseException:
+            self.remove()
+            raise
+        logging.info(f"Created scratch workspace {self.workspace_dir}")
+        self.check_quota()
+
+    def to_workspace_path(self, path: str) -> str:
+        """
+        @param path: Path in the project store
+        @return: Corresponding path in the working copy (paths outside of the project are returned unchanged)
+        """
+        relative = os.path.relpath(path, self.project_store_dir)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return path
+        return os.path.normpath(os.path.join(self.project_dir, relative))
+
+    def get_path_resolver(self, path_resolver: Optional[PathResolver], chapter_idx: int) -> PathResolver:
+        """
+        @param path_resolver: Function returning files of a resource in the project store (e.g. of result cache)
+        @param chapter_idx: Chapter whose iteration files are resolved
+        @return: Function returning files of a resource in the workspace: iteration files are the chapter's
+                 iteration directory, other resources are mapped to the working copy
+        """
+        return partial(self.__resolve_paths, path_resolver, chapter_idx)
+
+    def __resolve_paths(self, path_resolver: Optional[PathResolver], chapter_idx: int,
+                        metadata: ProjectMetadata, resource: SimulationResource) -> List[str]:
+        if resource == SimulationResource.ITERATION_FILES:
+            return [self.get_iteration_dir(chapter_idx)] if chapter_idx >= 0 else []
+        if path_resolver is None:
+            return []
+        return [self.to_workspace_path(path) for path in path_resolver(metadata, resource)]
+
+    def get_iteration_dir(self, chapter_idx: int) -> str:
+        return os.path.join(self.workspace_dir, ITERATIONS_DIR_NAME, str(chapter_idx))
+
+    def get_coupling_dir(self, chapter_idx: int) -> str:
+        """
+        @return: Directory of coupling data exchanged by stages of the chapter (see CouplingExchange)
+        """
+        return os.path.join(self.workspace_dir, COUPLING_DIR_NAME, str(chapter_idx))
+
+    def has_iteration(self, chapter_idx: int) -> bool:
+        return os.path.isdir(self.get_iteration_dir(chapter_idx))
+
+    def create_iteration(self, chapter_idx: int) -> str:
+        """
+        Create directory of an iteration from links to files of the closest preceding iteration (empty if there is
+        none). Existing directory of the iteration (e.g. staged before the simulation was interrupted) is replaced.
+        @param chapter_idx: Index of the chapter of the iteration
+        @return: Path of the iteration directory
+        """
+        iteration_dir = self.get_iteration_dir(chapter_idx)
+        tmp_dir = f"{iteration_dir}.{uuid.uuid4().hex}.tmp"
+        previous_idx = next((idx for idx in range(chapter_idx - 1, -1, -1) if self.has_iteration(idx)), None)
+        try:
+            if previous_idx is not None:
+                clone_tree(self.get_iteration_dir(previous_idx), tmp_dir, allow_hardlinks=True)
+            else:
+                os.makedirs(tmp_dir)
+            if os.path.isdir(iteration_dir):
+                shutil.rmtree(iteration_dir)
+            os.rename(tmp_dir, iteration_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.check_quota()
+        return iteration_dir
+
+    def materialize(self, path: str) -> str:
+        """
+        Give the file its own copy of data, so modifying it in place doesn't change files linked to it
+        (e.g. in the previous iteration). Copy-on-write clones and unlinked files are left as they are.
+        @param path: File inside the workspace which is going to be modified
+        @return: The same path
+        """
+        if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                shutil.copy2(path, tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return path
+
+    def materialize_tree(self, path: str) -> str:
+        """
+        Materialize all files of a directory (see materialize), e.g. of a model rewritten by a stage.
+        """
+        for root, _, files in os.walk(path):
+            for file in files:
+                self.materialize(os.path.join(root, file))
+        self.check_free_space()
+        return path
+
+    def get_usage(self) -> int:
+        """
+        @return: Disk usage of the workspace in bytes, files linked to each other are counted once
+        """
+        seen: Set[Tuple[int, int]] = set()
+        usage = 0
+        for root, _, files in os.walk(self.workspace_dir):
+            for file in files:
+                try:
+                    stat = os.stat(os.path.join(root, file))
+                except FileNotFoundError:  # Temporary file replaced in the meantime
+                    continue
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    usage += stat.st_size
+        return usage
+
+    def check_quota(self) -> None:
+        """
+        Check disk usage of the whole workspace (walks all its files, called when the workspace or an iteration
+        is created), see also check_free_space.
+        @raise WorkspaceQuotaExceeded: Workspace uses more than its quota or scratch storage is running out of space
+        """
+        if not os.path.isdir(self.workspace_dir):  # Removed by cleanup
+            return
+        if self.quota_bytes is not None:
+            usage = self.get_usage()
+            if usage > self.quota_bytes:
+                raise WorkspaceQuotaExceeded(description=f"Scratch workspace uses {usage} bytes, "
+                                                         f"its quota is {self.quota_bytes} bytes!")
+        self.check_free_space()
+
+    def check_free_space(self) -> None:
+        """
+        Check free space of scratch storage, cheap enough to be called after every stage.
+        @raise WorkspaceQuotaExceeded: Scratch storage is running out of space
+        """
+        if self.min_free_bytes > 0 and os.path.isdir(self.workspace_dir):
+            free = shutil.disk_usage(self.workspace_dir).free
+            if free < self.min_free_bytes:
+                raise WorkspaceQuotaExceeded(description=f"Only {free} bytes are left on scratch storage, "
+                                                         f"at least {self.min_free_bytes} bytes are required!")
+
+    def sync(self) -> int:
+        """
+        Write files of the working copy which were created or changed during the simulation back to the project
+        store. Each file is replaced atomically; files removed from the working copy are kept in the store.
+        Iteration directories are not synced.
+        @return: Number of written files
+        """
+        written = 0
+        for root, _, files in os.walk(self.project_dir):
+            target_root = os.path.join(self.project_store_dir, os.path.relpath(root, self.project_dir))
+            os.makedirs(target_root, exist_ok=True)
+            for file in files:
+                source_path = os.path.join(root, file)
+                target_path = os.path.join(target_root, file)
+                if not _is_changed(source_path, target_path):
+                    continue
+                tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+                shutil.copy2(source_path, tmp_path)
+                os.replace(tmp_path, target_path)
+                written += 1
+        return written
+
+    def remove(self) -> None:
+        shutil.rmtree(self.workspace_dir, ignore_errors=True)
+        try:
+            # Directory of the project's workspaces is removed with its last workspace
+            os.rmdir(os.path.dirname(self.workspace_dir))
+        except OSError:
+            pass
+
+
+class ScratchWorkspaceManager:
+    """
+    Creates workspaces of simulated projects on fast local scratch storage (see ScratchWorkspace). Workspace
+    of a failed simulation is kept only while it can be resumed from a checkpoint (see Simulation.close).
+    """
+
+    def __init__(self, scratch_dir: str, project_dir_resolver: ProjectDirResolver,
+                 quota_bytes: Optional[int] = None, min_free_bytes: int = 0):
+        """
+        @param scratch_dir: Directory on scratch storage (e.g. local NVMe disk or tmpfs) for workspaces
+        @param project_dir_resolver: Function returning directory of a project in the project store
+        @param quota_bytes: Maximal disk usage of a workspace (None for no limit)
+        @param min_free_bytes: Free space which must remain on scratch storage
+        """
+        self.scratch_dir = scratch_dir
+        self.project_dir_resolver = project_dir_resolver
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        os.makedirs(scratch_dir, exist_ok=True)
+
+    def create_workspace(self, project_metadata: ProjectMetadata,
+                         workspace_dir: Optional[str] = None) -> ScratchWorkspace:
+        """
+        Describe workspace of a simulation run, the workspace is created when the simulation starts (see open).
+        @param workspace_dir: Directory of the workspace to resume (recorded in a checkpoint), new directory
+                              of the run by default, so runs of the same project never share a workspace
+        """
+        if workspace_dir is None:
+            workspace_dir = os.path.join(self.scratch_dir, str(project_metadata.project_id), uuid.uuid4().hex)
+        return ScratchWorkspace(workspace_dir, self.project_dir_resolver(project_metadata),
+                                quota_bytes=self.quota_bytes, min_free_bytes=self.min_free_bytes)
+
+
+def clone_tree(src: str, dst: str, allow_hardlinks: bool) -> None:
+    """
+    Recreate directory tree with files sharing data with the source: copy-on-write clones if the filesystem supports
+    them, otherwise hardlinks (if allowed) and copies as the last resort (e.g. across filesystems).
+    """
+    for root, dirs, files in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target_root, exist_ok=True)
+        for file in files:
+            _clone_file(os.path.join(root, file), os.path.join(target_root, file), allow_hardlinks)
+
+
+def _clone_file(src: str, dst: str, allow_hardlinks: bool) -> None:
+    if _reflink(src, dst):
+        return
+    if allow_hardlinks:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def _reflink(src: str, dst: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as source, open(dst, "wb") as target:
+            fcntl.ioctl(target.fileno(), __FICLONE, source.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def _is_changed(source_path: str, target_path: str) -> bool:
+    if not os.path.exists(target_path):
+        return True
+    source, target = os.stat(source_path), os.stat(target_path)
+    if (source.st_dev, source.st_ino) == (target.st_dev, target.st_ino):
+        return False
+    # Cloned files keep modification time of the store, so files not written by stages are skipped
+    return source.st_size != target.st_size or source.st_mtime_ns != target.st_mtime_ns
+
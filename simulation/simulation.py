@@ -1,40 +1,438 @@
+import os
+import shutil
+import tempfile
+import time
+import uuid
 from abc import ABC
-from typing import List
+from contextlib import contextmanager
+from concurrent.futures import Future
+from functools import partial
+from typing import List, Callable, Optional, Dict, Set, Tuple, Union, Awaitable
 
+from .cancellation import CancellationToken, CANCELLATION_POLL_INTERVAL
+from .metadata_cache import metadata_cache
+from .output_stream import StepOutputWriter, get_run_output_dir
+from .resource_scheduler import ResourceAwareScheduler, StageDemand
+from .result_cache import ResultCache, ResourcePathResolver
+from .scratch_workspace import ScratchWorkspaceManager, ScratchWorkspace
 from .simulation_chapter import SimulationChapter
-from .simulation_enums import SimulationStageStatus
-from .simulation_error import SimulationError
+from .simulation_checkpoint import CheckpointStore, SimulationCheckpoint
+from .simulation_enums import SimulationStageStatus, SimulationStage, SimulationStageName, SimulationResource, \
+    ITERATION_SCOPED_RESOURCES
+from .simulation_error import SimulationError, SimulationCancelled, as_simulation_error
 from .simulation_status import ChapterStatus
-from ..hmse_projects.project_dao import project_dao
+from .stage_status_store import StageStatusStore
+from .status_events import StatusEventStream
+from .task_scheduler import DagScheduler, tasks_conflict
+from .tasks import hmse_task
 from ..hmse_projects.project_metadata import ProjectMetadata
 
+# Events kept in status history per stage of a running simulation
+STATUS_EVENTS_PER_STAGE = 16
+
 
 class Simulation(ABC):
+    # Whether stages run in the process coordinating the simulation, so they can work in its scratch workspace
+    uses_scratch_workspace = True
 
-    def __init__(self, project_metadata: ProjectMetadata, sim_chapters: List[SimulationChapter]):
+    def __init__(self, project_metadata: ProjectMetadata, sim_chapters: List[SimulationChapter],
+                 task_scheduler: Optional[DagScheduler] = None, result_cache: Optional[ResultCache] = None,
+                 checkpoint_store: Optional[CheckpointStore] = None, pipeline_lookahead: int = 0,
+                 stage_timeouts: Optional[Dict[SimulationStageName, float]] = None,
+                 resource_scheduler: Optional[ResourceAwareScheduler] = None,
+                 workspace_manager: Optional[ScratchWorkspaceManager] = None,
+                 output_dir: Optional[str] = None):
+        """
+        @param pipeline_lookahead: Number of following chapters whose prefetchable stages (e.g. staging files of next
+                                   feedback iteration) can run while the current chapter is running, 0 disables it
+        @param stage_timeouts: Wall-clock time limit (in seconds) of stages with given names, stages exceeding it
+                               are stopped with TIMED_OUT status
+        @param resource_scheduler: Scheduler admitting stages of all simulations within CPU and memory budgets
+        @param workspace_manager: Manager of scratch workspaces, stages work in a copy of the project on scratch
+                                  storage instead of the project store (synced back by the cleanup stage)
+        @param output_dir: Directory of incremental output, results of each feedback step are appended to it
+                           as soon as the step finishes (see StepOutputWriter)
+        """
         self.project_metadata = project_metadata
-        self.chapter_statuses = [ChapterStatus(chapter, project_metadata) for chapter in sim_chapters]
+        plans = [chapter.get_execution_plan(project_metadata) for chapter in sim_chapters]
+        total_stages = sum(len(plan.tasks) for plan in plans)
+        self.status_store = StageStatusStore(total_stages)
+        self.chapter_statuses = []
+        offset = 0
+        for chapter_idx, plan in enumerate(plans):
+            self.chapter_statuses.append(ChapterStatus(plan, self.status_store, chapter_idx, offset))
+            offset += len(plan.tasks)
+        # Every stage changes a few times (plus progress of its sub-tasks), clients further behind get full status
+        self.status_events = StatusEventStream(history_size=STATUS_EVENTS_PER_STAGE * total_stages,
+                                               closed_history_size=total_stages)
+        self.add_status_listener(self._publish_status)
+        self.task_scheduler = task_scheduler or DagScheduler()
+        self.result_cache = result_cache
+        self.checkpoint_store = checkpoint_store
+        self.pipeline_lookahead = pipeline_lookahead
+        self.stage_timeouts = stage_timeouts or {}
+        self.resource_scheduler = resource_scheduler
+        self.workspace_manager = workspace_manager
+        self.workspace: Optional[ScratchWorkspace] = \
+            workspace_manager.create_workspace(project_metadata) \
+            if workspace_manager is not None and self.uses_scratch_workspace else None
+        self.__discard_workspace = False
+        # Coupling data of a simulation without workspace is kept in a temporary directory until it is closed
+        self.__exchange_dir = os.path.join(tempfile.gettempdir(), f"hmse-coupling-{uuid.uuid4().hex}") \
+            if self.workspace is None else None
+        # Every run writes its own output, replaced runs which are still stopping can't write to the new one
+        self.__output_dir = output_dir
+        self.output_writer = \
+            StepOutputWriter(get_run_output_dir(output_dir, project_metadata.project_id, uuid.uuid4().hex)) \
+            if output_dir is not None else None
+        self.cancellation_token = CancellationToken()
+        self._prefetched_stages: Dict[int, Set[int]] = {}
+        self.completed_chapters = 0
         self.simulation_error = None
 
     def run_simulation(self):
-        for chapter in self.chapter_statuses:
-            self.__run_chapter(chapter)
-        self.project_metadata.finished = True
-        project_dao.save_or_update_metadata(self.project_metadata)
+        self._open_workspace()
+        self._open_output()
+        try:
+            for chapter_idx in range(self.completed_chapters, len(self.chapter_statuses)):
+                self.cancellation_token.raise_if_cancelled()
+                self.__run_chapter(chapter_idx)
+                self._complete_chapter(chapter_idx)
+        except SimulationCancelled:
+            self.cancel_pending_stages()
+            raise
+        self._complete_simulation()
+
+    def cancel(self, reason: Optional[str] = None) -> None:
+        """
+        Request cancellation of the simulation. Running stages stop at their next cancellation check
+        (see hmse_task.check_cancelled), stages which have not started yet are not started at all.
+        @param reason: Description of the error raised by the cancelled simulation
+        """
+        self.cancellation_token.cancel(reason)
+
+    def is_cancelled(self) -> bool:
+        return self.cancellation_token.is_cancelled()
+
+    def cancel_pending_stages(self) -> None:
+        """
+        Mark stages which have not started yet as cancelled.
+        """
+        for chapter_status in self.chapter_statuses[self.completed_chapters:]:
+            for stage_idx in range(len(chapter_status.stages)):
+                if chapter_status.get_stage_status(stage_idx) == SimulationStageStatus.PENDING:
+                    chapter_status.set_stage_status(SimulationStageStatus.CANCELLED, stage_idx=stage_idx)
+
+    def restore_checkpoint(self, checkpoint: SimulationCheckpoint) -> None:
+        """
+        Mark chapters completed before the checkpoint as done, so the simulation continues from the next chapter.
+        @param checkpoint: Checkpoint of the same project with the same chapters
+        """
+        if checkpoint.project_id != self.project_metadata.project_id:
+            raise ValueError("Checkpoint does not belong to the simulated project!")
+        if [chapter_status.chapter for chapter_status in self.chapter_statuses] != checkpoint.chapters:
+            raise ValueError("Checkpoint does not match chapters of the simulation!")
+        for chapter_status, stages in zip(self.chapter_statuses, checkpoint.chapter_stages):
+            for stage_idx, stage in enumerate(stages):
+                chapter_status.set_stage(stage, stage_idx=stage_idx)
+        self.completed_chapters = checkpoint.completed_chapters
+        if self.workspace is not None and checkpoint.workspace_dir is not None:
+            # Iterations of completed chapters are in the workspace of the interrupted run
+            self.workspace = self.workspace_manager.create_workspace(self.project_metadata, checkpoint.workspace_dir)
+        if self.output_writer is not None and checkpoint.output_run_id is not None:
+            # Steps of completed chapters are in the output of the interrupted run
+            self.output_writer = StepOutputWriter(get_run_output_dir(self.__output_dir,
+                                                                     self.project_metadata.project_id,
+                                                                     checkpoint.output_run_id))
 
     def get_simulation_status(self) -> List[ChapterStatus]:
         return self.chapter_statuses
 
-    def __run_chapter(self, chapter_status: ChapterStatus) -> None:
-        chapter_tasks = chapter_status.chapter.get_simulation_tasks(self.project_metadata)
-        for i, workflow_task in enumerate(chapter_tasks):
-            chapter_status.set_stage_status(SimulationStageStatus.RUNNING, stage_idx=i)
+    def is_finished(self) -> bool:
+        return self.status_events.closed_at is not None
 
-            # Launch and monitor stage
-            try:
-                workflow_task(self.project_metadata)
-            except SimulationError as error:
-                chapter_status.set_stage_status(SimulationStageStatus.ERROR, stage_idx=i)
-                raise SimulationError(description=error.description)
+    def add_status_listener(self, listener: Callable[[int, int, SimulationStage], None]) -> None:
+        """
+        @param listener: Function called with chapter index, stage index and stage after every change of a stage
+        """
+        self.status_store.add_listener(listener)
+
+    def close(self) -> None:
+        """
+        Mark the simulation as finished, called by the executor when the simulation stops running. Workspace
+        of a failed simulation is kept only if the simulation can be resumed from a checkpoint.
+        """
+        self.status_events.close()
+        if self.workspace is not None and (self.__discard_workspace or self.checkpoint_store is None):
+            self.workspace.remove()
+        if self.__exchange_dir is not None:
+            shutil.rmtree(self.__exchange_dir, ignore_errors=True)
+
+    def discard_workspace(self) -> None:
+        """
+        Remove scratch workspace of the simulation as soon as it stops, e.g. when it is evicted or replaced
+        by another simulation of the project, so it won't be resumed.
+        """
+        self.__discard_workspace = True
+        if self.workspace is not None and self.is_finished():
+            self.workspace.remove()
+
+    def _open_workspace(self) -> None:
+        if self.workspace is not None:
+            self.workspace.open(resume=self.completed_chapters > 0)
+
+    def _open_output(self) -> None:
+        if self.output_writer is not None:
+            self.output_writer.publish()
+
+    def _check_workspace_quota(self) -> None:
+        # Stage filling up scratch storage fails, whole workspace is measured only when an iteration is created
+        if self.workspace is not None:
+            self.workspace.check_free_space()
+
+    def get_exchange_dir(self, chapter_idx: int) -> str:
+        """
+        @return: Directory of coupling data exchanged by stages of the chapter (see CouplingExchange)
+        """
+        if self.workspace is not None:
+            return self.workspace.get_coupling_dir(chapter_idx)
+        return os.path.join(self.__exchange_dir, str(chapter_idx))
+
+    def _get_path_resolver(self, path_resolver: Optional[ResourcePathResolver],
+                           chapter_idx: int) -> ResourcePathResolver:
+        """
+        @return: Resolver of files in the scratch workspace if the simulation uses one, otherwise the given one.
+                 Coupling data is resolved to the chapter's exchange directory, so it is cached and keys stages.
+        """
+        if self.workspace is not None:
+            path_resolver = self.workspace.get_path_resolver(path_resolver, chapter_idx)
+        return partial(self.__resolve_paths, path_resolver, chapter_idx)
+
+    def __resolve_paths(self, path_resolver: Optional[ResourcePathResolver], chapter_idx: int,
+                        metadata: ProjectMetadata, resource: SimulationResource) -> List[str]:
+        if resource == SimulationResource.COUPLING_DATA:
+            return [self.get_exchange_dir(chapter_idx)] if chapter_idx >= 0 else []
+        if path_resolver is None:
+            return []
+        return path_resolver(metadata, resource)
+
+    def _complete_chapter(self, chapter_idx: int) -> None:
+        self.completed_chapters = chapter_idx + 1
+        self._prefetched_stages.pop(chapter_idx, None)
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.save(self.__create_checkpoint())
+
+    def _complete_simulation(self) -> None:
+        self.project_metadata.finished = True
+        metadata_cache.save(self.project_metadata, flush=True)
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.remove(self.project_metadata.project_id)
+
+    def _get_cache_key(self, workflow_task: Callable[[ProjectMetadata], None], chapter_idx: int) -> Optional[str]:
+        if self.result_cache is None:
+            return None
+        return self.result_cache.compute_key(workflow_task, self.project_metadata, chapter_idx,
+                                             self._get_path_resolver(self.result_cache.path_resolver, chapter_idx))
+
+    def _acquire_cache_key(self, cache_key: Optional[str], blocking: bool = True,
+                           timeout: Optional[float] = None) -> bool:
+        # Identical stage of another project is not executed concurrently, its output is restored instead
+        return cache_key is None or self.result_cache.acquire_key(cache_key, blocking, timeout)
 
-            chapter_status.set_stage_status(SimulationStageStatus.SUCCESS, stage_idx=i)
+    def _release_cache_key(self, cache_key: Optional[str]) -> None:
+        if cache_key is not None:
+            self.result_cache.release_key(cache_key)
+
+    def _restore_cached_stage(self, cache_key: Optional[str], workflow_task: Callable[[ProjectMetadata], None],
+                              chapter_status: ChapterStatus, stage_idx: int) -> bool:
+        if cache_key is None:
+            return False
+        path_resolver = self._get_path_resolver(self.result_cache.path_resolver, chapter_status.chapter_idx)
+        if not self.result_cache.restore(cache_key, workflow_task, self.project_metadata, path_resolver):
+            return False
+        chapter_status.set_stage_cache_key(cache_key, stage_idx=stage_idx)
+        chapter_status.set_stage_cached(stage_idx=stage_idx)
+        chapter_status.set_stage_status(SimulationStageStatus.SUCCESS, stage_idx=stage_idx)
+        return True
+
+    def _stage_cancellation(self, chapter_status: ChapterStatus, stage_idx: int, timed: bool = True):
+        """
+        @param timed: Whether the time limit of the stage starts now, otherwise only cancellation is checked
+                      (e.g. while the stage waits for admission)
+        """
+        timeout = self.stage_timeouts.get(chapter_status.stages[stage_idx]) if timed else None
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        return hmse_task.stage_cancellation(self.cancellation_token, deadline)
+
+    @contextmanager
+    def _stage_context(self, chapter_status: ChapterStatus, stage_idx: int):
+        with hmse_task.stage_progress_reporter(partial(chapter_status.set_stage_progress, stage_idx=stage_idx)), \
+                hmse_task.stage_metrics_receiver(partial(chapter_status.set_stage_metrics, stage_idx=stage_idx)), \
+                hmse_task.stage_chapter(chapter_status.chapter_idx), \
+                hmse_task.stage_workspace(self.workspace), \
+                hmse_task.stage_exchange_dir(self.get_exchange_dir(chapter_status.chapter_idx)), \
+                hmse_task.stage_output_writer(self.output_writer), \
+                self._stage_cancellation(chapter_status, stage_idx, timed=False):
+            yield
+
+    def _acquire_stage_resources(self, chapter_status: ChapterStatus, stage_idx: int,
+                                 waiting_since: float, blocking: bool = True) -> Optional[StageDemand]:
+        """
+        Wait until resource scheduler admits the stage (checking cancellation while waiting).
+        @param waiting_since: time.monotonic() when the stage started waiting
+        @return: Reserved demand, None if there is no resource scheduler or the stage was not admitted (non-blocking)
+        """
+        if self.resource_scheduler is None:
+            return None
+        stage_name = chapter_status.stages[stage_idx]
+        while True:
+            demand = self.resource_scheduler.acquire(stage_name, blocking, timeout=CANCELLATION_POLL_INTERVAL,
+                                                     waiting_since=waiting_since)
+            if demand is not None or not blocking:
+                return demand
+            hmse_task.check_cancelled()
+
+    def _release_stage_resources(self, demand: Optional[StageDemand], chapter_status: ChapterStatus,
+                                 stage_idx: int, succeeded: bool) -> None:
+        if demand is not None:
+            # Metrics of successful stage are learned, so later stages of its kind are estimated better
+            stage = chapter_status.get_stage(stage_idx) if succeeded else None
+            self.resource_scheduler.release(demand, stage)
+
+    def _release_stopped_stage_resources(self, stage_run: Union[Future, Awaitable], demand: Optional[StageDemand],
+                                         chapter_status: ChapterStatus, stage_idx: int, succeeded: bool) -> None:
+        if stage_run.done():
+            self._release_stage_resources(demand, chapter_status, stage_idx, succeeded)
+        else:
+            # Stage which timed out (or was cancelled) is not awaited anymore, but its task keeps the resources
+            # until it has actually stopped along with its sub-task and solver processes
+            stage_run.add_done_callback(
+                lambda _: self._release_stage_resources(demand, chapter_status, stage_idx, False))
+
+    def _execute_stage(self, workflow_task: Callable[[ProjectMetadata], None],
+                       chapter_status: ChapterStatus, stage_idx: int) -> None:
+        with self._stage_context(chapter_status, stage_idx):
+            demand = self._acquire_stage_resources(chapter_status, stage_idx, time.monotonic())
+            # Time limit counts from admission, waiting for resources doesn't time the stage out
+            with self._stage_cancellation(chapter_status, stage_idx):
+                stage_run = hmse_task.start_stage(workflow_task, self.project_metadata)
+                succeeded = False
+                try:
+                    hmse_task.await_stage(stage_run)
+                    self._check_workspace_quota()
+                    succeeded = True
+                finally:
+                    self._release_stopped_stage_resources(stage_run, demand, chapter_status, stage_idx, succeeded)
+
+    @staticmethod
+    def _fail_stage(chapter_status: ChapterStatus, stage_idx: int, error: Exception) -> None:
+        error = as_simulation_error(error)
+        chapter_status.set_stage_status(error.stage_status, stage_idx=stage_idx)
+        raise type(error)(description=error.description)
+
+    def _complete_stage(self, cache_key: Optional[str], workflow_task: Callable[[ProjectMetadata], None],
+                        chapter_status: ChapterStatus, stage_idx: int) -> None:
+        if cache_key is not None:
+            path_resolver = self._get_path_resolver(self.result_cache.path_resolver, chapter_status.chapter_idx)
+            self.result_cache.store(cache_key, workflow_task, self.project_metadata, path_resolver)
+            chapter_status.set_stage_cache_key(cache_key, stage_idx=stage_idx)
+        chapter_status.set_stage_status(SimulationStageStatus.SUCCESS, stage_idx=stage_idx)
+
+    def _plan_pipeline(self, chapter_idx: int) -> Tuple[List[Tuple[ChapterStatus, int]], List[Set[int]]]:
+        """
+        Find stages to run along with a chapter: its stages which were not prefetched and prefetchable stages
+        of the following chapters (within lookahead). Stage of a following chapter depends on stages of preceding
+        chapters it conflicts with; writes of iteration scoped resources don't conflict with preceding chapters.
+        @return: Chapter status and index of each stage to run, dependencies between them (as in DagScheduler)
+        """
+        stages = []
+        dependencies = []
+        positions: Dict[Tuple[int, int], int] = {}
+        last_chapter_idx = min(chapter_idx + self.pipeline_lookahead, len(self.chapter_statuses) - 1)
+        for idx in range(chapter_idx, last_chapter_idx + 1):
+            chapter_status = self.chapter_statuses[idx]
+            prefetched = self._prefetched_stages.get(idx, set())
+            plan = chapter_status.plan
+            for stage_idx, task in enumerate(plan.tasks):
+                if stage_idx in prefetched or (idx > chapter_idx and stage_idx not in plan.prefetch_stages):
+                    continue
+                required = {(idx, dep) for dep in plan.dependencies[stage_idx] if dep not in prefetched}
+                for prev_idx in range(chapter_idx, idx):
+                    prev_prefetched = self._prefetched_stages.get(prev_idx, set())
+                    for prev_stage_idx, prev_task in enumerate(self.chapter_statuses[prev_idx].plan.tasks):
+                        if prev_stage_idx not in prev_prefetched and \
+                                tasks_conflict(prev_task, task, ITERATION_SCOPED_RESOURCES):
+                            required.add((prev_idx, prev_stage_idx))
+                # Stages depending on stages which don't run now are left for later chapters
+                if all(stage in positions for stage in required):
+                    positions[(idx, stage_idx)] = len(stages)
+                    stages.append((chapter_status, stage_idx))
+                    dependencies.append({positions[stage] for stage in required})
+        return stages, dependencies
+
+    def _mark_prefetched(self, chapter_idx: int, chapter_status: ChapterStatus, stage_idx: int) -> None:
+        if chapter_status.chapter_idx > chapter_idx:
+            self._prefetched_stages.setdefault(chapter_status.chapter_idx, set()).add(stage_idx)
+
+    def _roll_back_prefetched_stages(self, chapter_idx: int) -> None:
+        """
+        Discard stages of chapters following the failed one, which were run in advance. They are run again
+        (overwriting staged files) when the simulation is resumed.
+        """
+        for prefetched_idx in [idx for idx in self._prefetched_stages if idx > chapter_idx]:
+            for stage_idx in self._prefetched_stages.pop(prefetched_idx):
+                self.chapter_statuses[prefetched_idx].set_stage_status(SimulationStageStatus.PENDING,
+                                                                       stage_idx=stage_idx)
+
+    def __create_checkpoint(self) -> SimulationCheckpoint:
+        completed = self.chapter_statuses[:self.completed_chapters]
+        return self.checkpoint_store.create_checkpoint(
+            self.project_metadata,
+            chapters=[chapter_status.chapter for chapter_status in self.chapter_statuses],
+            completed_chapters=self.completed_chapters,
+            chapter_stages=[chapter_status.get_stages_statuses() for chapter_status in completed],
+            workspace_dir=self.workspace.workspace_dir if self.workspace is not None else None,
+            output_run_id=self.output_writer.run_id if self.output_writer is not None else None,
+            # Iteration files of the last completed chapter are needed to continue
+            path_resolver=self._get_path_resolver(self.checkpoint_store.path_resolver, self.completed_chapters - 1)
+        )
+
+    def _publish_status(self, chapter_idx: int, stage_idx: int, stage: SimulationStage) -> None:
+        self.status_events.publish(chapter_idx, self.chapter_statuses[chapter_idx].chapter, stage_idx, stage)
+
+    def __run_chapter(self, chapter_idx: int) -> None:
+        stages, dependencies = self._plan_pipeline(chapter_idx)
+        try:
+            self.task_scheduler.run(dependencies, partial(self.__run_pipeline_stage, chapter_idx, stages))
+        except SimulationError:
+            self._roll_back_prefetched_stages(chapter_idx)
+            raise
+
+    def __run_pipeline_stage(self, chapter_idx: int, stages: List[Tuple[ChapterStatus, int]], i: int) -> None:
+        chapter_status, stage_idx = stages[i]
+        self.__run_stage(chapter_status.chapter_idx, chapter_status, stage_idx)
+        self._mark_prefetched(chapter_idx, chapter_status, stage_idx)
+
+    def __run_stage(self, chapter_idx: int, chapter_status: ChapterStatus, stage_idx: int) -> None:
+        workflow_task = chapter_status.plan.tasks[stage_idx]
+        chapter_status.set_stage_status(SimulationStageStatus.RUNNING, stage_idx=stage_idx)
+
+        try:
+            cache_key = self._get_cache_key(workflow_task, chapter_idx)
+            # Key is awaited in intervals, so cancelled stage doesn't wait until identical stage of another project
+            # finishes
+            while not self._acquire_cache_key(cache_key, timeout=CANCELLATION_POLL_INTERVAL):
+                self.cancellation_token.raise_if_cancelled()
+        except Exception as error:
+            self._fail_stage(chapter_status, stage_idx, error)
+        try:
+            if self._restore_cached_stage(cache_key, workflow_task, chapter_status, stage_idx):
+                return
+
+            # Launch and monitor stage
+            self._execute_stage(workflow_task, chapter_status, stage_idx)
+            self._complete_stage(cache_key, workflow_task, chapter_status, stage_idx)
+        except Exception as error:
+            self._fail_stage(chapter_status, stage_idx, error)
+        finally:
+            self._release_cache_key(cache_key)
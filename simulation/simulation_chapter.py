@@ -1,13 +1,15 @@
-import copy
 from dataclasses import dataclass
 from enum import auto
-from typing import List, Callable, Set
+from functools import lru_cache
+from typing import List, Callable, Set, Tuple, FrozenSet
 
 from strenum import StrEnum
 
-from .tasks.configuration_tasks import ConfigurationTasks
-from .tasks.data_tasks import DataTasks
-from .tasks.simulation_tasks import SimulationTasks
+from .simulation_enums import SimulationStageName
+from .task_scheduler import build_dependency_graph
+from .tasks import hmse_task
+from .tasks.hmse_task import LazyTask
+from .tasks.task_registry import TASK_REGISTRY
 from ..hmse_projects.project_metadata import ProjectMetadata
 
 
@@ -19,10 +21,17 @@ class SimulationChapter(StrEnum):
     FEEDBACK_ITERATION = auto()
     FEEDBACK_SIMULATION_FINALIZATION = auto()
 
+    def get_execution_plan(self, metadata: ProjectMetadata) -> 'ChapterPlan':
+        """
+        Return plan of the chapter for given project. Plans only depend on the chapter and on which coupling
+        features project uses, so they are computed once and shared (e.g. by all feedback iterations).
+        """
+        is_hydrus_used = len(metadata.shapes_to_hydrus) > 0
+        is_weather_transfer_used = len(metadata.hydrus_to_weather) > 0
+        return SimulationChapter.__build_execution_plan(self, is_hydrus_used, is_weather_transfer_used)
+
     def get_simulation_tasks(self, metadata: ProjectMetadata) -> List[Callable[[ProjectMetadata], None]]:
-        tasks = copy.deepcopy(CHAPTER_TO_TASK_MAPPING[self])
-        steps_to_skip = SimulationChapter.__get_steps_to_skip(tasks, metadata)
-        return [t for t in tasks if t not in steps_to_skip]
+        return list(self.get_execution_plan(metadata).tasks)
 
     def get_name(self) -> str:
         return self.lower().replace('_', ' ').title()
@@ -31,25 +40,50 @@ class SimulationChapter(StrEnum):
         return self.get_name().replace(' ', '')
 
     @staticmethod
-    def __get_steps_to_skip(tasks: List[Callable[[ProjectMetadata], None]],
-                            metadata: ProjectMetadata) -> Set[Callable[[ProjectMetadata], None]]:
-        to_skip = set()
+    def clear_execution_plans() -> None:
+        """
+        Drop memoized plans, must be called after CHAPTER_TO_TASK_MAPPING is modified.
+        """
+        SimulationChapter.__build_execution_plan.cache_clear()
 
-        is_hydrus_used = len(metadata.shapes_to_hydrus) > 0
-        is_weather_transfer_used = len(metadata.hydrus_to_weather) > 0
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def __build_execution_plan(chapter: 'SimulationChapter', is_hydrus_used: bool,
+                               is_weather_transfer_used: bool) -> 'ChapterPlan':
+        tasks = CHAPTER_TO_TASK_MAPPING[chapter]
+        steps_to_skip = SimulationChapter.__get_steps_to_skip(tasks, is_hydrus_used, is_weather_transfer_used)
+        tasks = tuple(t for t in tasks if t not in steps_to_skip)
+        dependencies = tuple(frozenset(d) for d in build_dependency_graph(list(tasks)))
+        # Stage can be prefetched only if all stages it depends on can be prefetched too
+        prefetch_stages = set()
+        for stage_idx, task in enumerate(tasks):
+            if hmse_task.is_prefetchable(task) and dependencies[stage_idx] <= prefetch_stages:
+                prefetch_stages.add(stage_idx)
+        return ChapterPlan(
+            chapter=chapter,
+            tasks=tasks,
+            stage_names=tuple(hmse_task.get_stage_name(t) for t in tasks),
+            dependencies=dependencies,
+            prefetch_stages=frozenset(prefetch_stages)
+        )
+
+    @staticmethod
+    def __get_steps_to_skip(tasks: List[Callable[[ProjectMetadata], None]], is_hydrus_used: bool,
+                            is_weather_transfer_used: bool) -> Set[Callable[[ProjectMetadata], None]]:
+        to_skip = set()
 
         if not is_hydrus_used:
-            if DataTasks.weather_data_to_hydrus in tasks:
-                to_skip.add(DataTasks.weather_data_to_hydrus)
+            if _TASKS.weather_data_to_hydrus in tasks:
+                to_skip.add(_TASKS.weather_data_to_hydrus)
 
-            if SimulationTasks.hydrus_simulation in tasks:
-                to_skip.add(SimulationTasks.hydrus_simulation)
+            if _TASKS.hydrus_simulation in tasks:
+                to_skip.add(_TASKS.hydrus_simulation)
 
-            if DataTasks.hydrus_to_modflow in tasks:
-                to_skip.add(DataTasks.hydrus_to_modflow)
+            if _TASKS.hydrus_to_modflow in tasks:
+                to_skip.add(_TASKS.hydrus_to_modflow)
 
-        if is_hydrus_used and not is_weather_transfer_used and DataTasks.weather_data_to_hydrus in tasks:
-            to_skip.add(DataTasks.weather_data_to_hydrus)
+        if is_hydrus_used and not is_weather_transfer_used and _TASKS.weather_data_to_hydrus in tasks:
+            to_skip.add(_TASKS.weather_data_to_hydrus)
 
         return to_skip
 
@@ -57,49 +91,76 @@ class SimulationChapter(StrEnum):
         return str(self).__hash__()
 
 
+@dataclass(frozen=True)
+class ChapterPlan:
+    """
+    Immutable execution plan of a chapter: tasks to run, their stage names and dependencies between them.
+    """
+    chapter: SimulationChapter
+    tasks: Tuple[Callable[[ProjectMetadata], None], ...]
+    stage_names: Tuple[SimulationStageName, ...]
+    dependencies: Tuple[FrozenSet[int], ...]
+    prefetch_stages: FrozenSet[int] = frozenset()
+
+
+class _LazyTasks:
+    """
+    Tasks of the static registry by their names, their modules are not imported until they are called.
+    """
+
+    def __init__(self):
+        for task_id in TASK_REGISTRY:
+            setattr(self, task_id, LazyTask(task_id))
+
+
+_TASKS = _LazyTasks()
+
 __SIMPLE_COUPLING_TASKS = [
-    ConfigurationTasks.initialization,
-    DataTasks.weather_data_to_hydrus,
-    SimulationTasks.hydrus_simulation,
-    DataTasks.hydrus_to_modflow,
-    SimulationTasks.modflow_simulation,
-    ConfigurationTasks.output_extraction_to_json,
-    ConfigurationTasks.cleanup
+    _TASKS.initialization,
+    _TASKS.weather_data_to_hydrus,
+    _TASKS.hydrus_simulation,
+    _TASKS.hydrus_to_modflow,
+    _TASKS.modflow_simulation,
+    _TASKS.output_extraction_to_json,
+    _TASKS.cleanup
 ]
 
 __FEEDBACK_WARMUP_STEADY_STATE_TASKS = [
-    ConfigurationTasks.initialization,
-    DataTasks.weather_data_to_hydrus,
-    ConfigurationTasks.save_reference_hydrus_models,
-    ConfigurationTasks.create_per_zone_hydrus_models,
-    ConfigurationTasks.initialize_new_iteration_files,
-    DataTasks.modflow_init_condition_transfer_steady_state,
-    SimulationTasks.hydrus_simulation_warmup
+    _TASKS.initialization,
+    _TASKS.weather_data_to_hydrus,
+    _TASKS.save_reference_hydrus_models,
+    _TASKS.create_per_zone_hydrus_models,
+    _TASKS.initialize_new_iteration_files,
+    _TASKS.modflow_init_condition_transfer_steady_state,
+    _TASKS.hydrus_simulation_warmup,
+    _TASKS.iteration_output_extraction_to_json
 ]
 
 __FEEDBACK_WARMUP_TRANSIENT_TASKS = [
-    ConfigurationTasks.initialization,
-    DataTasks.weather_data_to_hydrus,
-    ConfigurationTasks.save_reference_hydrus_models,
-    ConfigurationTasks.create_per_zone_hydrus_models,
-    ConfigurationTasks.initialize_new_iteration_files,
-    DataTasks.modflow_init_condition_transfer_transient,
-    SimulationTasks.hydrus_simulation_warmup
+    _TASKS.initialization,
+    _TASKS.weather_data_to_hydrus,
+    _TASKS.save_reference_hydrus_models,
+    _TASKS.create_per_zone_hydrus_models,
+    _TASKS.initialize_new_iteration_files,
+    _TASKS.modflow_init_condition_transfer_transient,
+    _TASKS.hydrus_simulation_warmup,
+    _TASKS.iteration_output_extraction_to_json
 ]
 
 __FEEDBACK_ITERATION_TASKS = [
-    ConfigurationTasks.iteration_pre_configuration,
-    ConfigurationTasks.initialize_new_iteration_files,
-    DataTasks.modflow_to_hydrus,
-    SimulationTasks.hydrus_simulation,
-    DataTasks.hydrus_to_modflow,
-    SimulationTasks.modflow_simulation
+    _TASKS.iteration_pre_configuration,
+    _TASKS.initialize_new_iteration_files,
+    _TASKS.modflow_to_hydrus,
+    _TASKS.hydrus_simulation,
+    _TASKS.hydrus_to_modflow,
+    _TASKS.modflow_simulation,
+    _TASKS.iteration_output_extraction_to_json
 ]
 
 __FEEDBACK_SIMULATION_FINALIZATION = [
-    ConfigurationTasks.iteration_pre_configuration,
-    ConfigurationTasks.output_extraction_to_json,
-    ConfigurationTasks.cleanup
+    _TASKS.iteration_pre_configuration,
+    _TASKS.output_extraction_to_json,
+    _TASKS.cleanup
 ]
 
 CHAPTER_TO_TASK_MAPPING = {
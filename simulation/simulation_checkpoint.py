@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from .result_cache import ResourcePathResolver
+from .simulation_chapter import SimulationChapter
+from .simulation_enums import SimulationStage, SimulationResource, SimulationStageName, SimulationStageStatus
+from .stage_metrics import StageMetrics
+from ..hmse_projects.project_metadata import ProjectMetadata
+from ..hmse_projects.typing_help import ProjectID
+
+
+@dataclass
+class SimulationCheckpoint:
+    """
+    Progress of a simulation: chapters completed so far and their stages. Metadata of the project is not part
+    of the checkpoint, the resumed simulation reads it from the project store.
+    """
+    project_id: ProjectID
+    chapters: List[SimulationChapter]
+    completed_chapters: int
+    chapter_stages: List[List[SimulationStage]]
+    iteration_files: List[str]
+    # Scratch workspace with iterations of completed chapters (see ScratchWorkspace), None if not used
+    workspace_dir: Optional[str] = None
+    # Run whose output contains steps of completed chapters (see StepOutputWriter), None if output is not written
+    output_run_id: Optional[str] = None
+
+    def to_json(self):
+        return {
+            "project_id": self.project_id,
+            "chapters": [str(chapter) for chapter in self.chapters],
+            "completed_chapters": self.completed_chapters,
+            "chapter_stages": [[_stage_to_json(stage) for stage in stages] for stages in self.chapter_stages],
+            "iteration_files": self.iteration_files,
+            "workspace_dir": self.workspace_dir,
+            "output_run_id": self.output_run_id
+        }
+
+    @staticmethod
+    def from_json(checkpoint) -> 'SimulationCheckpoint':
+        return SimulationCheckpoint(
+            project_id=checkpoint["project_id"],
+            chapters=[SimulationChapter(chapter) for chapter in checkpoint["chapters"]],
+            completed_chapters=checkpoint["completed_chapters"],
+            chapter_stages=[[_stage_from_json(stage) for stage in stages] for stages in checkpoint["chapter_stages"]],
+            iteration_files=checkpoint["iteration_files"],
+            workspace_dir=checkpoint["workspace_dir"],
+            output_run_id=checkpoint["output_run_id"]
+        )
+
+
+class CheckpointStore:
+    """
+    Durable storage of simulation checkpoints, one JSON file per project. Files are replaced atomically,
+    so a crash during save leaves the previous checkpoint intact.
+    """
+
+    def __init__(self, checkpoint_dir: str, path_resolver: Optional[ResourcePathResolver] = None):
+        """
+        @param checkpoint_dir: Directory for checkpoint files
+        @param path_resolver: Function returning files of a resource in given project, used to record (and verify
+                              on resume) location of iteration files
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.path_resolver = path_resolver
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def create_checkpoint(self, project_metadata: ProjectMetadata, chapters: List[SimulationChapter],
+                          completed_chapters: int, chapter_stages: List[List[SimulationStage]],
+                          workspace_dir: Optional[str] = None, output_run_id: Optional[str] = None,
+                          path_resolver: Optional[ResourcePathResolver] = None) -> SimulationCheckpoint:
+        """
+        @param workspace_dir: Scratch workspace of the simulation, reused when the simulation is resumed
+        @param output_run_id: Run whose output is continued when the simulation is resumed
+        @param path_resolver: Resolver used instead of the store's one (e.g. of simulation's scratch workspace)
+        """
+        path_resolver = path_resolver or self.path_resolver
+        iteration_files = path_resolver(project_metadata, SimulationResource.ITERATION_FILES) \
+            if path_resolver is not None else []
+        return SimulationCheckpoint(project_metadata.project_id, chapters, completed_chapters, chapter_stages,
+                                    iteration_files, workspace_dir, output_run_id)
+
+    def save(self, checkpoint: SimulationCheckpoint) -> None:
+        path = self.__get_checkpoint_path(checkpoint.project_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint.to_json(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, project_id: ProjectID) -> Optional[SimulationCheckpoint]:
+        """
+        @return: Last checkpoint of the project or None if there is no usable checkpoint
+        """
+        path = self.__get_checkpoint_path(project_id)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as f:
+                checkpoint = SimulationCheckpoint.from_json(json.load(f))
+        except (ValueError, KeyError, TypeError) as error:
+            logging.warning(f"Checkpoint of project {project_id} is unusable, it can't be read: {error}")
+            return None
+
+        missing_files = [file for file in checkpoint.iteration_files if not os.path.exists(file)]
+        if missing_files:
+            logging.warning(f"Checkpoint of project {project_id} is unusable, missing iteration files: {missing_files}")
+            return None
+        return checkpoint
+
+    def remove(self, project_id: ProjectID) -> None:
+        path = self.__get_checkpoint_path(project_id)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def __get_checkpoint_path(self, project_id: ProjectID) -> str:
+        return os.path.join(self.checkpoint_dir, f"{project_id}.checkpoint.json")
+
+
+def _stage_to_json(stage: SimulationStage):
+    return {
+        "name": str(stage.name),
+        "status": str(stage.status),
+        "completed_subtasks": stage.completed_subtasks,
+        "total_subtasks": stage.total_subtasks,
+        "cached": stage.cached,
+        "metrics": stage.metrics.to_json() if stage.metrics is not None else None,
+        "cache_key": stage.cache_key
+    }
+
+
+def _stage_from_json(stage) -> SimulationStage:
+    return SimulationStage(
+        name=SimulationStageName(stage["name"]),
+        status=SimulationStageStatus(stage["status"]),
+        completed_subtasks=stage["completed_subtasks"],
+        total_subtasks=stage["total_subtasks"],
+        cached=stage["cached"],
+        metrics=StageMetrics(**stage["metrics"]) if stage["metrics"] is not None else None,
+        cache_key=stage["cache_key"]
+    )
@@ -1,21 +1,36 @@
-from typing import List
+from typing import Dict, List, Optional, Type
 
+from .resource_scheduler import ResourceAwareScheduler
+from .result_cache import ResultCache
+from .scratch_workspace import ScratchWorkspaceManager
 from .simulation import Simulation
 from .simulation_chapter import SimulationChapter
-from ..hmse_projects.hmse_hydrological_models.processing.modflow.modflow_step import ModflowStepType
+from .simulation_checkpoint import CheckpointStore
+from .simulation_enums import SimulationStageName
 from ..hmse_projects.project_metadata import ProjectMetadata
 from ..hmse_projects.simulation_mode import SimulationMode
 
 
-def configure_simulation(project_metadata: ProjectMetadata) -> Simulation:
+def configure_simulation(project_metadata: ProjectMetadata, result_cache: Optional[ResultCache] = None,
+                         checkpoint_store: Optional[CheckpointStore] = None,
+                         simulation_class: Type[Simulation] = Simulation, pipeline_lookahead: int = 0,
+                         stage_timeouts: Optional[Dict[SimulationStageName, float]] = None,
+                         resource_scheduler: Optional[ResourceAwareScheduler] = None,
+                         workspace_manager: Optional[ScratchWorkspaceManager] = None,
+                         output_dir: Optional[str] = None) -> Simulation:
     sim_chapters = __chapters_from_metadata(project_metadata)
-    return Simulation(project_metadata, sim_chapters)
+    return simulation_class(project_metadata, sim_chapters, result_cache=result_cache,
+                            checkpoint_store=checkpoint_store, pipeline_lookahead=pipeline_lookahead,
+                            stage_timeouts=stage_timeouts, resource_scheduler=resource_scheduler,
+                            workspace_manager=workspace_manager, output_dir=output_dir)
 
 
 def __chapters_from_metadata(project_metadata: ProjectMetadata) -> List[SimulationChapter]:
     if project_metadata.simulation_mode == SimulationMode.SIMPLE_COUPLING:
         chapters = [SimulationChapter.SIMPLE_COUPLING]
     elif project_metadata.simulation_mode == SimulationMode.WITH_FEEDBACK:
+        # Modflow processing is imported on first use, it is not needed to start the service
+        from ..hmse_projects.hmse_hydrological_models.processing.modflow.modflow_step import ModflowStepType
         modflow_steps = project_metadata.modflow_metadata.steps_info
         starts_steady = modflow_steps[0].type == ModflowStepType.STEADY_STATE
         chapters = [SimulationChapter.FEEDBACK_WARMUP_STEADY_STATE
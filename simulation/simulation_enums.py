@@ -1,17 +1,22 @@
 from dataclasses import dataclass
 from enum import auto
+from typing import Optional
 
 from strenum import StrEnum
 
+from .stage_metrics import StageMetrics
+
 
 class SimulationStageStatus(StrEnum):
     PENDING = auto()
     RUNNING = auto()
     SUCCESS = auto()
     ERROR = auto()
+    CANCELLED = auto()
+    TIMED_OUT = auto()
 
     def is_finished(self):
-        return self == SimulationStageStatus.SUCCESS or self == SimulationStageStatus.ERROR
+        return self != SimulationStageStatus.PENDING and self != SimulationStageStatus.RUNNING
 
 
 class SimulationStageName(StrEnum):
@@ -22,6 +27,7 @@ class SimulationStageName(StrEnum):
     HYDRUS_TO_MODFLOW_DATA_PASSING = auto()
     MODFLOW_SIMULATION = auto()
     OUTPUT_EXTRACTION_TO_JSON = auto()
+    ITERATION_OUTPUT_EXTRACTION_TO_JSON = auto()
     CLEANUP = auto()
 
     INITIALIZE_NEW_ITERATION_FILES = auto()
@@ -47,6 +53,7 @@ class SimulationStageName(StrEnum):
             SimulationStageName.HYDRUS_TO_MODFLOW_DATA_PASSING: "Passing data from Hydrus to Modflow",
             SimulationStageName.MODFLOW_SIMULATION: "Modflow simulation",
             SimulationStageName.OUTPUT_EXTRACTION_TO_JSON: "Exporting output to JSON",
+            SimulationStageName.ITERATION_OUTPUT_EXTRACTION_TO_JSON: "Exporting step output to JSON",
             SimulationStageName.CLEANUP: "Cleaning up after simulation",
             SimulationStageName.INITIALIZE_NEW_ITERATION_FILES: "Initializing files for new iteration",
             SimulationStageName.CREATE_PER_ZONE_HYDRUS_MODELS: "Creating per zone Hydrus models",
@@ -61,7 +68,35 @@ class SimulationStageName(StrEnum):
         }[self]
 
 
+class SimulationResource(StrEnum):
+    """
+    Data read or written by simulation tasks - used to determine which tasks of a chapter can run concurrently.
+    """
+    WEATHER_DATA = auto()
+    HYDRUS_MODELS = auto()
+    REFERENCE_HYDRUS_MODELS = auto()
+    PER_ZONE_HYDRUS_MODELS = auto()
+    HYDRUS_OUTPUT = auto()
+    MODFLOW_MODEL = auto()
+    MODFLOW_OUTPUT = auto()
+    ITERATION_FILES = auto()
+    SIMULATION_OUTPUT = auto()
+    # Binary arrays passed between Hydrus and Modflow (see coupling_exchange), model files are written from them
+    # only by solver stages
+    COUPLING_DATA = auto()
+
+
+# Resources kept separately for each chapter (iteration), writing them doesn't affect preceding chapters
+ITERATION_SCOPED_RESOURCES = frozenset({SimulationResource.ITERATION_FILES})
+
+
 @dataclass
 class SimulationStage:
     name: SimulationStageName
     status: SimulationStageStatus
+    completed_subtasks: int = 0
+    total_subtasks: int = 0
+    cached: bool = False
+    metrics: Optional[StageMetrics] = None
+    # Result cache key of the stage's output (if it is cacheable), identical stages of other projects share it
+    cache_key: Optional[str] = None
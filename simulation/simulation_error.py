@@ -1,6 +1,39 @@
 from werkzeug.exceptions import HTTPException
 
+from .simulation_enums import SimulationStageStatus
+
 
 class SimulationError(HTTPException):
     code = 500
     description = "Simulation failed!"
+    # Status of the stage which raised the error
+    stage_status = SimulationStageStatus.ERROR
+
+
+def as_simulation_error(error: Exception) -> SimulationError:
+    """
+    @return: The error itself if it is a simulation error, otherwise simulation error (with ERROR stage status)
+             describing it, so unexpected errors (e.g. OSError of a task) fail the stage as well
+    """
+    if isinstance(error, SimulationError):
+        return error
+    return SimulationError(description=f"{SimulationError.description} {type(error).__name__}: {error}")
+
+
+class SimulationCancelled(SimulationError):
+    description = "Simulation was cancelled!"
+    stage_status = SimulationStageStatus.CANCELLED
+
+
+class StageTimedOut(SimulationError):
+    description = "Stage exceeded its time limit!"
+    stage_status = SimulationStageStatus.TIMED_OUT
+
+
+class SimulationNotFound(SimulationError):
+    code = 404
+    description = "Simulation not found!"
+
+
+class WorkspaceQuotaExceeded(SimulationError):
+    description = "Scratch workspace exceeded its disk quota!"
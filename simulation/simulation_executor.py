@@ -0,0 +1,319 @@
+import asyncio
+import copy
+import heapq
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import auto
+from functools import partial
+from threading import RLock, Thread
+from typing import List, Optional
+
+from strenum import StrEnum
+
+from .async_simulation import AsyncSimulation
+from .distributed_simulation import DistributedSimulation
+from .job_queue import JobQueue
+from .metadata_cache import metadata_cache, EXIT_FLUSH_TIMEOUT
+from .simulation import Simulation
+from .simulation_enums import SimulationStage
+from .simulation_error import SimulationCancelled
+from ..hmse_projects.project_metadata import ProjectMetadata
+
+
+# Threads running blocking work of async simulations (synchronous stages, file operations), solvers are coroutines
+DEFAULT_BRIDGE_WORKERS = 32
+
+
+class ExecutorBackend(StrEnum):
+    THREAD = auto()
+    PROCESS = auto()
+
+
+class AdmissionPolicy(StrEnum):
+    FIFO = auto()
+    PRIORITY = auto()
+
+
+@dataclass(order=True)
+class _QueuedSimulation:
+    priority: int
+    seq: int
+    enqueued_at: float = field(compare=False)
+    simulation: Simulation = field(compare=False)
+
+
+@dataclass
+class ExecutorStats:
+    max_workers: int
+    active_workers: int
+    queue_depth: int
+    mean_wait_time: float
+    longest_current_wait: float
+
+    def to_json(self):
+        return {
+            "max_workers": self.max_workers,
+            "active_workers": self.active_workers,
+            "queue_depth": self.queue_depth,
+            "mean_wait_time": self.mean_wait_time,
+            "longest_current_wait": self.longest_current_wait
+        }
+
+
+class _AdmissionQueue:
+    """
+    Admission queue shared by executors. Simulations exceeding the concurrency limit wait (FIFO or priority based -
+    lower priority value is admitted first) until a running simulation finishes.
+    """
+
+    def __init__(self, max_workers: int, admission_policy: AdmissionPolicy):
+        self.max_workers = max_workers
+        self.admission_policy = admission_policy
+        self._lock = RLock()
+        self.__queue: List[_QueuedSimulation] = []
+        self.__seq = itertools.count()
+        self.__active_workers = 0
+        self.__admitted_count = 0
+        self.__total_wait_time = 0.0
+
+    def get_stats(self) -> ExecutorStats:
+        with self._lock:
+            now = time.monotonic()
+            return ExecutorStats(
+                max_workers=self.max_workers,
+                active_workers=self.__active_workers,
+                queue_depth=len(self.__queue),
+                mean_wait_time=self.__total_wait_time / self.__admitted_count if self.__admitted_count else 0.0,
+                longest_current_wait=max((now - q.enqueued_at for q in self.__queue), default=0.0)
+            )
+
+    def _enqueue(self, simulation: Simulation, priority: int) -> None:
+        if self.admission_policy == AdmissionPolicy.FIFO:
+            priority = 0
+        with self._lock:
+            heapq.heappush(self.__queue, _QueuedSimulation(priority, next(self.__seq), time.monotonic(), simulation))
+
+    def _admit_next(self) -> Optional[Simulation]:
+        """
+        @return: Next queued simulation (counted as active from now on) or None if none can be admitted
+        """
+        with self._lock:
+            if not self.__queue or self.__active_workers >= self.max_workers:
+                return None
+            queued = heapq.heappop(self.__queue)
+            self.__active_workers += 1
+            self.__admitted_count += 1
+            self.__total_wait_time += time.monotonic() - queued.enqueued_at
+            return queued.simulation
+
+    def cancel(self, simulation: Simulation, reason: Optional[str] = None) -> None:
+        """
+        Cancel a simulation. Queued simulation is removed from the queue right away, running one stops
+        at the next cancellation check of its stages.
+        @param reason: Description of the error raised by the cancelled simulation
+        """
+        simulation.cancel(reason)
+        with self._lock:
+            queued = [q for q in self.__queue if q.simulation is simulation]
+            if queued:
+                self.__queue.remove(queued[0])
+                heapq.heapify(self.__queue)
+        if queued:
+            simulation.cancel_pending_stages()
+            simulation.close()
+
+    def _release(self) -> None:
+        with self._lock:
+            self.__active_workers -= 1
+
+    def _clear_queue(self) -> None:
+        with self._lock:
+            self.__queue.clear()
+
+
+class SimulationExecutor(_AdmissionQueue):
+    """
+    Runs simulations on a bounded thread or process pool.
+    """
+    simulation_class = Simulation
+
+    def __init__(self, max_workers: Optional[int] = None,
+                 backend: ExecutorBackend = ExecutorBackend.THREAD,
+                 admission_policy: AdmissionPolicy = AdmissionPolicy.FIFO):
+        super().__init__(max_workers or os.cpu_count() or 1, admission_policy)
+        self.backend = backend
+        self.__pool: Optional[Executor] = None
+        self.__status_manager = None
+
+    def submit(self, simulation: Simulation, priority: int = 0) -> None:
+        self._enqueue(simulation, priority)
+        self.__dispatch()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            self._clear_queue()
+            pool, self.__pool = self.__pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+        if self.__status_manager is not None:
+            self.__status_manager.shutdown()
+            self.__status_manager = None
+
+    def __dispatch(self) -> None:
+        with self._lock:
+            while (simulation := self._admit_next()) is not None:
+                future = self.__start(simulation)
+                future.add_done_callback(partial(self.__on_finished, simulation))
+
+    def __start(self, simulation: Simulation) -> Future:
+        if self.__pool is None:
+            self.__pool = ThreadPoolExecutor(max_workers=self.max_workers) \
+                if self.backend == ExecutorBackend.THREAD else ProcessPoolExecutor(max_workers=self.max_workers)
+
+        if self.backend == ExecutorBackend.THREAD:
+            return self.__pool.submit(simulation.run_simulation)
+
+        # Statuses are updated in a separate process, so they are forwarded back to the simulation held by service
+        if self.__status_manager is None:
+            from multiprocessing import Manager
+            self.__status_manager = Manager()
+        status_queue = self.__status_manager.Queue()
+        # Cancelling the simulation held by service also cancels its copy in the worker process
+        simulation.cancellation_token.share_with_processes(self.__status_manager.Event())
+        Thread(target=_apply_forwarded_statuses, args=(simulation, status_queue), daemon=True).start()
+        future = self.__pool.submit(_run_in_worker_process, simulation, status_queue)
+        future.add_done_callback(lambda _: status_queue.put(None))
+        return future
+
+    def __on_finished(self, simulation: Simulation, future: Future) -> None:
+        error = future.exception()
+        if isinstance(error, SimulationCancelled):
+            logging.info(f"Simulation of project {simulation.project_metadata.project_id} cancelled: {error}")
+        elif error is not None:
+            logging.error(f"Simulation of project {simulation.project_metadata.project_id} failed: {error}")
+        elif self.backend == ExecutorBackend.PROCESS:
+            simulation.project_metadata = future.result()
+            # Saved again by the service process, so the final state is written even if the worker's write failed
+            # (written behind, callback of the pool must not wait for the project store)
+            metadata_cache.save(simulation.project_metadata)
+        simulation.close()
+        self._release()
+        self.__dispatch()
+
+
+class AsyncSimulationExecutor(_AdmissionQueue):
+    """
+    Supervises simulations on a single asyncio event loop running in a background thread. Solver stages are
+    coroutines awaited on the loop, synchronous tasks, file operations of simulations (and plain Simulations)
+    are bridged to the loop's default executor of bridge_workers threads.
+    """
+    simulation_class = AsyncSimulation
+
+    def __init__(self, max_concurrent_simulations: int = 1000, bridge_workers: int = DEFAULT_BRIDGE_WORKERS,
+                 admission_policy: AdmissionPolicy = AdmissionPolicy.FIFO):
+        """
+        @param bridge_workers: Number of threads running blocking work of all simulations, it bounds the number
+                               of synchronous stages running at once (solver stages don't occupy them)
+        """
+        super().__init__(max_concurrent_simulations, admission_policy)
+        self.bridge_workers = bridge_workers
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__bridge_executor: Optional[ThreadPoolExecutor] = None
+
+    def submit(self, simulation: Simulation, priority: int = 0) -> None:
+        self._enqueue(simulation, priority)
+        self.__get_loop().call_soon_threadsafe(self.__dispatch)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            self._clear_queue()
+            loop, self.__loop = self.__loop, None
+            bridge_executor, self.__bridge_executor = self.__bridge_executor, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        if bridge_executor is not None:
+            bridge_executor.shutdown(wait=wait)
+
+    def __get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                self.__bridge_executor = ThreadPoolExecutor(max_workers=self.bridge_workers,
+                                                            thread_name_prefix="async-simulation-bridge")
+                self.__loop.set_default_executor(self.__bridge_executor)
+                Thread(target=self.__loop.run_forever, name="async-simulation-executor", daemon=True).start()
+            return self.__loop
+
+    def __dispatch(self) -> None:
+        # Called in event loop thread
+        while (simulation := self._admit_next()) is not None:
+            asyncio.get_running_loop().create_task(self.__run(simulation))
+
+    async def __run(self, simulation: Simulation) -> None:
+        try:
+            if isinstance(simulation, AsyncSimulation):
+                simulation.bridge_executor = self.__bridge_executor
+                await simulation.run_simulation_async()
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, simulation.run_simulation)
+        except SimulationCancelled as error:
+            logging.info(f"Simulation of project {simulation.project_metadata.project_id} cancelled: {error}")
+        except Exception as error:
+            logging.error(f"Simulation of project {simulation.project_metadata.project_id} failed: {error}")
+        finally:
+            simulation.close()
+            self._release()
+            self.__dispatch()
+
+
+class DistributedSimulationExecutor(SimulationExecutor):
+    """
+    Coordinates simulations in threads of the service process, while their stages are executed by simulation
+    workers (see simulation_worker) pulling jobs from the job queue.
+    """
+    simulation_class = DistributedSimulation
+
+    def __init__(self, job_queue: JobQueue, max_coordinated_simulations: int = 64, poll_interval: float = 0.5,
+                 admission_policy: AdmissionPolicy = AdmissionPolicy.FIFO):
+        """
+        @param job_queue: Queue shared with simulation workers
+        @param max_coordinated_simulations: Number of simulations whose stages can be queued at the same time
+        @param poll_interval: Interval of checking state of queued stages
+        """
+        super().__init__(max_coordinated_simulations, ExecutorBackend.THREAD, admission_policy)
+        self.job_queue = job_queue
+        self.poll_interval = poll_interval
+
+    def submit(self, simulation: Simulation, priority: int = 0) -> None:
+        if not isinstance(simulation, DistributedSimulation):
+            raise TypeError(f"Distributed executor can only run {DistributedSimulation.__name__}!")
+        simulation.job_queue = self.job_queue
+        simulation.poll_interval = self.poll_interval
+        super().submit(simulation, priority)
+
+
+def _forward_status(status_queue, chapter_idx: int, stage_idx: int, stage: SimulationStage) -> None:
+    status_queue.put((chapter_idx, stage_idx, copy.copy(stage)))
+
+
+def _run_in_worker_process(simulation: Simulation, status_queue) -> ProjectMetadata:
+    simulation.add_status_listener(partial(_forward_status, status_queue))
+    try:
+        simulation.run_simulation()
+    finally:
+        # Pool processes don't run exit handlers, metadata saved in this process is written before returning
+        if not metadata_cache.flush(EXIT_FLUSH_TIMEOUT):
+            logging.error(f"Metadata of project {simulation.project_metadata.project_id} was not written "
+                          f"within {EXIT_FLUSH_TIMEOUT} s")
+    return simulation.project_metadata
+
+
+def _apply_forwarded_statuses(simulation: Simulation, status_queue) -> None:
+    chapter_statuses = simulation.get_simulation_status()
+    while (update := status_queue.get()) is not None:
+        chapter_idx, stage_idx, stage = update
+        chapter_statuses[chapter_idx].set_stage(stage, stage_idx=stage_idx)
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from typing import List
+
+from .simulation_chapter import SimulationChapter
+from .simulation_enums import SimulationStageName
+from .simulation_status import ChapterStatus
+from .stage_metrics import StageMetrics
+from ..hmse_projects.typing_help import ProjectID
+
+_PROMETHEUS_METRICS = [
+    ("wall_time", "hmse_stage_wall_time_seconds", "Wall clock time of simulation stage"),
+    ("cpu_time", "hmse_stage_cpu_time_seconds", "CPU time of simulation stage"),
+    ("peak_rss_bytes", "hmse_stage_peak_rss_bytes", "Process peak resident set size after simulation stage"),
+    ("memory_bytes", "hmse_stage_memory_bytes", "Peak memory growth of process tree during simulation stage"),
+    ("bytes_read", "hmse_stage_read_bytes", "Bytes read by simulation stage"),
+    ("bytes_written", "hmse_stage_written_bytes", "Bytes written by simulation stage"),
+]
+
+
+@dataclass
+class StageProfile:
+    chapter_idx: int
+    chapter: SimulationChapter
+    stage_idx: int
+    stage_name: SimulationStageName
+    metrics: StageMetrics
+
+    def to_json(self):
+        return {
+            "chapter_id": f"{self.chapter.get_as_id()}{self.chapter_idx}",
+            "stage_id": f"{self.stage_name.get_as_id()}{self.stage_idx}",
+            "stage_name": self.stage_name.get_name(),
+            "metrics": self.metrics.to_json()
+        }
+
+
+class SimulationProfile:
+
+    def __init__(self, project_id: ProjectID, chapter_statuses: List[ChapterStatus]):
+        self.project_id = project_id
+        self.chapters = [chapter_status.chapter for chapter_status in chapter_statuses]
+        self.stages = [
+            StageProfile(chapter_idx, chapter_status.chapter, stage_idx, stage.name, stage.metrics)
+            for chapter_idx, chapter_status in enumerate(chapter_statuses)
+            for stage_idx, stage in enumerate(chapter_status.get_stages_statuses())
+            if stage.metrics is not None
+        ]
+
+    def get_slowest_stages(self, count: int = 10) -> List[StageProfile]:
+        return sorted(self.stages, key=lambda stage: stage.metrics.wall_time, reverse=True)[:count]
+
+    def get_chapter_totals(self):
+        """
+        @return: Sum of wall time, CPU time and I/O of profiled stages for each chapter
+        """
+        totals = [{
+            "chapter_id": f"{chapter.get_as_id()}{i}",
+            "chapter_name": chapter.get_name(),
+            "wall_time": 0.0,
+            "cpu_time": 0.0,
+            "bytes_read": 0,
+            "bytes_written": 0
+        } for i, chapter in enumerate(self.chapters)]
+        for stage in self.stages:
+            chapter_totals = totals[stage.chapter_idx]
+            chapter_totals["wall_time"] += stage.metrics.wall_time
+            chapter_totals["cpu_time"] += stage.metrics.cpu_time
+            chapter_totals["bytes_read"] += stage.metrics.bytes_read
+            chapter_totals["bytes_written"] += stage.metrics.bytes_written
+        return totals
+
+    def to_json(self, slowest_stages_count: int = 10):
+        return {
+            "project_id": self.project_id,
+            "slowest_stages": [stage.to_json() for stage in self.get_slowest_stages(slowest_stages_count)],
+            "chapter_totals": self.get_chapter_totals(),
+            "stages": [stage.to_json() for stage in self.stages]
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        @return: Stage metrics in Prometheus text exposition format
+        """
+        lines = []
+        for attribute, metric_name, description in _PROMETHEUS_METRICS:
+            lines.append(f"# HELP {metric_name} {description}")
+            lines.append(f"# TYPE {metric_name} gauge")
+            for stage in self.stages:
+                value = getattr(stage.metrics, attribute)
+                if value is None:
+                    # Not measured (e.g. memory without procfs)
+                    continue
+                labels = ",".join([
+                    f'project="{_escape_label(self.project_id)}"',
+                    f'chapter="{stage.chapter.get_as_id()}{stage.chapter_idx}"',
+                    f'stage="{stage.stage_name.get_as_id()}{stage.stage_idx}"'
+                ])
+                lines.append(f"{metric_name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -1,38 +1,87 @@
-from typing import List
+from typing import List, Sequence
 
-from .simulation_chapter import SimulationChapter
+from .simulation_chapter import ChapterPlan
 from .simulation_enums import SimulationStageName, SimulationStageStatus, SimulationStage
-from .tasks import hmse_task
-from ..hmse_projects.project_metadata import ProjectMetadata
+from .stage_metrics import StageMetrics
+from .stage_status_store import StageStatusStore
 
 
 class ChapterStatus:
+    """
+    View of statuses of chapter stages, which are kept in a store shared by all chapters of the simulation.
+    """
+    __slots__ = ("plan", "chapter", "stages", "chapter_idx", "__store", "__offset")
 
-    def __init__(self, chapter: SimulationChapter, metadata: ProjectMetadata):
-        stages = [hmse_task.get_stage_name(t) for t in chapter.get_simulation_tasks(metadata)]
-        self.chapter = chapter
-        self.stages = stages
-        self.stages_statuses = [SimulationStage(stage, SimulationStageStatus.PENDING) for stage in stages]
+    def __init__(self, plan: ChapterPlan, store: StageStatusStore, chapter_idx: int, offset: int):
+        # Plan (tasks, stage names and dependencies) is shared by all chapters of the same kind
+        self.plan = plan
+        self.chapter = plan.chapter
+        self.stages = plan.stage_names
+        self.chapter_idx = chapter_idx
+        self.__store = store
+        self.__offset = offset
 
-    def get_stages_names(self) -> List[SimulationStageName]:
+    def get_stages_names(self) -> Sequence[SimulationStageName]:
         return self.stages
 
     def get_stages_statuses(self) -> List[SimulationStage]:
-        return self.stages_statuses
+        return [self.__store.get_stage(self.__offset + i, name) for i, name in enumerate(self.stages)]
+
+    def get_stage(self, stage_idx: int) -> SimulationStage:
+        return self.__store.get_stage(self.__offset + stage_idx, self.stages[stage_idx])
+
+    def get_stage_status(self, stage_idx: int) -> SimulationStageStatus:
+        return self.__store.get_status(self.__offset + stage_idx)
 
     def set_stage_status(self, new_status: SimulationStageStatus, stage_idx: int):
-        self.stages_statuses[stage_idx].status = new_status
+        self.__store.set_status(self.__offset + stage_idx, new_status)
+        self.__notify_listeners(stage_idx)
+
+    def set_stage_progress(self, completed: int, total: int, stage_idx: int):
+        self.__store.set_progress(self.__offset + stage_idx, completed, total)
+        self.__notify_listeners(stage_idx)
+
+    def set_stage_cached(self, stage_idx: int):
+        self.__store.set_cached(self.__offset + stage_idx)
+        self.__notify_listeners(stage_idx)
+
+    def set_stage_cache_key(self, cache_key: str, stage_idx: int):
+        self.__store.set_cache_key(self.__offset + stage_idx, cache_key)
+        self.__notify_listeners(stage_idx)
+
+    def set_stage_metrics(self, metrics: StageMetrics, stage_idx: int):
+        self.__store.set_metrics(self.__offset + stage_idx, metrics)
+        self.__notify_listeners(stage_idx)
+
+    def set_stage(self, stage: SimulationStage, stage_idx: int):
+        self.__store.set_stage(self.__offset + stage_idx, stage)
+        self.__notify_listeners(stage_idx)
+
+    def __notify_listeners(self, stage_idx: int) -> None:
+        if not self.__store.listeners:
+            return
+        stage = self.__store.get_stage(self.__offset + stage_idx, self.stages[stage_idx])
+        for listener in self.__store.listeners:
+            listener(self.chapter_idx, stage_idx, stage)
 
     def to_json(self, i: int):
-        stage_statuses = [
-            {
-                "id": f"{stage.name.get_as_id()}{i}",
-                "name": stage.name.get_name(),
-                "status": stage.status
-            } for i, stage in enumerate(self.stages_statuses)
-        ]
         return {
             "chapter_id": f"{self.chapter.get_as_id()}{i}",
             "chapter_name": self.chapter.get_name(),
-            "stage_statuses": stage_statuses
+            "stage_statuses": [ChapterStatus.stage_to_json(stage, i)
+                               for i, stage in enumerate(self.get_stages_statuses())]
+        }
+
+    @staticmethod
+    def stage_to_json(stage: SimulationStage, i: int):
+        return {
+            "id": f"{stage.name.get_as_id()}{i}",
+            "name": stage.name.get_name(),
+            "status": stage.status,
+            "cached": stage.cached,
+            "metrics": stage.metrics.to_json() if stage.metrics is not None else None,
+            "progress": {
+                "completed": stage.completed_subtasks,
+                "total": stage.total_subtasks
+            } if stage.total_subtasks > 0 else None
         }
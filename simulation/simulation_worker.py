@@ -0,0 +1,123 @@
+"""
+Stateless worker executing stages of distributed simulations. Run any number of workers sharing the job queue, e.g.:
+    python -m hmse_simulations.simulation.simulation_worker --queue /data/hmse/jobs.sqlite
+"""
+import argparse
+import logging
+import os
+import socket
+import time
+from functools import partial
+from threading import Event, Thread
+from typing import Optional, List
+
+from .cancellation import CancellationToken, CANCELLATION_POLL_INTERVAL
+from .job_queue import JobQueue, StageJob, SqliteJobQueue
+from .output_stream import StepOutputWriter
+from .simulation_enums import SimulationStageStatus
+from .simulation_error import SimulationError
+from .stage_metrics import StageMetrics
+from .tasks import hmse_task
+
+
+class SimulationWorker:
+
+    def __init__(self, job_queue: JobQueue, worker_id: Optional[str] = None, poll_interval: float = 1.0,
+                 heartbeat_interval: float = 30.0):
+        """
+        @param job_queue: Queue shared with the coordinator
+        @param worker_id: Unique name of the worker (host name and process ID by default)
+        @param poll_interval: Time to wait before polling again an empty queue
+        @param heartbeat_interval: Interval of extending lease of the executed job, must be shorter than the lease
+        """
+        self.job_queue = job_queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+
+    def run(self, stop_event: Optional[Event] = None) -> None:
+        """
+        Execute jobs until stop_event is set (forever if not given).
+        """
+        while stop_event is None or not stop_event.is_set():
+            if not self.run_once():
+                time.sleep(self.poll_interval)
+
+    def run_once(self) -> bool:
+        """
+        Execute a single job if there is any pending.
+        @return: Whether a job was executed
+        """
+        job = self.job_queue.take(self.worker_id)
+        if job is None:
+            return False
+
+        finished = Event()
+        cancellation_token = CancellationToken()
+        Thread(target=self.__supervise_job, args=(job, cancellation_token, finished), daemon=True).start()
+        try:
+            self.__execute(job, cancellation_token)
+        finally:
+            finished.set()
+        return True
+
+    def __execute(self, job: StageJob, cancellation_token: CancellationToken) -> None:
+        metrics: List[StageMetrics] = []
+        logging.info(f"Worker {self.worker_id} runs stage {job.stage_idx} of chapter "
+                     f"{job.chapter.get_as_id()}{job.chapter_idx} of project {job.project_metadata.project_id}")
+        try:
+            task = hmse_task.get_task(job.task_id)
+            reporter = partial(self.job_queue.report_progress, job.job_id, self.worker_id)
+            deadline = time.monotonic() + job.time_limit if job.time_limit is not None else None
+            output_writer = StepOutputWriter(job.output_dir) if job.output_dir is not None else None
+            # Same stage context as in Simulation, except for the coordinator's workspace and coupling exchange
+            # (workers may run on other hosts)
+            with hmse_task.stage_progress_reporter(reporter), hmse_task.stage_metrics_receiver(metrics.append), \
+                    hmse_task.stage_chapter(job.chapter_idx), hmse_task.stage_workspace(None), \
+                    hmse_task.stage_exchange_dir(None), hmse_task.stage_output_writer(output_writer), \
+                    hmse_task.stage_cancellation(cancellation_token, deadline):
+                hmse_task.await_stage(hmse_task.start_stage(task, job.project_metadata))
+        except SimulationError as error:
+            self.__finish(job, error.stage_status, metrics, error.description)
+        except Exception as error:
+            logging.exception(f"Stage {job.task_id} failed on worker {self.worker_id}")
+            self.__finish(job, SimulationStageStatus.ERROR, metrics, str(error))
+        else:
+            self.__finish(job, SimulationStageStatus.SUCCESS, metrics)
+
+    def __finish(self, job: StageJob, status: SimulationStageStatus, metrics: List[StageMetrics],
+                 error: Optional[str] = None) -> None:
+        self.job_queue.finish(job.job_id, self.worker_id, status, metrics[-1] if metrics else None, error)
+
+    def __supervise_job(self, job: StageJob, cancellation_token: CancellationToken, finished: Event) -> None:
+        """
+        Extend lease of the executed job and cancel it once the coordinator has removed it from the queue
+        (the stage was cancelled or timed out).
+        """
+        last_heartbeat = time.monotonic()
+        while not finished.wait(CANCELLATION_POLL_INTERVAL):
+            if self.job_queue.get_state(job.job_id) is None:
+                cancellation_token.cancel("Stage was cancelled by the coordinator!")
+                return
+            if time.monotonic() - last_heartbeat >= self.heartbeat_interval:
+                self.job_queue.heartbeat(job.job_id, self.worker_id)
+                last_heartbeat = time.monotonic()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker executing stages of HMSE simulations")
+    parser.add_argument("--queue", required=True, help="Path of SQLite job queue shared with the service")
+    parser.add_argument("--worker-id", help="Unique name of the worker (host name and process ID by default)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Polling interval of an empty queue")
+    parser.add_argument("--lease", type=float, default=300.0,
+                        help="Time without heartbeat after which a job is given to another worker")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    job_queue = SqliteJobQueue(args.queue, lease_seconds=args.lease)
+    SimulationWorker(job_queue, args.worker_id, args.poll_interval,
+                     heartbeat_interval=args.lease / 3).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from threading import Lock, Thread
+from typing import Callable, Optional, Tuple, Dict, List
+
+try:
+    import resource
+except ImportError:  # Windows (desktop deployment)
+    resource = None
+
+__THREAD_IO_PATH = "/proc/thread-self/io"
+__PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+@dataclass
+class StageMetrics:
+    """
+    Resources used by a single stage execution. CPU time and I/O are measured for the thread executing the stage
+    (sub-tasks running in other processes are not included), peak RSS is the high-water mark of the whole process.
+    Memory of the stage is the growth of resident memory of the process tree (the process, sub-task pool workers
+    and solvers) from the start of the stage to its peak, sampled while the stage runs. It includes stages running
+    concurrently in the same process, None if it can't be measured (no procfs).
+    """
+    start_time: float
+    end_time: float
+    wall_time: float
+    cpu_time: float
+    peak_rss_bytes: int
+    bytes_read: int
+    bytes_written: int
+    memory_bytes: Optional[int] = None
+
+    def to_json(self):
+        return {
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "memory_bytes": self.memory_bytes
+        }
+
+
+@contextmanager
+def measure_stage(receiver: Optional[Callable[[StageMetrics], None]]):
+    """
+    Measure resources used by the code executed inside the context and pass them to receiver (even if code fails).
+    @param receiver: Function accepting measured metrics, if None nothing is measured
+    """
+    if receiver is None:
+        yield
+        return
+
+    start_time = time.time()
+    start_perf = time.perf_counter()
+    start_cpu = time.thread_time()
+    start_read, start_written = _get_thread_io()
+    measurement = _RSS_SAMPLER.start_measurement()
+    try:
+        yield
+    finally:
+        end_read, end_written = _get_thread_io()
+        receiver(StageMetrics(
+            start_time=start_time,
+            end_time=time.time(),
+            wall_time=time.perf_counter() - start_perf,
+            cpu_time=time.thread_time() - start_cpu,
+            peak_rss_bytes=_get_peak_rss(),
+            bytes_read=end_read - start_read,
+            bytes_written=end_written - start_written,
+            memory_bytes=_RSS_SAMPLER.stop_measurement(measurement)
+        ))
+
+
+class _ProcessTreeRssSampler:
+    """
+    Samples resident memory of the process tree (the process, its sub-task pool workers and solvers) while any
+    stage is measured. A single thread samples for all stages, each stage keeps the peak of samples taken
+    while it runs.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.__reset()
+        if hasattr(os, "register_at_fork"):
+            # Sampling thread does not survive fork (e.g. simulation worker processes)
+            os.register_at_fork(after_in_child=self.__reset)
+
+    def start_measurement(self) -> Optional[Tuple[int, int]]:
+        """
+        @return: ID of the measurement and RSS of the tree at its start, None if RSS can't be read
+        """
+        rss = _get_process_tree_rss()
+        if rss is None:
+            return None
+        with self.__lock:
+            measurement_id = next(self.__ids)
+            self.__peaks[measurement_id] = rss
+            if not self.__sampling:
+                self.__sampling = True
+                Thread(target=self.__sample, name="stage-rss-sampler", daemon=True).start()
+        return measurement_id, rss
+
+    def stop_measurement(self, measurement: Optional[Tuple[int, int]]) -> Optional[int]:
+        """
+        @return: Growth of the tree RSS from the start of the measurement to its peak, None if it can't be read
+        """
+        if measurement is None:
+            return None
+        measurement_id, start_rss = measurement
+        rss = _get_process_tree_rss()
+        with self.__lock:
+            peak_rss = self.__peaks.pop(measurement_id)
+        return max(peak_rss, rss or 0) - start_rss
+
+    def __sample(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            rss = _get_process_tree_rss()
+            with self.__lock:
+                if not self.__peaks:
+                    self.__sampling = False
+                    return
+                if rss is not None:
+                    for measurement_id, peak_rss in self.__peaks.items():
+                        self.__peaks[measurement_id] = max(peak_rss, rss)
+
+    def __reset(self) -> None:
+        self.__lock = Lock()
+        self.__ids = itertools.count()
+        self.__peaks: Dict[int, int] = {}
+        self.__sampling = False
+
+
+_RSS_SAMPLER = _ProcessTreeRssSampler(interval=0.1)
+
+
+def _get_thread_io() -> Tuple[int, int]:
+    try:
+        with open(__THREAD_IO_PATH) as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _get_peak_rss() -> int:
+    if resource is None:
+        return 0
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _get_process_tree_rss() -> Optional[int]:
+    """
+    @return: Resident memory of the process and all its descendants, None if it can't be read (no procfs)
+    """
+    total = 0
+    pids = [os.getpid()]
+    while pids:
+        pid = pids.pop()
+        rss = _get_process_rss(pid)
+        if rss is None:
+            if pid == os.getpid():
+                return None
+            # Process has exited meanwhile
+            continue
+        total += rss
+        pids.extend(_get_child_pids(pid))
+    return total
+
+
+def _get_process_rss(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * __PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _get_child_pids(pid: int) -> List[int]:
+    children = []
+    try:
+        for thread_id in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{thread_id}/children") as f:
+                children.extend(int(child_pid) for child_pid in f.read().split())
+    except (OSError, ValueError):
+        pass
+    return children
@@ -0,0 +1,79 @@
+from typing import Dict, Set, Tuple, List, Callable
+
+from .simulation_enums import SimulationStageName, SimulationStageStatus, SimulationStage
+from .stage_metrics import StageMetrics
+
+_STATUSES: Tuple[SimulationStageStatus, ...] = tuple(SimulationStageStatus)
+_STATUS_CODES: Dict[SimulationStageStatus, int] = {status: code for code, status in enumerate(_STATUSES)}
+
+
+class StageStatusStore:
+    """
+    Compact statuses of all stages of a simulation. Status of each stage takes a single byte, details which only
+    some stages have (progress of sub-tasks, cache hit, metrics) are kept sparsely, keyed by position of the stage.
+    Stage names are not stored, they are shared by chapter plans.
+    """
+    __slots__ = ("codes", "progress", "cached", "cache_keys", "metrics", "listeners")
+
+    def __init__(self, size: int):
+        self.codes = bytearray([_STATUS_CODES[SimulationStageStatus.PENDING]]) * size
+        self.progress: Dict[int, Tuple[int, int]] = {}
+        self.cached: Set[int] = set()
+        self.cache_keys: Dict[int, str] = {}
+        self.metrics: Dict[int, StageMetrics] = {}
+        self.listeners: List[Callable[[int, int, SimulationStage], None]] = []
+
+    def get_status(self, position: int) -> SimulationStageStatus:
+        return _STATUSES[self.codes[position]]
+
+    def count_status(self, status: SimulationStageStatus) -> int:
+        return self.codes.count(_STATUS_CODES[status])
+
+    def set_status(self, position: int, status: SimulationStageStatus) -> None:
+        self.codes[position] = _STATUS_CODES[status]
+
+    def set_progress(self, position: int, completed: int, total: int) -> None:
+        self.progress[position] = (completed, total)
+
+    def set_cached(self, position: int) -> None:
+        self.cached.add(position)
+
+    def set_cache_key(self, position: int, cache_key: str) -> None:
+        self.cache_keys[position] = cache_key
+
+    def set_metrics(self, position: int, metrics: StageMetrics) -> None:
+        self.metrics[position] = metrics
+
+    def get_stage(self, position: int, name: SimulationStageName) -> SimulationStage:
+        """
+        @return: New stage object filled with the stored status, changes of it are not stored
+        """
+        completed, total = self.progress.get(position, (0, 0))
+        return SimulationStage(name, self.get_status(position), completed_subtasks=completed, total_subtasks=total,
+                               cached=position in self.cached, metrics=self.metrics.get(position),
+                               cache_key=self.cache_keys.get(position))
+
+    def set_stage(self, position: int, stage: SimulationStage) -> None:
+        self.set_status(position, stage.status)
+        if stage.total_subtasks > 0:
+            self.progress[position] = (stage.completed_subtasks, stage.total_subtasks)
+        else:
+            self.progress.pop(position, None)
+        if stage.cached:
+            self.cached.add(position)
+        else:
+            self.cached.discard(position)
+        if stage.metrics is not None:
+            self.metrics[position] = stage.metrics
+        else:
+            self.metrics.pop(position, None)
+        if stage.cache_key is not None:
+            self.cache_keys[position] = stage.cache_key
+        else:
+            self.cache_keys.pop(position, None)
+
+    def add_listener(self, listener: Callable[[int, int, SimulationStage], None]) -> None:
+        """
+        @param listener: Function called with chapter index, stage index and stage after every change of a stage
+        """
+        self.listeners.append(listener)
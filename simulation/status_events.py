@@ -0,0 +1,141 @@
+import asyncio
+import copy
+import time
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+from threading import Condition
+from typing import List, Optional, Iterator, AsyncIterator
+
+from .simulation_chapter import SimulationChapter
+from .simulation_enums import SimulationStage
+from .simulation_status import ChapterStatus
+
+
+@dataclass
+class StatusEvent:
+    seq: int
+    chapter_idx: int
+    chapter: SimulationChapter
+    stage_idx: int
+    stage: SimulationStage
+
+    def to_json(self):
+        return {
+            "seq": self.seq,
+            "chapter_id": f"{self.chapter.get_as_id()}{self.chapter_idx}",
+            "stage": ChapterStatus.stage_to_json(self.stage, self.stage_idx)
+        }
+
+
+class StatusEventStream:
+    """
+    Sequence of stage changes of a single simulation. Keeps a bounded history for delta queries and pushes
+    new events to blocking (e.g. SSE) and asyncio (e.g. websocket) subscribers. History is trimmed when the stream
+    is closed, clients further behind get full status instead (finished simulations are kept until evicted).
+    """
+
+    def __init__(self, history_size: int = 10000, closed_history_size: int = 0):
+        """
+        @param history_size: Number of the latest events kept while the stream is open
+        @param closed_history_size: Number of the latest events kept after the stream is closed
+        """
+        self.history_size = history_size
+        self.closed_history_size = closed_history_size
+        self.closed = False
+        self.closed_at: Optional[float] = None
+        self.__events = deque(maxlen=history_size)
+        self.__last_seq = 0
+        self.__condition = Condition()
+        self.__async_subscribers = []
+
+    def __reduce__(self):
+        # Subscribers stay in the process which created the stream, a copy sent to another process starts empty
+        return StatusEventStream, (self.history_size, self.closed_history_size)
+
+    def publish(self, chapter_idx: int, chapter: SimulationChapter, stage_idx: int, stage: SimulationStage) -> None:
+        with self.__condition:
+            self.__last_seq += 1
+            # Stage is copied, so the event is not affected by further changes of the stage
+            event = StatusEvent(self.__last_seq, chapter_idx, chapter, stage_idx, copy.copy(stage))
+            self.__events.append(event)
+            self.__condition.notify_all()
+            for loop, queue in self.__async_subscribers:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def close(self) -> None:
+        with self.__condition:
+            self.closed = True
+            self.closed_at = time.time()
+            # Only the final changes are kept, for clients which were just behind
+            self.__events = deque(self.__events, maxlen=self.closed_history_size)
+            self.__condition.notify_all()
+            for loop, queue in self.__async_subscribers:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    def get_last_seq(self) -> int:
+        return self.__last_seq
+
+    def get_events_since(self, seq: int) -> Optional[List[StatusEvent]]:
+        """
+        @param seq: Sequence number of the last event known to the client
+        @return: Events newer than seq or None if some of them are no longer kept in history
+        """
+        with self.__condition:
+            return self.__get_events_since(seq)
+
+    def iter_events(self, since_seq: int = 0, timeout: Optional[float] = None) -> Iterator[StatusEvent]:
+        """
+        Blocking generator of events, ends when the stream is closed or no event arrives within timeout.
+        Events which are no longer kept in history are skipped.
+        """
+        last_seq = since_seq
+        while True:
+            with self.__condition:
+                events = self.__get_events_since(last_seq)
+                if events is None:
+                    events = list(self.__events)
+                if not events:
+                    if self.closed or not self.__condition.wait(timeout):
+                        return
+                    continue
+            for event in events:
+                yield event
+            last_seq = events[-1].seq
+
+    async def subscribe(self, since_seq: int = 0) -> AsyncIterator[StatusEvent]:
+        """
+        Asynchronous generator of events, ends when the stream is closed.
+        Must be iterated inside a running event loop.
+        """
+        queue = asyncio.Queue()
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.__condition:
+            backlog = self.__get_events_since(since_seq)
+            if backlog is None:
+                backlog = list(self.__events)
+            closed = self.closed
+            if not closed:
+                self.__async_subscribers.append(subscriber)
+        try:
+            for event in backlog:
+                yield event
+            if closed:
+                return
+            while (event := await queue.get()) is not None:
+                yield event
+        finally:
+            with self.__condition:
+                if subscriber in self.__async_subscribers:
+                    self.__async_subscribers.remove(subscriber)
+
+    def __get_events_since(self, seq: int) -> Optional[List[StatusEvent]]:
+        # Must be called with lock acquired
+        if seq >= self.__last_seq:
+            return []
+        if not self.__events:
+            return None
+        first_seq = self.__events[0].seq
+        if seq + 1 < first_seq:
+            return None
+        return list(islice(self.__events, seq + 1 - first_seq, None))
@@ -0,0 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Set, Callable, Optional, Awaitable, Sequence, AbstractSet
+
+from .simulation_enums import SimulationResource
+from .simulation_error import SimulationError, as_simulation_error
+from .tasks import hmse_task
+from ..hmse_projects.project_metadata import ProjectMetadata
+
+
+def build_dependency_graph(tasks: List[Callable[[ProjectMetadata], None]]) -> List[Set[int]]:
+    """
+    Find dependencies between tasks of a chapter (see tasks_conflict).
+    @param tasks: Tasks of a chapter in their sequential order
+    @return: Indices of tasks which must finish before the task with given index starts
+    """
+    return [{j for j in range(i) if tasks_conflict(tasks[j], task)} for i, task in enumerate(tasks)]
+
+
+def tasks_conflict(earlier: Callable[[ProjectMetadata], None], later: Callable[[ProjectMetadata], None],
+                   private_writes: AbstractSet[SimulationResource] = frozenset()) -> bool:
+    """
+    Check whether a task must wait for a preceding one: one of them writes a resource which the other one reads
+    or writes. Tasks without declared resources conflict with all other tasks.
+    @param private_writes: Resources which the later task writes to its own copy (e.g. files of its iteration)
+    """
+    earlier_resources = hmse_task.get_task_resources(earlier)
+    later_resources = hmse_task.get_task_resources(later)
+    if earlier_resources is None or later_resources is None:
+        return True
+    prev_reads, prev_writes = earlier_resources
+    reads, writes = later_resources
+    writes = writes - private_writes
+    return bool(prev_writes & (reads | writes) or prev_reads & writes)
+
+
+class DagScheduler:
+
+    def __init__(self, max_parallel_tasks: Optional[int] = None):
+        self.max_parallel_tasks = max_parallel_tasks
+
+    def run(self, dependencies: Sequence[AbstractSet[int]], run_stage: Callable[[int], None]) -> None:
+        """
+        Run tasks of a chapter, each one as soon as all tasks it depends on have finished.
+        After the first failure no new tasks are started, running ones are awaited and the error is raised
+        (as SimulationError, see as_simulation_error).
+        @param dependencies: Dependency graph of chapter tasks (see build_dependency_graph)
+        @param run_stage: Function launching the task with given index
+        """
+        remaining_dependencies = [set(d) for d in dependencies]
+        not_started = set(range(len(dependencies)))
+        error = None
+        max_workers = self.max_parallel_tasks or max(len(dependencies), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            running = {}
+            while True:
+                if error is None:
+                    for i in sorted(not_started):
+                        if not remaining_dependencies[i]:
+                            not_started.remove(i)
+                            running[pool.submit(run_stage, i)] = i
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    for task_dependencies in remaining_dependencies:
+                        task_dependencies.discard(finished)
+
+        if isinstance(error, SimulationError):
+            raise error
+        if error is not None:
+            raise as_simulation_error(error) from error
+
+    async def run_async(self, dependencies: Sequence[AbstractSet[int]],
+                        run_stage: Callable[[int], Awaitable[None]]) -> None:
+        """
+        Asynchronous counterpart of run, stages are launched as coroutines on the running event loop.
+        @param dependencies: Dependency graph of chapter tasks (see build_dependency_graph)
+        @param run_stage: Coroutine function launching the task with given index
+        """
+        # Imported here (already loaded by the running event loop), so synchronous users don't import asyncio
+        import asyncio
+        remaining_dependencies = [set(d) for d in dependencies]
+        not_started = set(range(len(dependencies)))
+        limit = asyncio.Semaphore(self.max_parallel_tasks or max(len(dependencies), 1))
+        error = None
+        running = {}
+
+        async def run_limited(i: int) -> None:
+            async with limit:
+                await run_stage(i)
+
+        while True:
+            if error is None:
+                for i in sorted(not_started):
+                    if not remaining_dependencies[i]:
+                        not_started.remove(i)
+                        running[asyncio.ensure_future(run_limited(i))] = i
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                finished = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                for task_dependencies in remaining_dependencies:
+                    task_dependencies.discard(finished)
+
+        if isinstance(error, SimulationError):
+            raise error
+        if error is not None:
+            raise as_simulation_error(error) from error
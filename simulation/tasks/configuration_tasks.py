@@ -1,10 +1,11 @@
 import logging
 from time import sleep
 
-from .hmse_task import hmse_task
-from ..simulation_enums import SimulationStageName
+from .hmse_task import hmse_task, get_stage_chapter_idx, get_stage_workspace, get_stage_output_writer
+from ..simulation_enums import SimulationStageName, SimulationResource
 from ...hmse_projects.hmse_hydrological_models.processing.task_logic import configuration_tasks_logic
 from ...hmse_projects.project_metadata import ProjectMetadata
+from ...hmse_projects.simulation_mode import SimulationMode
 
 
 class ConfigurationTasks:
@@ -16,43 +17,103 @@ class ConfigurationTasks:
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.SAVE_REFERENCE_HYDRUS_MODELS)
+    @hmse_task(stage_name=SimulationStageName.SAVE_REFERENCE_HYDRUS_MODELS,
+               reads=(SimulationResource.HYDRUS_MODELS,),
+               writes=(SimulationResource.REFERENCE_HYDRUS_MODELS,),
+               cache_key_fields=())
     def save_reference_hydrus_models(project_metadata: ProjectMetadata) -> None:
-        logging.info("Hydrus reference models save mock")
+        if get_stage_workspace() is not None:
+            # Reference models are cloned in the workspace (see scratch_workspace.clone_tree) instead of copied
+            logging.info("Hydrus reference models clone mock")
+        else:
+            logging.info("Hydrus reference models save mock")
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.OUTPUT_EXTRACTION_TO_JSON)
+    @hmse_task(stage_name=SimulationStageName.OUTPUT_EXTRACTION_TO_JSON,
+               reads=(SimulationResource.HYDRUS_OUTPUT,
+                      SimulationResource.MODFLOW_OUTPUT,
+                      SimulationResource.ITERATION_FILES),
+               writes=(SimulationResource.SIMULATION_OUTPUT,))
     def output_extraction_to_json(project_metadata: ProjectMetadata) -> None:
-        logging.info("Output extraction to JSON mock")
+        # In feedback mode results of steps are appended by their chapters (see output_stream), only index is
+        # written; finalization chapter follows the step chapters, so its index is the number of steps
+        writer = get_stage_output_writer()
+        if project_metadata.simulation_mode == SimulationMode.WITH_FEEDBACK and writer is not None \
+                and writer.get_written_steps() >= set(range(get_stage_chapter_idx())):
+            writer.finalize()
+            logging.info("Output index finalized")
+        else:
+            logging.info("Output extraction to JSON mock")
+            sleep(1)
+
+    @staticmethod
+    @hmse_task(stage_name=SimulationStageName.ITERATION_OUTPUT_EXTRACTION_TO_JSON,
+               reads=(SimulationResource.HYDRUS_OUTPUT,
+                      SimulationResource.MODFLOW_OUTPUT,
+                      SimulationResource.ITERATION_FILES),
+               writes=(SimulationResource.SIMULATION_OUTPUT,))
+    def iteration_output_extraction_to_json(project_metadata: ProjectMetadata) -> None:
+        # Warmup chapter is the step 0, each feedback iteration simulates the next step
+        step_idx = get_stage_chapter_idx()
+        logging.info(f"Step {step_idx} output extraction to JSON mock")
         sleep(1)
+        writer = get_stage_output_writer()
+        if writer is not None:
+            writer.append_step(step_idx, {})
 
     @staticmethod
     @hmse_task(stage_name=SimulationStageName.CLEANUP)
     def cleanup(project_metadata: ProjectMetadata) -> None:
+        workspace = get_stage_workspace()
+        if workspace is not None:
+            # Iterations exist only in the workspace, results are written to the project store in one pass
+            written = workspace.sync()
+            workspace.remove()
+            logging.info(f"Synced {written} files of scratch workspace to the project store")
         logging.info("Cleanup mock")
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.INITIALIZE_NEW_ITERATION_FILES)
+    @hmse_task(stage_name=SimulationStageName.INITIALIZE_NEW_ITERATION_FILES,
+               reads=(SimulationResource.MODFLOW_MODEL,),
+               writes=(SimulationResource.ITERATION_FILES,),
+               prefetchable=True)
     def initialize_new_iteration_files(project_metadata: ProjectMetadata) -> None:
+        workspace = get_stage_workspace()
+        chapter_idx = get_stage_chapter_idx()
+        if workspace is not None and not workspace.has_iteration(chapter_idx):
+            workspace.create_iteration(chapter_idx)
+        # Files of the iteration modified in place are materialized first, they are linked to the previous iteration
         logging.info("New interation files' initialization mock")
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.CREATE_PER_ZONE_HYDRUS_MODELS)
+    @hmse_task(stage_name=SimulationStageName.CREATE_PER_ZONE_HYDRUS_MODELS,
+               reads=(SimulationResource.HYDRUS_MODELS,),
+               writes=(SimulationResource.PER_ZONE_HYDRUS_MODELS,),
+               cache_key_fields=("shapes_to_hydrus",))
     def create_per_zone_hydrus_models(project_metadata: ProjectMetadata) -> None:
         logging.info("Per zone hydrus models mock")
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.ITERATION_PRE_CONFIGURATION)
+    @hmse_task(stage_name=SimulationStageName.ITERATION_PRE_CONFIGURATION,
+               reads=(SimulationResource.ITERATION_FILES,),
+               writes=(SimulationResource.ITERATION_FILES,),
+               prefetchable=True)
     def iteration_pre_configuration(project_metadata: ProjectMetadata) -> None:
+        workspace = get_stage_workspace()
+        if workspace is not None:
+            # Files of the previous iteration are linked instead of copied
+            workspace.create_iteration(get_stage_chapter_idx())
         logging.info("Iteration preconfiguration mock")
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.FEEDBACK_SAVE_OUTPUT_ITERATION)
+    @hmse_task(stage_name=SimulationStageName.FEEDBACK_SAVE_OUTPUT_ITERATION,
+               reads=(SimulationResource.ITERATION_FILES,),
+               writes=(SimulationResource.SIMULATION_OUTPUT,))
     def save_last_iteration(project_metadata: ProjectMetadata) -> None:
         logging.info("Final interation save mock")
         sleep(1)
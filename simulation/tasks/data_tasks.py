@@ -1,39 +1,103 @@
 import logging
 from time import sleep
+from typing import List
+
+import numpy as np
 
 from .hmse_task import hmse_task
-from ..simulation_enums import SimulationStageName
+from ..coupling_exchange import ExchangeArray, get_stage_exchange, zone_recharge_to_grid, \
+    grid_heads_to_zone_water_table
+from ..simulation_enums import SimulationStageName, SimulationResource
 from ...hmse_projects.project_metadata import ProjectMetadata
 
+# Mock Modflow grid (rows x cols), real grid and zone masks come from the project's Modflow model and shapes
+_MOCK_GRID_SHAPE = (10, 10)
+
 
 class DataTasks:
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.WEATHER_DATA_TRANSFER)
+    @hmse_task(stage_name=SimulationStageName.WEATHER_DATA_TRANSFER,
+               reads=(SimulationResource.WEATHER_DATA, SimulationResource.HYDRUS_MODELS),
+               writes=(SimulationResource.HYDRUS_MODELS,),
+               cache_key_fields=("hydrus_to_weather",))
     def weather_data_to_hydrus(project_metadata: ProjectMetadata) -> None:
         logging.info("Weather data transfer mock")
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.HYDRUS_TO_MODFLOW_DATA_PASSING)
+    @hmse_task(stage_name=SimulationStageName.HYDRUS_TO_MODFLOW_DATA_PASSING,
+               reads=(SimulationResource.HYDRUS_OUTPUT,),
+               writes=(SimulationResource.COUPLING_DATA,),
+               cache_key_fields=("shapes_to_hydrus",))
     def hydrus_to_modflow(project_metadata: ProjectMetadata) -> None:
         logging.info("Hydrus -> Modflow transfer mock")
         sleep(1)
+        exchange = get_stage_exchange()
+        if exchange is None:
+            return
+        zones = _get_zones(project_metadata)
+        steps = len(project_metadata.modflow_metadata.steps_info) if project_metadata.modflow_metadata else 1
+        for zone in zones:
+            # Mock of parsing bottom flux of the zone's Hydrus model output
+            exchange.write_array(ExchangeArray.ZONE_RECHARGE, zone, np.full(steps, 1e-3))
+        zone_recharge = np.stack([exchange.read_array(ExchangeArray.ZONE_RECHARGE, zone) for zone in zones]) \
+            if zones else np.zeros((0, steps))
+        grid_recharge = zone_recharge_to_grid(_get_mock_zone_masks(len(zones)), zone_recharge)
+        exchange.write_array(ExchangeArray.GRID_RECHARGE, "0", grid_recharge)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.MODFLOW_TO_HYDRUS_DATA_PASSING)
+    @hmse_task(stage_name=SimulationStageName.MODFLOW_TO_HYDRUS_DATA_PASSING,
+               reads=(SimulationResource.MODFLOW_OUTPUT, SimulationResource.ITERATION_FILES),
+               writes=(SimulationResource.COUPLING_DATA,),
+               cache_key_fields=("shapes_to_hydrus",))
     def modflow_to_hydrus(project_metadata: ProjectMetadata) -> None:
         logging.info("Modflow -> Hydrus transfer mock")
         sleep(1)
+        exchange = get_stage_exchange()
+        if exchange is None:
+            return
+        # Mock of parsing heads of the top layer from Modflow output and the layer's top elevation
+        heads = np.full(_MOCK_GRID_SHAPE, 9.0)
+        surface = np.full(_MOCK_GRID_SHAPE, 10.0)
+        exchange.write_array(ExchangeArray.LAYER_HEADS, "0", heads)
+        zones = _get_zones(project_metadata)
+        water_table = grid_heads_to_zone_water_table(_get_mock_zone_masks(len(zones)),
+                                                     exchange.read_array(ExchangeArray.LAYER_HEADS, "0"), surface)
+        for zone, depth in zip(zones, water_table):
+            exchange.write_array(ExchangeArray.ZONE_WATER_TABLE, zone, np.atleast_1d(depth))
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.MODFLOW_INIT_CONDITION_TRANSFER_STEADY_STATE)
+    @hmse_task(stage_name=SimulationStageName.MODFLOW_INIT_CONDITION_TRANSFER_STEADY_STATE,
+               reads=(SimulationResource.MODFLOW_MODEL,
+                      SimulationResource.ITERATION_FILES,
+                      SimulationResource.PER_ZONE_HYDRUS_MODELS),
+               writes=(SimulationResource.MODFLOW_OUTPUT, SimulationResource.PER_ZONE_HYDRUS_MODELS),
+               cache_key_fields=("shapes_to_hydrus", "modflow_metadata"))
     def modflow_init_condition_transfer_steady_state(project_metadata: ProjectMetadata) -> None:
         logging.info("Hydrus mock initialization using steady state Modflow 1st step")
         sleep(1)
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.MODFLOW_INIT_CONDITION_TRANSFER_TRANSIENT)
+    @hmse_task(stage_name=SimulationStageName.MODFLOW_INIT_CONDITION_TRANSFER_TRANSIENT,
+               reads=(SimulationResource.MODFLOW_MODEL,
+                      SimulationResource.ITERATION_FILES,
+                      SimulationResource.PER_ZONE_HYDRUS_MODELS),
+               writes=(SimulationResource.PER_ZONE_HYDRUS_MODELS,),
+               cache_key_fields=("shapes_to_hydrus", "modflow_metadata"))
     def modflow_init_condition_transfer_transient(project_metadata: ProjectMetadata) -> None:
         logging.info("Hydrus mock initialization using transient Modflow 1st step")
         sleep(1)
+
+
+def _get_zones(project_metadata: ProjectMetadata) -> List[str]:
+    return sorted(shape_id for shape_id, hydrus_id in project_metadata.shapes_to_hydrus.items()
+                  if isinstance(hydrus_id, str))
+
+
+def _get_mock_zone_masks(zones: int) -> np.ndarray:
+    # Zones cover consecutive bands of grid rows
+    masks = np.zeros((zones,) + _MOCK_GRID_SHAPE, dtype=bool)
+    for zone, rows in enumerate(np.array_split(np.arange(_MOCK_GRID_SHAPE[0]), zones) if zones else []):
+        masks[zone, rows, :] = True
+    return masks
@@ -1,26 +1,399 @@
 # Decorator for checking metadata in function
+import contextvars
+import inspect
+import time
+from concurrent.futures import Executor, Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
-from typing import Callable
+from threading import Thread
+from typing import Any, Awaitable, Callable, Optional, Iterable, FrozenSet, Tuple, Dict, Union
 
-from ..simulation_enums import SimulationStageName
+from . import task_registry
+from ..cancellation import CancellationToken, CANCELLATION_POLL_INTERVAL
+from ..output_stream import StepOutputWriter
+from ..scratch_workspace import ScratchWorkspace
+from ..simulation_enums import SimulationStageName, SimulationResource
+from ..simulation_error import StageTimedOut
+from ..stage_metrics import StageMetrics, measure_stage
 from ...hmse_projects.project_metadata import ProjectMetadata
 
 __TASK_TO_NAME_MAPPING = {}
+__ID_TO_TASK_MAPPING = {}
+__TASK_TO_RESOURCES_MAPPING = {}
+__TASK_TO_CACHE_KEY_FIELDS_MAPPING = {}
+__PREFETCHABLE_TASKS = set()
+__STAGE_PROGRESS_REPORTER: ContextVar[Optional[Callable[[int, int], None]]] = ContextVar("stage_progress_reporter",
+                                                                                         default=None)
+__STAGE_METRICS_RECEIVER: ContextVar[Optional[Callable[[StageMetrics], None]]] = ContextVar("stage_metrics_receiver",
+                                                                                            default=None)
+__STAGE_CHAPTER_IDX: ContextVar[Optional[int]] = ContextVar("stage_chapter_idx", default=None)
+__STAGE_CANCELLATION: ContextVar[Optional[Tuple[CancellationToken, Optional[float]]]] = \
+    ContextVar("stage_cancellation", default=None)
+__STAGE_WORKSPACE: ContextVar[Optional[ScratchWorkspace]] = ContextVar("stage_workspace", default=None)
+__STAGE_EXCHANGE_DIR: ContextVar[Optional[str]] = ContextVar("stage_exchange_dir", default=None)
+__STAGE_OUTPUT_WRITER: ContextVar[Optional[StepOutputWriter]] = ContextVar("stage_output_writer", default=None)
 
 
-def hmse_task(stage_name: SimulationStageName):
+def hmse_task(stage_name: SimulationStageName,
+              reads: Optional[Iterable[SimulationResource]] = None,
+              writes: Optional[Iterable[SimulationResource]] = None,
+              cache_key_fields: Optional[Iterable[str]] = None,
+              prefetchable: bool = False):
+    """
+    Register function as a simulation task.
+    @param stage_name: Name of the stage displayed for the task
+    @param reads: Resources used by the task; if neither reads nor writes are declared,
+                  the task is run after all preceding tasks and before all following tasks of the chapter
+    @param writes: Resources modified by the task
+    @param cache_key_fields: ProjectMetadata fields affecting the task's output; if declared (along with resources),
+                             outputs of the task can be cached
+    @param prefetchable: Whether the task only stages files of its own chapter (see get_stage_chapter_idx),
+                         so it can run ahead while the previous chapter is still running
+    """
     def hmse_decorator(func: Callable):
         @wraps(func)
         def checking_wrapper(*args, **kwargs):
-            total_args = list(args) + list(kwargs.values())
-            if not any(map(lambda arg: isinstance(arg, ProjectMetadata), total_args)):
-                raise RuntimeError("HMSE task requires ProjectMetadata as an argument")
-            return func(*args, **kwargs)
+            __check_metadata_argument(args, kwargs)
+            check_cancelled()
+            with measure_stage(__STAGE_METRICS_RECEIVER.get()):
+                return func(*args, **kwargs)
 
+        # Coroutine tasks (e.g. awaiting solver processes) are awaited by AsyncSimulation
+        @wraps(func)
+        async def async_checking_wrapper(*args, **kwargs):
+            __check_metadata_argument(args, kwargs)
+            check_cancelled()
+            with measure_stage(__STAGE_METRICS_RECEIVER.get()):
+                return await func(*args, **kwargs)
+
+        wrapper = async_checking_wrapper if inspect.iscoroutinefunction(func) else checking_wrapper
         __TASK_TO_NAME_MAPPING[func.__name__] = stage_name
-        return checking_wrapper
+        __ID_TO_TASK_MAPPING[func.__name__] = wrapper
+        if reads is not None or writes is not None:
+            __TASK_TO_RESOURCES_MAPPING[func.__name__] = (frozenset(reads or ()), frozenset(writes or ()))
+        if cache_key_fields is not None:
+            __TASK_TO_CACHE_KEY_FIELDS_MAPPING[func.__name__] = tuple(cache_key_fields)
+        if prefetchable:
+            __PREFETCHABLE_TASKS.add(func.__name__)
+        return wrapper
     return hmse_decorator
 
 
+def __check_metadata_argument(args, kwargs) -> None:
+    total_args = list(args) + list(kwargs.values())
+    if not any(map(lambda arg: isinstance(arg, ProjectMetadata), total_args)):
+        raise RuntimeError("HMSE task requires ProjectMetadata as an argument")
+
+
+class LazyTask:
+    """
+    Task of the static registry (see task_registry), module defining the task is imported when it is called
+    for the first time. Stage name and declarations of the task are read from the registry.
+    """
+
+    def __init__(self, task_id: str):
+        self.__name__ = task_id
+
+    def __reduce__(self):
+        return LazyTask, (self.__name__,)
+
+    def __repr__(self):
+        return f"LazyTask({self.__name__})"
+
+    def __call__(self, *args, **kwargs):
+        return get_task(self.__name__)(*args, **kwargs)
+
+
+def resolve_task(task: Callable) -> Callable:
+    """
+    @return: Task registered with hmse_task decorator (importing its module if the task is lazy)
+    """
+    return get_task(task.__name__) if isinstance(task, LazyTask) else task
+
+
+def get_registered_tasks() -> Dict[str, Callable]:
+    """
+    @return: Tasks registered with hmse_task decorator so far (by modules imported until now)
+    """
+    return dict(__ID_TO_TASK_MAPPING)
+
+
 def get_stage_name(task: Callable):
-    return __TASK_TO_NAME_MAPPING[task.__name__]
+    name = task.__name__
+    if name in __TASK_TO_NAME_MAPPING:
+        return __TASK_TO_NAME_MAPPING[name]
+    return task_registry.TASK_REGISTRY[name].stage_name
+
+
+def get_task_id(task: Callable) -> str:
+    """
+    @return: Identifier of the task, which can be sent to other processes (e.g. simulation workers)
+    """
+    return task.__name__
+
+
+def get_task(task_id: str) -> Callable:
+    """
+    @param task_id: Identifier returned by get_task_id; module defining the task is imported if it is in the static
+                    registry, otherwise it must be imported already
+    @return: Task registered with hmse_task decorator
+    """
+    if task_id not in __ID_TO_TASK_MAPPING and task_id in task_registry.TASK_REGISTRY:
+        task_registry.import_task_module(task_id)
+    return __ID_TO_TASK_MAPPING[task_id]
+
+
+def get_task_resources(task: Callable) -> Optional[Tuple[FrozenSet[SimulationResource], FrozenSet[SimulationResource]]]:
+    """
+    @param task: Task registered with hmse_task decorator or in the static registry
+    @return: Resources read and written by the task or None if they were not declared
+    """
+    name = task.__name__
+    if name in __ID_TO_TASK_MAPPING:
+        return __TASK_TO_RESOURCES_MAPPING.get(name)
+    spec = task_registry.TASK_REGISTRY.get(name)
+    return spec.get_resources() if spec is not None else None
+
+
+def get_cache_key_fields(task: Callable) -> Optional[Tuple[str, ...]]:
+    name = task.__name__
+    if name in __ID_TO_TASK_MAPPING:
+        return __TASK_TO_CACHE_KEY_FIELDS_MAPPING.get(name)
+    spec = task_registry.TASK_REGISTRY.get(name)
+    return spec.cache_key_fields if spec is not None else None
+
+
+def is_prefetchable(task: Callable) -> bool:
+    name = task.__name__
+    if name in __ID_TO_TASK_MAPPING:
+        return name in __PREFETCHABLE_TASKS
+    spec = task_registry.TASK_REGISTRY.get(name)
+    return spec is not None and spec.prefetchable
+
+
+@contextmanager
+def stage_progress_reporter(reporter: Callable[[int, int], None]):
+    """
+    Set the function receiving sub-task progress of the currently executed stage.
+    @param reporter: Function accepting number of completed sub-tasks and total number of sub-tasks
+    """
+    token = __STAGE_PROGRESS_REPORTER.set(reporter)
+    try:
+        yield
+    finally:
+        __STAGE_PROGRESS_REPORTER.reset(token)
+
+
+@contextmanager
+def stage_metrics_receiver(receiver: Callable[[StageMetrics], None]):
+    """
+    Set the function receiving resource usage metrics of tasks executed in the current context.
+    @param receiver: Function accepting metrics of a finished (or failed) task
+    """
+    token = __STAGE_METRICS_RECEIVER.set(receiver)
+    try:
+        yield
+    finally:
+        __STAGE_METRICS_RECEIVER.reset(token)
+
+
+@contextmanager
+def stage_chapter(chapter_idx: int):
+    """
+    Set index of the chapter which the currently executed stage belongs to.
+    """
+    token = __STAGE_CHAPTER_IDX.set(chapter_idx)
+    try:
+        yield
+    finally:
+        __STAGE_CHAPTER_IDX.reset(token)
+
+
+def get_stage_chapter_idx() -> Optional[int]:
+    """
+    @return: Index of the chapter (e.g. feedback iteration) of the executed stage, tasks use it to locate files
+             of their iteration instead of assuming the latest one, so the next iteration can be staged in advance
+    """
+    return __STAGE_CHAPTER_IDX.get()
+
+
+@contextmanager
+def stage_workspace(workspace: Optional[ScratchWorkspace]):
+    """
+    Set scratch workspace of the simulation of the currently executed stage.
+    """
+    token = __STAGE_WORKSPACE.set(workspace)
+    try:
+        yield
+    finally:
+        __STAGE_WORKSPACE.reset(token)
+
+
+def get_stage_workspace() -> Optional[ScratchWorkspace]:
+    """
+    @return: Scratch workspace the executed stage works in (see ScratchWorkspace), None if the simulation works
+             directly in the project store
+    """
+    return __STAGE_WORKSPACE.get()
+
+
+@contextmanager
+def stage_exchange_dir(exchange_dir: Optional[str]):
+    """
+    Set directory of coupling data of the chapter of the currently executed stage.
+    """
+    token = __STAGE_EXCHANGE_DIR.set(exchange_dir)
+    try:
+        yield
+    finally:
+        __STAGE_EXCHANGE_DIR.reset(token)
+
+
+def get_stage_exchange_dir() -> Optional[str]:
+    """
+    @return: Directory of arrays the executed stage exchanges with other stages of its chapter (see
+             CouplingExchange), None if the stage runs apart from its simulation (e.g. on a distributed worker)
+    """
+    return __STAGE_EXCHANGE_DIR.get()
+
+
+@contextmanager
+def stage_output_writer(writer: Optional[StepOutputWriter]):
+    """
+    Set writer of incremental output of the simulation of the currently executed stage.
+    """
+    token = __STAGE_OUTPUT_WRITER.set(writer)
+    try:
+        yield
+    finally:
+        __STAGE_OUTPUT_WRITER.reset(token)
+
+
+def get_stage_output_writer() -> Optional[StepOutputWriter]:
+    """
+    @return: Writer the executed stage appends results of its step to (see StepOutputWriter), None if the output
+             is extracted in one pass by the final stage
+    """
+    return __STAGE_OUTPUT_WRITER.get()
+
+
+@contextmanager
+def stage_cancellation(token: CancellationToken, deadline: Optional[float] = None):
+    """
+    Set cancellation token and time limit of the currently executed stage.
+    @param deadline: time.monotonic() value after which the stage is timed out, None for no limit
+    """
+    token_reset = __STAGE_CANCELLATION.set((token, deadline))
+    try:
+        yield
+    finally:
+        __STAGE_CANCELLATION.reset(token_reset)
+
+
+def check_cancelled() -> None:
+    """
+    Stop the executed stage if its simulation was cancelled or the stage exceeded its time limit. Long-running tasks
+    call it between units of work, so cancelled simulations free their workers quickly.
+    @raise SimulationCancelled: Simulation was cancelled (e.g. preempted by a new simulation of the project)
+    @raise StageTimedOut: Stage has run longer than its time limit
+    """
+    cancellation = __STAGE_CANCELLATION.get()
+    if cancellation is None:
+        return
+    token, deadline = cancellation
+    token.raise_if_cancelled()
+    if deadline is not None and time.monotonic() > deadline:
+        raise StageTimedOut()
+
+
+def get_check_interval() -> float:
+    """
+    @return: Time until the next check of cancellation of the executed stage, its time limit is checked right
+             when it passes
+    """
+    cancellation = __STAGE_CANCELLATION.get()
+    if cancellation is None or cancellation[1] is None:
+        return CANCELLATION_POLL_INTERVAL
+    return min(CANCELLATION_POLL_INTERVAL, max(cancellation[1] - time.monotonic(), 0.001))
+
+
+def run_task(task: Callable[[ProjectMetadata], None], project_metadata: ProjectMetadata) -> Any:
+    """
+    Run a task in the current thread, coroutine tasks (e.g. awaiting solver processes) are run on an event loop
+    of their own.
+    """
+    result = task(project_metadata)
+    if inspect.isawaitable(result):
+        # Event loop is only needed by coroutine tasks, so asyncio is not imported on start
+        import asyncio
+        return asyncio.run(result)
+    return result
+
+
+def start_stage(task: Callable[[ProjectMetadata], None], project_metadata: ProjectMetadata,
+                executor: Optional[Executor] = None) -> Future:
+    """
+    Start the task of a stage in another thread with the current stage context (cancellation, time limit,
+    progress reporting), so the stage can stop being awaited while the task is still stopping (see await_stage).
+    Coroutine tasks are run by run_task.
+    @param executor: Executor running the task, a new thread by default
+    @return: Future finished when the task has stopped
+    """
+    context = contextvars.copy_context()
+    if executor is not None:
+        return executor.submit(context.run, run_task, task, project_metadata)
+    stage_run = Future()
+
+    def run_stage() -> None:
+        if not stage_run.set_running_or_notify_cancel():
+            return
+        try:
+            stage_run.set_result(context.run(run_task, task, project_metadata))
+        except BaseException as error:
+            stage_run.set_exception(error)
+
+    Thread(target=run_stage, name=f"stage-{get_task_id(task)}", daemon=True).start()
+    return stage_run
+
+
+def await_stage(stage_run: Future) -> Any:
+    """
+    Wait for a task started by start_stage. Time limit and cancellation are enforced here, they don't depend on
+    the task checking them: once exceeded (or cancelled), the stage stops being awaited. The task keeps its
+    sub-task and solver processes only until its next check_cancelled (they are terminated then).
+    @raise SimulationCancelled: Simulation was cancelled
+    @raise StageTimedOut: Stage has run longer than its time limit
+    """
+    while True:
+        try:
+            return stage_run.result(timeout=get_check_interval())
+        except FutureTimeoutError:
+            check_cancelled()
+
+
+async def await_stage_async(stage_run: Union[Future, Awaitable]) -> Any:
+    """
+    Await a coroutine task (or a task started by start_stage) like await_stage. A coroutine task which is
+    not awaited anymore is cancelled, so its solver processes are terminated right away (a task started
+    by start_stage is cancelled only if it is still waiting for its executor).
+    @raise SimulationCancelled: Simulation was cancelled
+    @raise StageTimedOut: Stage has run longer than its time limit
+    """
+    import asyncio
+    awaited = asyncio.wrap_future(stage_run) if isinstance(stage_run, Future) else stage_run
+    while True:
+        done, _ = await asyncio.wait({awaited}, timeout=get_check_interval())
+        if done:
+            return awaited.result()
+        try:
+            check_cancelled()
+        except BaseException:
+            stage_run.cancel()
+            raise
+
+
+def report_progress(completed: int, total: int) -> None:
+    reporter = __STAGE_PROGRESS_REPORTER.get()
+    if reporter is not None:
+        reporter(completed, total)
@@ -1,27 +1,96 @@
 import logging
+import os
+import sys
 from time import sleep
+from typing import List
+
+import numpy as np
 
 from .hmse_task import hmse_task
-from ..simulation_enums import SimulationStageName
+from .solver_process import run_solver
+from .subtask_pool import run_subtasks_async
+from ..coupling_exchange import CouplingExchange, ExchangeArray, get_stage_exchange
+from ..simulation_enums import SimulationStageName, SimulationResource
 from ...hmse_projects.project_metadata import ProjectMetadata
+from ...hmse_projects.simulation_mode import SimulationMode
+from ...hmse_projects.typing_help import ProjectID
 
 
 class SimulationTasks:
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.HYDRUS_SIMULATION)
-    def hydrus_simulation(project_metadata: ProjectMetadata) -> None:
-        logging.info("Hydrus simulation mock")
-        sleep(1)
+    @hmse_task(stage_name=SimulationStageName.HYDRUS_SIMULATION,
+               reads=(SimulationResource.HYDRUS_MODELS, SimulationResource.PER_ZONE_HYDRUS_MODELS,
+                      SimulationResource.COUPLING_DATA),
+               # Per zone models are updated from coupling data (water table) right before the solver runs
+               writes=(SimulationResource.HYDRUS_OUTPUT, SimulationResource.PER_ZONE_HYDRUS_MODELS),
+               cache_key_fields=("simulation_mode", "shapes_to_hydrus"))
+    async def hydrus_simulation(project_metadata: ProjectMetadata) -> None:
+        models = SimulationTasks.__get_hydrus_models_to_simulate(project_metadata)
+        exchange = get_stage_exchange()
+        if exchange is not None:
+            for model in models:
+                # Per zone models get initial conditions from the water table of the previous Modflow step
+                if exchange.has_array(ExchangeArray.ZONE_WATER_TABLE, model):
+                    exchange.materialize(ExchangeArray.ZONE_WATER_TABLE, model,
+                                         _get_solver_input_path(exchange, f"{model}-profile.dat"), _write_array)
+        await run_subtasks_async(_simulate_hydrus_model, [(project_metadata.project_id, model) for model in models])
+
+    @staticmethod
+    @hmse_task(stage_name=SimulationStageName.HYDRUS_SIMULATION_WARMUP,
+               reads=(SimulationResource.PER_ZONE_HYDRUS_MODELS,),
+               writes=(SimulationResource.HYDRUS_OUTPUT,),
+               cache_key_fields=("simulation_mode", "shapes_to_hydrus"))
+    async def hydrus_simulation_warmup(project_metadata: ProjectMetadata) -> None:
+        models = SimulationTasks.__get_hydrus_models_to_simulate(project_metadata)
+        await run_subtasks_async(_simulate_hydrus_model_warmup, [(project_metadata.project_id, model) for model in models])
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.HYDRUS_SIMULATION_WARMUP)
-    def hydrus_simulation_warmup(project_metadata: ProjectMetadata) -> None:
+    @hmse_task(stage_name=SimulationStageName.MODFLOW_SIMULATION,
+               reads=(SimulationResource.MODFLOW_MODEL, SimulationResource.ITERATION_FILES,
+                      SimulationResource.COUPLING_DATA),
+               # Recharge of the model is updated from coupling data right before the solver runs
+               writes=(SimulationResource.MODFLOW_OUTPUT, SimulationResource.MODFLOW_MODEL),
+               cache_key_fields=("modflow_metadata",))
+    async def modflow_simulation(project_metadata: ProjectMetadata) -> None:
+        exchange = get_stage_exchange()
+        if exchange is not None and exchange.has_array(ExchangeArray.GRID_RECHARGE, "0"):
+            exchange.materialize(ExchangeArray.GRID_RECHARGE, "0", _get_solver_input_path(exchange, "recharge.rch"),
+                                 _write_array)
         logging.info("Modflow simulation mock")
-        sleep(1)
+        await run_solver(_get_mock_solver_command(1))
 
     @staticmethod
-    @hmse_task(stage_name=SimulationStageName.MODFLOW_SIMULATION)
-    def modflow_simulation(project_metadata: ProjectMetadata) -> None:
-        logging.info("Hydrus warmup simulation mock")
-        sleep(1)
+    def __get_hydrus_models_to_simulate(project_metadata: ProjectMetadata) -> List[str]:
+        # In feedback mode each zone (shape) has its own copy of Hydrus model
+        if project_metadata.simulation_mode == SimulationMode.WITH_FEEDBACK:
+            return sorted(shape_id for shape_id, hydrus_id in project_metadata.shapes_to_hydrus.items()
+                          if isinstance(hydrus_id, str))
+        return sorted({hydrus_id for hydrus_id in project_metadata.shapes_to_hydrus.values()
+                       if isinstance(hydrus_id, str)})
+
+
+def _get_mock_solver_command(seconds: float) -> List[str]:
+    # Mock of a solver process, the real solver executables and model files are located by hmse_projects processing
+    return [sys.executable, "-c", f"import time; time.sleep({seconds})"]
+
+
+def _get_solver_input_path(exchange: CouplingExchange, file_name: str) -> str:
+    # Mock location, model files of the project are located by hmse_projects processing
+    return os.path.join(exchange.exchange_dir, "solver_input", file_name)
+
+
+def _write_array(array: np.ndarray, path: str) -> None:
+    # Mock of the solver's input format, one row per time step (or value)
+    np.savetxt(path, array.reshape(array.shape[0], -1) if array.ndim > 1 else array)
+
+
+# Sub-tasks are module level functions, so they can be sent to worker processes
+def _simulate_hydrus_model(project_id: ProjectID, model_id: str) -> None:
+    logging.info(f"Hydrus simulation mock ({project_id}: {model_id})")
+    sleep(1)
+
+
+def _simulate_hydrus_model_warmup(project_id: ProjectID, model_id: str) -> None:
+    logging.info(f"Hydrus warmup simulation mock ({project_id}: {model_id})")
+    sleep(1)
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from . import hmse_task
+from ..cancellation import CANCELLATION_POLL_INTERVAL
+from ..simulation_error import SimulationError
+
+
+async def run_solver(args: List[str], cwd: Optional[str] = None) -> None:
+    """
+    Run external solver (Hydrus, Modflow) without blocking the event loop. Solver is killed when the stage
+    is cancelled or exceeds its time limit.
+    @param args: Solver executable followed by its arguments
+    @param cwd: Working directory of the solver (usually model directory)
+    """
+    process = await asyncio.create_subprocess_exec(*args, cwd=cwd,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    communication = asyncio.ensure_future(process.communicate())
+    try:
+        while not communication.done():
+            await asyncio.wait({communication}, timeout=CANCELLATION_POLL_INTERVAL)
+            if not communication.done():
+                hmse_task.check_cancelled()
+        stdout, stderr = communication.result()
+    except (asyncio.CancelledError, SimulationError):
+        communication.cancel()
+        process.kill()
+        await process.wait()
+        raise
+
+    logging.debug(stdout.decode(errors="replace"))
+    if process.returncode != 0:
+        logging.error(f"Solver {args[0]} failed with code {process.returncode}: {stderr.decode(errors='replace')}")
+        raise SimulationError(description=f"Solver {args[0]} failed with code {process.returncode}!")
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from contextlib import contextmanager
+from multiprocessing.pool import AsyncResult
+from threading import Condition
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from . import hmse_task
+from ..cancellation import CANCELLATION_POLL_INTERVAL
+from ..simulation_error import SimulationError
+
+__MAX_WORKERS: Optional[int] = None
+__USED_WORKERS = 0
+__WORKERS_CONDITION = Condition()
+
+
+def configure_subtask_pool(max_workers: Optional[int]) -> None:
+    """
+    Set number of sub-task processes which stages of all running simulations can use at once
+    (defaults to number of CPUs).
+    @param max_workers: Maximal number of sub-tasks running at once
+    """
+    global __MAX_WORKERS
+    with __WORKERS_CONDITION:
+        __MAX_WORKERS = max_workers
+        __WORKERS_CONDITION.notify_all()
+
+
+def run_subtasks(subtask: Callable, subtasks_args: Iterable[Tuple]) -> None:
+    """
+    Run independent sub-tasks of a stage in parallel on a process pool of the stage and report their progress.
+    The pool gets as many of the shared sub-task processes (see configure_subtask_pool) as are free, at least one.
+    Stage succeeds only when all sub-tasks have finished. On the first failure, cancellation or time limit
+    of the stage, processes of the pool are terminated; the function returns only when they have exited,
+    so no sub-task outlives its stage (nor the worker process running the simulation).
+    @param subtask: Picklable (module level) function to run
+    @param subtasks_args: Arguments for each sub-task
+    """
+    subtasks_args = list(subtasks_args)
+    hmse_task.report_progress(0, len(subtasks_args))
+    if not subtasks_args:
+        return
+
+    workers = __acquire_workers(len(subtasks_args))
+    try:
+        with __subtask_pool(subtask, subtasks_args, workers) as pending:
+            while pending:
+                pending[0].wait(hmse_task.get_check_interval())
+                __collect_finished(pending, len(subtasks_args))
+                hmse_task.check_cancelled()
+    finally:
+        __release_workers(workers)
+
+
+async def run_subtasks_async(subtask: Callable, subtasks_args: Iterable[Tuple]) -> None:
+    """
+    Run sub-tasks like run_subtasks from a coroutine task, they are awaited without blocking the event loop
+    (nor a thread bridged to it). Cancelling the coroutine terminates the sub-tasks.
+    @param subtask: Picklable (module level) function to run
+    @param subtasks_args: Arguments for each sub-task
+    """
+    subtasks_args = list(subtasks_args)
+    hmse_task.report_progress(0, len(subtasks_args))
+    if not subtasks_args:
+        return
+
+    while (workers := __acquire_workers(len(subtasks_args), blocking=False)) == 0:
+        hmse_task.check_cancelled()
+        await asyncio.sleep(hmse_task.get_check_interval())
+    try:
+        loop = asyncio.get_running_loop()
+        finished = asyncio.Event()
+        # Event is set by the pool's result thread whenever a sub-task finishes
+        with __subtask_pool(subtask, subtasks_args, workers,
+                            lambda _: loop.call_soon_threadsafe(finished.set)) as pending:
+            while pending:
+                try:
+                    await asyncio.wait_for(finished.wait(), hmse_task.get_check_interval())
+                except asyncio.TimeoutError:
+                    pass
+                finished.clear()
+                __collect_finished(pending, len(subtasks_args))
+                hmse_task.check_cancelled()
+    finally:
+        __release_workers(workers)
+
+
+@contextmanager
+def __subtask_pool(subtask: Callable, subtasks_args: List[Tuple], workers: int,
+                   on_finished: Optional[Callable[[Any], None]] = None):
+    """
+    Start sub-tasks on a process pool of the stage, yields list of their pending results. Processes are terminated
+    if the stage stops (fails, is cancelled or times out) before all sub-tasks have finished.
+    @param on_finished: Function called (in a thread of the pool) when a sub-task finishes or fails
+    """
+    pool = None
+    try:
+        pool = multiprocessing.get_context().Pool(workers)
+        yield [pool.apply_async(subtask, args, callback=on_finished, error_callback=on_finished)
+               for args in subtasks_args]
+        pool.close()
+        pool.join()
+    except BaseException as error:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if isinstance(error, SimulationError) or not isinstance(error, Exception):
+            raise
+        logging.error(f"Sub-task {subtask.__name__} failed: {error}")
+        raise SimulationError(description=f"Sub-task {subtask.__name__} failed: {error}")
+
+
+def __collect_finished(pending: List[AsyncResult], total: int) -> None:
+    """
+    Remove finished sub-tasks from pending ones (raising error of a failed one) and report progress of the stage.
+    """
+    finished = [result for result in pending if result.ready()]
+    for result in finished:
+        result.get()
+        pending.remove(result)
+    if finished:
+        hmse_task.report_progress(total - len(pending), total)
+
+
+def __acquire_workers(wanted: int, blocking: bool = True) -> int:
+    """
+    Wait until at least one sub-task process is free (checking cancellation of the stage while waiting).
+    @param blocking: Whether to wait, otherwise 0 is returned if no process is free
+    @return: Number of reserved processes, at most wanted
+    """
+    global __USED_WORKERS
+    with __WORKERS_CONDITION:
+        while (free := (__MAX_WORKERS or os.cpu_count() or 1) - __USED_WORKERS) <= 0:
+            if not blocking:
+                return 0
+            __WORKERS_CONDITION.wait(CANCELLATION_POLL_INTERVAL)
+            hmse_task.check_cancelled()
+        workers = min(wanted, free)
+        __USED_WORKERS += workers
+        return workers
+
+
+def __release_workers(workers: int) -> None:
+    global __USED_WORKERS
+    with __WORKERS_CONDITION:
+        __USED_WORKERS -= workers
+        __WORKERS_CONDITION.notify_all()
@@ -0,0 +1,145 @@
+"""
+Static registry of simulation tasks. Stage names and declarations of tasks are available without importing
+task modules (and heavy processing logic they use), modules are imported when a task is called for the first time.
+Must be kept in sync with hmse_task decorators of the tasks (see verify_task_registry).
+"""
+from dataclasses import dataclass
+from importlib import import_module
+from typing import Dict, FrozenSet, Optional, Tuple, List
+
+from ..simulation_enums import SimulationStageName, SimulationResource as Resource
+
+
+@dataclass(frozen=True)
+class TaskSpec:
+    module: str
+    stage_name: SimulationStageName
+    reads: Optional[FrozenSet[Resource]] = None
+    writes: Optional[FrozenSet[Resource]] = None
+    cache_key_fields: Optional[Tuple[str, ...]] = None
+    prefetchable: bool = False
+
+    def get_resources(self) -> Optional[Tuple[FrozenSet[Resource], FrozenSet[Resource]]]:
+        if self.reads is None and self.writes is None:
+            return None
+        return self.reads or frozenset(), self.writes or frozenset()
+
+
+def _spec(module: str, stage_name: SimulationStageName, reads=None, writes=None, cache_key_fields=None,
+          prefetchable: bool = False) -> TaskSpec:
+    # Same normalization as in hmse_task decorator
+    declares_resources = reads is not None or writes is not None
+    return TaskSpec(module, stage_name,
+                    reads=frozenset(reads or ()) if declares_resources else None,
+                    writes=frozenset(writes or ()) if declares_resources else None,
+                    cache_key_fields=tuple(cache_key_fields) if cache_key_fields is not None else None,
+                    prefetchable=prefetchable)
+
+
+_CONFIGURATION = "configuration_tasks"
+_DATA = "data_tasks"
+_SIMULATION = "simulation_tasks"
+
+TASK_REGISTRY: Dict[str, TaskSpec] = {
+    "initialization": _spec(_CONFIGURATION, SimulationStageName.INITIALIZATION),
+    "save_reference_hydrus_models": _spec(_CONFIGURATION, SimulationStageName.SAVE_REFERENCE_HYDRUS_MODELS,
+                                          reads=(Resource.HYDRUS_MODELS,),
+                                          writes=(Resource.REFERENCE_HYDRUS_MODELS,),
+                                          cache_key_fields=()),
+    "output_extraction_to_json": _spec(_CONFIGURATION, SimulationStageName.OUTPUT_EXTRACTION_TO_JSON,
+                                       reads=(Resource.HYDRUS_OUTPUT, Resource.MODFLOW_OUTPUT,
+                                              Resource.ITERATION_FILES),
+                                       writes=(Resource.SIMULATION_OUTPUT,)),
+    "iteration_output_extraction_to_json": _spec(_CONFIGURATION,
+                                                 SimulationStageName.ITERATION_OUTPUT_EXTRACTION_TO_JSON,
+                                                 reads=(Resource.HYDRUS_OUTPUT, Resource.MODFLOW_OUTPUT,
+                                                        Resource.ITERATION_FILES),
+                                                 writes=(Resource.SIMULATION_OUTPUT,)),
+    "cleanup": _spec(_CONFIGURATION, SimulationStageName.CLEANUP),
+    "initialize_new_iteration_files": _spec(_CONFIGURATION, SimulationStageName.INITIALIZE_NEW_ITERATION_FILES,
+                                            reads=(Resource.MODFLOW_MODEL,),
+                                            writes=(Resource.ITERATION_FILES,),
+                                            prefetchable=True),
+    "create_per_zone_hydrus_models": _spec(_CONFIGURATION, SimulationStageName.CREATE_PER_ZONE_HYDRUS_MODELS,
+                                           reads=(Resource.HYDRUS_MODELS,),
+                                           writes=(Resource.PER_ZONE_HYDRUS_MODELS,),
+                                           cache_key_fields=("shapes_to_hydrus",)),
+    "iteration_pre_configuration": _spec(_CONFIGURATION, SimulationStageName.ITERATION_PRE_CONFIGURATION,
+                                         reads=(Resource.ITERATION_FILES,),
+                                         writes=(Resource.ITERATION_FILES,),
+                                         prefetchable=True),
+    "save_last_iteration": _spec(_CONFIGURATION, SimulationStageName.FEEDBACK_SAVE_OUTPUT_ITERATION,
+                                 reads=(Resource.ITERATION_FILES,),
+                                 writes=(Resource.SIMULATION_OUTPUT,)),
+
+    "weather_data_to_hydrus": _spec(_DATA, SimulationStageName.WEATHER_DATA_TRANSFER,
+                                    reads=(Resource.WEATHER_DATA, Resource.HYDRUS_MODELS),
+                                    writes=(Resource.HYDRUS_MODELS,),
+                                    cache_key_fields=("hydrus_to_weather",)),
+    "hydrus_to_modflow": _spec(_DATA, SimulationStageName.HYDRUS_TO_MODFLOW_DATA_PASSING,
+                               reads=(Resource.HYDRUS_OUTPUT,),
+                               writes=(Resource.COUPLING_DATA,),
+                               cache_key_fields=("shapes_to_hydrus",)),
+    "modflow_to_hydrus": _spec(_DATA, SimulationStageName.MODFLOW_TO_HYDRUS_DATA_PASSING,
+                               reads=(Resource.MODFLOW_OUTPUT, Resource.ITERATION_FILES),
+                               writes=(Resource.COUPLING_DATA,),
+                               cache_key_fields=("shapes_to_hydrus",)),
+    "modflow_init_condition_transfer_steady_state": _spec(
+        _DATA, SimulationStageName.MODFLOW_INIT_CONDITION_TRANSFER_STEADY_STATE,
+        reads=(Resource.MODFLOW_MODEL, Resource.ITERATION_FILES, Resource.PER_ZONE_HYDRUS_MODELS),
+        writes=(Resource.MODFLOW_OUTPUT, Resource.PER_ZONE_HYDRUS_MODELS),
+        cache_key_fields=("shapes_to_hydrus", "modflow_metadata")),
+    "modflow_init_condition_transfer_transient": _spec(
+        _DATA, SimulationStageName.MODFLOW_INIT_CONDITION_TRANSFER_TRANSIENT,
+        reads=(Resource.MODFLOW_MODEL, Resource.ITERATION_FILES, Resource.PER_ZONE_HYDRUS_MODELS),
+        writes=(Resource.PER_ZONE_HYDRUS_MODELS,),
+        cache_key_fields=("shapes_to_hydrus", "modflow_metadata")),
+
+    "hydrus_simulation": _spec(_SIMULATION, SimulationStageName.HYDRUS_SIMULATION,
+                               reads=(Resource.HYDRUS_MODELS, Resource.PER_ZONE_HYDRUS_MODELS,
+                                      Resource.COUPLING_DATA),
+                               writes=(Resource.HYDRUS_OUTPUT, Resource.PER_ZONE_HYDRUS_MODELS),
+                               cache_key_fields=("simulation_mode", "shapes_to_hydrus")),
+    "hydrus_simulation_warmup": _spec(_SIMULATION, SimulationStageName.HYDRUS_SIMULATION_WARMUP,
+                                      reads=(Resource.PER_ZONE_HYDRUS_MODELS,),
+                                      writes=(Resource.HYDRUS_OUTPUT,),
+                                      cache_key_fields=("simulation_mode", "shapes_to_hydrus")),
+    "modflow_simulation": _spec(_SIMULATION, SimulationStageName.MODFLOW_SIMULATION,
+                                reads=(Resource.MODFLOW_MODEL, Resource.ITERATION_FILES, Resource.COUPLING_DATA),
+                                writes=(Resource.MODFLOW_OUTPUT, Resource.MODFLOW_MODEL),
+                                cache_key_fields=("modflow_metadata",)),
+}
+
+
+def import_task_module(task_id: str) -> None:
+    """
+    Import module defining a registered task, so the task's hmse_task decorator registers it.
+    """
+    import_module(f"{__package__}.{TASK_REGISTRY[task_id].module}")
+
+
+def verify_task_registry() -> List[str]:
+    """
+    Import all task modules and compare hmse_task declarations of their tasks with the static registry.
+    @return: Description of each difference (empty if the registry is up to date)
+    """
+    from . import hmse_task
+    modules = {spec.module for spec in TASK_REGISTRY.values()}
+    tasks = {}
+    for module in sorted(modules):
+        imported = import_module(f"{__package__}.{module}")
+        tasks.update({task_id: (module, task) for task_id, task in hmse_task.get_registered_tasks().items()
+                      if task.__module__ == imported.__name__})
+
+    differences = [f"Task {task_id} is missing in module {spec.module}"
+                   for task_id, spec in TASK_REGISTRY.items() if task_id not in tasks]
+    for task_id, (module, task) in tasks.items():
+        resources = hmse_task.get_task_resources(task)
+        declared = TaskSpec(module, hmse_task.get_stage_name(task),
+                            reads=resources[0] if resources is not None else None,
+                            writes=resources[1] if resources is not None else None,
+                            cache_key_fields=hmse_task.get_cache_key_fields(task),
+                            prefetchable=hmse_task.is_prefetchable(task))
+        if TASK_REGISTRY.get(task_id) != declared:
+            differences.append(f"Task {task_id} is declared as {declared}, registry has {TASK_REGISTRY.get(task_id)}")
+    return differences
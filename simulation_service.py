@@ -1,43 +1,287 @@
+import time
+import uuid
 from dataclasses import dataclass, field
-from threading import Thread
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Iterator, AsyncIterator, Tuple, Union
 
-from .hmse_projects.project_dao import project_dao
 from .hmse_projects.project_metadata import ProjectMetadata
 from .hmse_projects.typing_help import ProjectID
 from .simulation import simulation_configurator
+from .simulation.resource_scheduler import ResourceAwareScheduler
+from .simulation.result_cache import ResultCache
+from .simulation.scratch_workspace import ScratchWorkspaceManager
+from .simulation.batch_status import BatchStatus
+from .simulation.metadata_cache import metadata_cache
+from .simulation.output_stream import get_current_output_dir, read_step, read_steps
 from .simulation.simulation import Simulation
+from .simulation.simulation_checkpoint import CheckpointStore
+from .simulation.simulation_enums import SimulationStageName
+from .simulation.simulation_error import SimulationNotFound
+from .simulation.simulation_executor import SimulationExecutor, AsyncSimulationExecutor, ExecutorStats
+from .simulation.simulation_profile import SimulationProfile
 from .simulation.simulation_status import ChapterStatus
+from .simulation.status_events import StatusEvent
 
 
 @dataclass
 class SimulationService:
     simulations: Dict[ProjectID, Simulation] = field(default_factory=dict)
+    batches: Dict[str, List[ProjectID]] = field(default_factory=dict)
+    executor: Union[SimulationExecutor, AsyncSimulationExecutor] = field(default_factory=SimulationExecutor)
+    result_cache: Optional[ResultCache] = None
+    checkpoint_store: Optional[CheckpointStore] = None
+    finished_simulation_ttl: float = 3600.0
+    max_finished_simulations: int = 1000
+    pipeline_lookahead: int = 0
+    stage_timeouts: Dict[SimulationStageName, float] = field(default_factory=dict)
+    resource_scheduler: Optional[ResourceAwareScheduler] = None
+    workspace_manager: Optional[ScratchWorkspaceManager] = None
+    output_dir: Optional[str] = None
 
-    def run_simulation(self, project_metadata: ProjectMetadata) -> None:
-        simulation = simulation_configurator.configure_simulation(project_metadata)
-        self.register_simulation_if_necessary(simulation)
+    def run_simulation(self, project_metadata: ProjectMetadata, priority: int = 0, use_cache: bool = True) -> None:
+        """
+        Queue simulation of a project.
+        @param project_metadata: Metadata of the simulated project
+        @param priority: Admission priority (lower value is admitted first), used by priority based executor
+        @param use_cache: Whether outputs of unchanged stages can be restored from result cache (if configured)
+        """
+        result_cache = self.result_cache if use_cache else None
+        simulation = simulation_configurator.configure_simulation(project_metadata, result_cache=result_cache,
+                                                                  checkpoint_store=self.checkpoint_store,
+                                                                  simulation_class=self.executor.simulation_class,
+                                                                  pipeline_lookahead=self.pipeline_lookahead,
+                                                                  stage_timeouts=self.stage_timeouts,
+                                                                  resource_scheduler=self.resource_scheduler,
+                                                                  workspace_manager=self.workspace_manager,
+                                                                  output_dir=self.output_dir)
+        self.__start_simulation(simulation, priority)
 
-        project_metadata.finished = False
-        project_dao.save_or_update_metadata(project_metadata)
+    def run_batch(self, projects: List[ProjectMetadata], priority: int = 0) -> str:
+        """
+        Queue simulations of many similar projects (e.g. a parameter sweep). Stages with the same inputs
+        in different projects (e.g. weather data transfer, warmup) are executed once and their outputs
+        are restored from result cache to the other projects.
+        @param projects: Metadata of the simulated projects
+        @param priority: Admission priority of all simulations of the batch
+        @return: ID of the batch, used to check its progress
+        """
+        if self.result_cache is None:
+            raise ValueError("Batch simulation requires result cache to share stages between projects!")
 
-        # Run simulation in background
-        thread = Thread(target=simulation.run_simulation)
-        thread.start()
+        batch_id = uuid.uuid4().hex
+        simulations = [simulation_configurator.configure_simulation(project_metadata, result_cache=self.result_cache,
+                                                                    checkpoint_store=self.checkpoint_store,
+                                                                    simulation_class=self.executor.simulation_class,
+                                                                    pipeline_lookahead=self.pipeline_lookahead,
+                                                                    stage_timeouts=self.stage_timeouts,
+                                                                    resource_scheduler=self.resource_scheduler,
+                                                                    workspace_manager=self.workspace_manager,
+                                                                    output_dir=self.output_dir)
+                       for project_metadata in projects]
+        for simulation in simulations:
+            self.__start_simulation(simulation, priority)
+        self.batches[batch_id] = [simulation.project_metadata.project_id for simulation in simulations]
+        return batch_id
+
+    def get_batch_status(self, batch_id: str) -> BatchStatus:
+        """
+        Return progress of a batch and each of its projects, detailed status of a project is available
+        through check_simulation_status.
+        @param batch_id: ID returned by run_batch
+        """
+        if batch_id not in self.batches:
+            raise SimulationNotFound(description=f"No batch {batch_id}!")
+        project_ids = self.batches[batch_id]
+        return BatchStatus(batch_id, [self.simulations[project_id] for project_id in project_ids
+                                      if project_id in self.simulations])
+
+    def resume_simulation(self, project_id: ProjectID, priority: int = 0, use_cache: bool = True) -> None:
+        """
+        Queue simulation of a project continuing from the last completed chapter.
+        @param project_id: ID of the project whose simulation was interrupted or failed
+        @param priority: Admission priority (lower value is admitted first), used by priority based executor
+        @param use_cache: Whether outputs of unchanged stages can be restored from result cache (if configured)
+        """
+        checkpoint = self.checkpoint_store.load(project_id) if self.checkpoint_store is not None else None
+        if checkpoint is None:
+            raise SimulationNotFound(description=f"No checkpoint to resume simulation of project {project_id}!")
+
+        # Only progress of chapters is taken from the checkpoint, metadata comes from the project store
+        project_metadata = metadata_cache.load(project_id)
+        result_cache = self.result_cache if use_cache else None
+        simulation = simulation_configurator.configure_simulation(project_metadata,
+                                                                  result_cache=result_cache,
+                                                                  checkpoint_store=self.checkpoint_store,
+                                                                  simulation_class=self.executor.simulation_class,
+                                                                  pipeline_lookahead=self.pipeline_lookahead,
+                                                                  stage_timeouts=self.stage_timeouts,
+                                                                  resource_scheduler=self.resource_scheduler,
+                                                                  workspace_manager=self.workspace_manager,
+                                                                  output_dir=self.output_dir)
+        simulation.restore_checkpoint(checkpoint)
+        self.__start_simulation(simulation, priority)
+
+    def cancel_simulation(self, project_id: ProjectID) -> None:
+        """
+        Stop simulation of a project. Queued simulation never starts, running one stops at the next cancellation
+        check of its stages. Completed chapters stay checkpointed, so the simulation can be resumed.
+        @param project_id: ID of the simulated project
+        """
+        simulation = self.__get_simulation(project_id)
+        if not simulation.is_finished():
+            self.executor.cancel(simulation, reason=f"Simulation of project {project_id} was cancelled!")
 
     def check_simulation_status(self, project_id: ProjectID) -> List[ChapterStatus]:
         """
-        Return status of each step in particular simulation.
+        Return status of each step in particular simulation. Finished simulations stay available
+        until they are evicted (see evict_finished_simulations).
         @param project_id: ID of the simulated project to check
         @return: Status of hydrus stage, passing stage and modflow stage (in this exact order)
         """
-        all_chapter_statuses = self.simulations[project_id].get_simulation_status()
-        if all_chapter_statuses[-1].get_stages_statuses()[-1].status.is_finished():
-            del self.simulations[project_id]
-        return all_chapter_statuses
+        return self.__get_simulation(project_id).get_simulation_status()
+
+    def get_status_changes(self, project_id: ProjectID, since_seq: int = 0):
+        """
+        Return changes of stages in particular simulation since the sequence number known to the client.
+        @param project_id: ID of the simulated project to check
+        @param since_seq: Sequence number returned by the previous call (0 for the first one)
+        @return: New sequence number and changed stages; full status of all chapters is returned
+                 instead if the client is too far behind
+        """
+        simulation = self.__get_simulation(project_id)
+        last_seq = simulation.status_events.get_last_seq()
+        events = simulation.status_events.get_events_since(since_seq)
+        if events is None:
+            return {
+                "seq": last_seq,
+                "chapters": [chapter.to_json(i) for i, chapter in enumerate(simulation.get_simulation_status())]
+            }
+        return {
+            "seq": events[-1].seq if events else last_seq,
+            "events": [event.to_json() for event in events]
+        }
+
+    def stream_status_changes(self, project_id: ProjectID, since_seq: int = 0,
+                              timeout: Optional[float] = None) -> Iterator[StatusEvent]:
+        """
+        Blocking generator of stage changes (e.g. for Server-Sent Events), ends with the simulation
+        or when no change happens within timeout.
+        """
+        return self.__get_simulation(project_id).status_events.iter_events(since_seq, timeout)
+
+    def subscribe_to_status_changes(self, project_id: ProjectID, since_seq: int = 0) -> AsyncIterator[StatusEvent]:
+        """
+        Asynchronous generator of stage changes (e.g. for websockets), ends with the simulation.
+        """
+        return self.__get_simulation(project_id).status_events.subscribe(since_seq)
+
+    def get_simulation_profile(self, project_id: ProjectID) -> SimulationProfile:
+        """
+        Return resource usage of stages executed so far in particular simulation.
+        @param project_id: ID of the simulated project
+        @return: Profile exportable as JSON or Prometheus text format
+        """
+        return SimulationProfile(project_id, self.__get_simulation(project_id).get_simulation_status())
+
+    def get_step_output(self, project_id: ProjectID, step_idx: int) -> Optional[Dict[str, Any]]:
+        """
+        Return results of a single step of feedback simulation, available as soon as the step finishes.
+        @param project_id: ID of the simulated project
+        @param step_idx: Index of the step (0 is the warmup)
+        @return: Results of the step or None if it was not written yet
+        """
+        output_dir = self.__get_output_dir(project_id)
+        return read_step(output_dir, step_idx) if output_dir is not None else None
+
+    def iter_step_outputs(self, project_id: ProjectID) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Iterate over results of steps of feedback simulation written so far, one step at a time.
+        @param project_id: ID of the simulated project
+        @return: Step index and results of each step
+        """
+        output_dir = self.__get_output_dir(project_id)
+        return read_steps(output_dir) if output_dir is not None else iter(())
+
+    def get_simulation_eta(self, project_id: ProjectID):
+        """
+        Estimate when each chapter of particular simulation finishes, based on learned durations of stages.
+        @param project_id: ID of the simulated project
+        @return: Remaining time of each chapter and expected time of its end (UNIX timestamp)
+        """
+        if self.resource_scheduler is None:
+            raise ValueError("Estimating simulation time requires resource scheduler with stage history!")
+        chapter_statuses = self.__get_simulation(project_id).get_simulation_status()
+        now = time.time()
+        return [{
+            "chapter_id": f"{chapter_status.chapter.get_as_id()}{i}",
+            "chapter_name": chapter_status.chapter.get_name(),
+            "remaining_time": remaining,
+            "eta": now + finish_in
+        } for i, (chapter_status, (remaining, finish_in))
+            in enumerate(zip(chapter_statuses, self.resource_scheduler.estimate_chapters(chapter_statuses)))]
+
+    def get_executor_stats(self) -> ExecutorStats:
+        """
+        Return load of the simulation executor.
+        @return: Queue depth, wait times and number of active workers
+        """
+        return self.executor.get_stats()
+
+    def __get_simulation(self, project_id: ProjectID) -> Simulation:
+        # Simulation may have been evicted (see evict_finished_simulations)
+        simulation = self.simulations.get(project_id)
+        if simulation is None:
+            raise SimulationNotFound(description=f"No simulation of project {project_id}!")
+        return simulation
+
+    def __get_output_dir(self, project_id: ProjectID) -> Optional[str]:
+        # Output of the last started run of the project, None if no simulation of it has started
+        if self.output_dir is None:
+            raise ValueError("Reading output of steps requires output directory!")
+        return get_current_output_dir(self.output_dir, project_id)
+
+    def __start_simulation(self, simulation: Simulation, priority: int) -> None:
+        self.register_simulation_if_necessary(simulation)
+
+        simulation.project_metadata.finished = False
+        metadata_cache.save(simulation.project_metadata)
+
+        # Run simulation in background (queued if all workers are busy)
+        self.executor.submit(simulation, priority=priority)
 
     def register_simulation_if_necessary(self, simulation: Simulation):
-        self.simulations[simulation.project_metadata.project_id] = simulation
+        self.evict_finished_simulations()
+        project_id = simulation.project_metadata.project_id
+        # Earlier simulation of the project is preempted, so it doesn't hold a worker nor overwrite new results
+        previous = self.simulations.get(project_id)
+        if previous is not None and previous is not simulation:
+            if not previous.is_finished():
+                self.executor.cancel(previous,
+                                     reason=f"Simulation of project {project_id} was preempted by a new one!")
+            # Workspace of the previous simulation is kept only if the new one resumes in it
+            resumes_in_workspace = previous.workspace is not None and simulation.workspace is not None and \
+                previous.workspace.workspace_dir == simulation.workspace.workspace_dir
+            if not resumes_in_workspace:
+                previous.discard_workspace()
+        self.simulations[project_id] = simulation
+
+    def evict_finished_simulations(self) -> None:
+        """
+        Forget simulations which finished more than finished_simulation_ttl seconds ago and the oldest finished
+        ones above max_finished_simulations. Called whenever a simulation is registered, so the number of kept
+        simulations stays bounded on a long-running server. Batches are forgotten along with their last simulation,
+        scratch workspaces kept for resuming forgotten simulations are removed.
+        """
+        now = time.time()
+        finished = sorted((simulation.status_events.closed_at, project_id)
+                          for project_id, simulation in self.simulations.items() if simulation.is_finished())
+        over_limit = len(finished) - self.max_finished_simulations
+        for i, (finished_at, project_id) in enumerate(finished):
+            if i >= over_limit and now - finished_at <= self.finished_simulation_ttl:
+                break
+            self.simulations.pop(project_id).discard_workspace()
+        for batch_id in [batch_id for batch_id, project_ids in self.batches.items()
+                         if not any(project_id in self.simulations for project_id in project_ids)]:
+            del self.batches[batch_id]
 
 
 simulation_service = SimulationService()
@@ -0,0 +1,68 @@
+import copy
+from typing import Callable, Dict, List
+
+import pytest
+
+from ..hmse_projects.project_metadata import ProjectMetadata
+from ..hmse_projects.simulation_mode import SimulationMode
+from ..simulation.metadata_cache import metadata_cache
+from ..simulation.simulation_chapter import CHAPTER_TO_TASK_MAPPING, SimulationChapter
+
+
+class InMemoryProjectStore:
+    """
+    Project store (in place of project_dao) keeping metadata in memory.
+    """
+
+    def __init__(self):
+        self.metadata: Dict[str, ProjectMetadata] = {}
+
+    def read_metadata(self, project_id: str) -> ProjectMetadata:
+        return copy.deepcopy(self.metadata[project_id])
+
+    def save_or_update_metadata(self, metadata: ProjectMetadata) -> None:
+        self.metadata[metadata.project_id] = copy.deepcopy(metadata)
+
+
+@pytest.fixture(autouse=True)
+def project_store(monkeypatch) -> InMemoryProjectStore:
+    store = InMemoryProjectStore()
+    monkeypatch.setattr(metadata_cache, "dao", store)
+    return store
+
+
+@pytest.fixture
+def chapter_tasks():
+    """
+    Replace tasks of all chapters with given ones until the end of the test. Tasks must be module level functions,
+    so simulations using them can be sent to worker processes.
+    """
+    original_mapping = {chapter: list(tasks) for chapter, tasks in CHAPTER_TO_TASK_MAPPING.items()}
+
+    def replace(tasks: List[Callable[[ProjectMetadata], None]]) -> None:
+        for chapter in original_mapping:
+            CHAPTER_TO_TASK_MAPPING[chapter] = list(tasks)
+        SimulationChapter.clear_execution_plans()
+
+    yield replace
+    CHAPTER_TO_TASK_MAPPING.update(original_mapping)
+    SimulationChapter.clear_execution_plans()
+
+
+@pytest.fixture
+def new_metadata() -> Callable[[str], ProjectMetadata]:
+    return _make_metadata
+
+
+def _make_metadata(project_id: str) -> ProjectMetadata:
+    """
+    Create metadata of a simple coupling project, only fields used by simulation pipeline are filled in.
+    """
+    metadata = ProjectMetadata.__new__(ProjectMetadata)
+    metadata.project_id = project_id
+    metadata.name = project_id
+    metadata.finished = False
+    metadata.simulation_mode = SimulationMode.SIMPLE_COUPLING
+    metadata.shapes_to_hydrus = {}
+    metadata.hydrus_to_weather = {}
+    return metadata
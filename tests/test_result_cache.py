@@ -0,0 +1,136 @@
+import os
+import threading
+
+import pytest
+
+from ..simulation.result_cache import ResultCache
+from ..simulation.simulation_enums import SimulationResource, SimulationStageName
+from ..simulation.tasks.hmse_task import hmse_task
+
+
+@hmse_task(stage_name=SimulationStageName.HYDRUS_SIMULATION,
+           reads=[SimulationResource.HYDRUS_MODELS], writes=[SimulationResource.HYDRUS_OUTPUT],
+           cache_key_fields=["name"])
+def cache_test_task(project_metadata):
+    pass
+
+
+@pytest.fixture
+def project_dir(tmp_path):
+    return str(tmp_path / "projects")
+
+
+@pytest.fixture
+def cache(tmp_path, project_dir):
+    def resolve_paths(metadata, resource):
+        return [os.path.join(project_dir, metadata.project_id, resource)]
+
+    return ResultCache(str(tmp_path / "cache"), resolve_paths)
+
+
+def _write(project_dir: str, project_id: str, resource: SimulationResource, content: str) -> str:
+    path = os.path.join(project_dir, project_id, resource)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def _store_output(cache, project_dir, metadata, content: str) -> str:
+    _write(project_dir, metadata.project_id, SimulationResource.HYDRUS_MODELS, f"model of {content}")
+    _write(project_dir, metadata.project_id, SimulationResource.HYDRUS_OUTPUT, content)
+    key = cache.compute_key(cache_test_task, metadata, chapter_idx=0)
+    cache.store(key, cache_test_task, metadata)
+    return key
+
+
+def test_miss_then_hit_restores_output(cache, project_dir, new_metadata):
+    metadata = new_metadata("p")
+    _write(project_dir, "p", SimulationResource.HYDRUS_MODELS, "model")
+    key = cache.compute_key(cache_test_task, metadata, chapter_idx=0)
+    assert not cache.restore(key, cache_test_task, metadata)
+
+    output = _write(project_dir, "p", SimulationResource.HYDRUS_OUTPUT, "output")
+    cache.store(key, cache_test_task, metadata)
+    os.remove(output)
+
+    assert cache.restore(key, cache_test_task, metadata)
+    assert _read(output) == "output"
+
+
+def test_changed_input_misses(cache, project_dir, new_metadata):
+    metadata = new_metadata("p")
+    key = _store_output(cache, project_dir, metadata, "output")
+    _write(project_dir, "p", SimulationResource.HYDRUS_MODELS, "changed model")
+
+    assert cache.compute_key(cache_test_task, metadata, chapter_idx=0) != key
+    assert cache.compute_key(cache_test_task, metadata, chapter_idx=1) != key
+
+
+def test_eviction_keeps_cache_within_size(cache, project_dir, new_metadata):
+    cache.max_size_bytes = 100
+    keys = [_store_output(cache, project_dir, new_metadata(f"p{i}"), "x" * 40) for i in range(5)]
+
+    entries = os.listdir(cache.cache_dir)
+    assert len(entries) == 2
+    assert set(entries) == set(keys[-2:])
+
+
+def test_eviction_skips_acquired_entry(cache, project_dir, new_metadata):
+    key = _store_output(cache, project_dir, new_metadata("p0"), "x" * 40)
+    cache.max_size_bytes = 0
+    assert cache.acquire_key(key)
+    try:
+        cache.evict()
+        assert os.listdir(cache.cache_dir) == [key]
+    finally:
+        cache.release_key(key)
+    cache.evict()
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_restore_racing_with_eviction_is_hit_or_miss(cache, project_dir, new_metadata):
+    metadata = new_metadata("p")
+    key = _store_output(cache, project_dir, metadata, "x" * 1000)
+    output = os.path.join(project_dir, "p", SimulationResource.HYDRUS_OUTPUT)
+    errors = []
+    stop = threading.Event()
+
+    def restore():
+        while not stop.is_set():
+            try:
+                cache.acquire_key(key)
+                try:
+                    if cache.restore(key, cache_test_task, metadata):
+                        assert _read(output) == "x" * 1000
+                    else:
+                        cache.store(key, cache_test_task, metadata)
+                finally:
+                    cache.release_key(key)
+            except Exception as error:
+                errors.append(error)
+                return
+
+    def evict():
+        while not stop.is_set():
+            try:
+                cache.evict()
+            except Exception as error:
+                errors.append(error)
+                return
+
+    cache.max_size_bytes = 0
+    threads = [threading.Thread(target=restore) for _ in range(4)] + [threading.Thread(target=evict)]
+    for thread in threads:
+        thread.start()
+    threading.Event().wait(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
@@ -0,0 +1,67 @@
+import multiprocessing
+import time
+
+from ..simulation import simulation_configurator
+from ..simulation.simulation_enums import SimulationStageName, SimulationStageStatus
+from ..simulation.simulation_executor import ExecutorBackend, SimulationExecutor
+from ..simulation.tasks.hmse_task import hmse_task
+
+
+@hmse_task(stage_name=SimulationStageName.INITIALIZATION)
+def executor_test_initialization(project_metadata):
+    time.sleep(0.05)
+
+
+@hmse_task(stage_name=SimulationStageName.CLEANUP)
+def executor_test_cleanup(project_metadata):
+    time.sleep(0.05)
+
+
+def _wait_until(condition, timeout: float = 30.0) -> None:
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "Condition was not met in time"
+        time.sleep(0.01)
+
+
+def _get_statuses(simulation):
+    return [stage.status for chapter_status in simulation.get_simulation_status()
+            for stage in chapter_status.get_stages_statuses()]
+
+
+def _is_done(simulation) -> bool:
+    # Statuses are forwarded from worker processes by a thread of their own, they may arrive after the simulation ends
+    return simulation.is_finished() and all(status.is_finished() for status in _get_statuses(simulation))
+
+
+def test_process_backend_runs_simulations_and_shuts_down(chapter_tasks, new_metadata):
+    chapter_tasks([executor_test_initialization, executor_test_cleanup])
+    simulations = [simulation_configurator.configure_simulation(new_metadata(f"process-{i}")) for i in range(3)]
+    executor = SimulationExecutor(max_workers=2, backend=ExecutorBackend.PROCESS)
+    for simulation in simulations:
+        executor.submit(simulation)
+    _wait_until(lambda: all(_is_done(simulation) for simulation in simulations))
+    executor.shutdown()
+
+    for simulation in simulations:
+        # Final metadata is sent back from the worker process
+        assert _get_statuses(simulation) == [SimulationStageStatus.SUCCESS, SimulationStageStatus.SUCCESS]
+        assert simulation.project_metadata.finished
+    assert multiprocessing.active_children() == []
+    assert executor.get_stats().active_workers == 0
+
+
+def test_process_backend_shutdown_drops_queued_simulations(chapter_tasks, new_metadata):
+    chapter_tasks([executor_test_initialization, executor_test_cleanup])
+    running = simulation_configurator.configure_simulation(new_metadata("running"))
+    queued = simulation_configurator.configure_simulation(new_metadata("queued"))
+    executor = SimulationExecutor(max_workers=1, backend=ExecutorBackend.PROCESS)
+    executor.submit(running)
+    executor.submit(queued)
+    executor.shutdown(wait=True)
+
+    # Running simulation is awaited, queued one never starts
+    _wait_until(lambda: _is_done(running))
+    assert _get_statuses(running) == [SimulationStageStatus.SUCCESS, SimulationStageStatus.SUCCESS]
+    assert _get_statuses(queued) == [SimulationStageStatus.PENDING, SimulationStageStatus.PENDING]
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ..simulation import simulation_configurator
+from ..simulation.cancellation import CancellationToken
+from ..simulation.simulation_enums import SimulationStageName, SimulationStageStatus
+from ..simulation.simulation_error import SimulationCancelled, StageTimedOut
+from ..simulation.simulation_executor import SimulationExecutor
+from ..simulation.tasks import hmse_task
+
+
+@hmse_task.hmse_task(stage_name=SimulationStageName.INITIALIZATION)
+def cancellation_test_quick(project_metadata):
+    time.sleep(0.01)
+
+
+@hmse_task.hmse_task(stage_name=SimulationStageName.MODFLOW_SIMULATION)
+def cancellation_test_blocking(project_metadata):
+    # Never checks cancellation, the stage must be stopped anyway
+    time.sleep(2)
+
+
+@hmse_task.hmse_task(stage_name=SimulationStageName.CLEANUP)
+def cancellation_test_cleanup(project_metadata):
+    time.sleep(0.01)
+
+
+def _wait_until(condition, timeout: float = 10.0) -> None:
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "Condition was not met in time"
+        time.sleep(0.01)
+
+
+def _get_statuses(simulation):
+    return [stage.status for chapter_status in simulation.get_simulation_status()
+            for stage in chapter_status.get_stages_statuses()]
+
+
+def test_check_cancelled_raises_reason_of_cancellation():
+    token = CancellationToken()
+    with hmse_task.stage_cancellation(token):
+        hmse_task.check_cancelled()
+        token.cancel("Stopped by test")
+        with pytest.raises(SimulationCancelled) as error:
+            hmse_task.check_cancelled()
+    assert error.value.description == "Stopped by test"
+
+
+def test_await_stage_times_out_blocking_task(new_metadata):
+    start = time.monotonic()
+    with hmse_task.stage_cancellation(CancellationToken(), deadline=time.monotonic() + 0.2):
+        with pytest.raises(StageTimedOut):
+            hmse_task.await_stage(hmse_task.start_stage(cancellation_test_blocking, new_metadata("timeout")))
+    assert time.monotonic() - start < 1.0
+
+
+def test_await_stage_stops_on_cancellation(new_metadata):
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+    start = time.monotonic()
+    with hmse_task.stage_cancellation(token):
+        with pytest.raises(SimulationCancelled):
+            hmse_task.await_stage(hmse_task.start_stage(cancellation_test_blocking, new_metadata("cancel")))
+    assert time.monotonic() - start < 1.0
+
+
+def test_await_stage_async_cancels_timed_out_coroutine():
+    stopped = []
+
+    async def solver():
+        try:
+            await asyncio.sleep(5)
+        finally:
+            stopped.append(True)
+
+    async def run_stage():
+        with hmse_task.stage_cancellation(CancellationToken(), deadline=time.monotonic() + 0.1):
+            stage = asyncio.ensure_future(solver())
+            with pytest.raises(StageTimedOut):
+                await hmse_task.await_stage_async(stage)
+            await asyncio.wait({stage})
+
+    asyncio.run(run_stage())
+    assert stopped == [True]
+
+
+def test_simulation_stage_exceeding_time_limit_is_timed_out(chapter_tasks, new_metadata):
+    chapter_tasks([cancellation_test_quick, cancellation_test_blocking, cancellation_test_cleanup])
+    simulation = simulation_configurator.configure_simulation(
+        new_metadata("timed-out"), stage_timeouts={SimulationStageName.MODFLOW_SIMULATION: 0.2})
+
+    with pytest.raises(StageTimedOut):
+        simulation.run_simulation()
+    assert _get_statuses(simulation) == [SimulationStageStatus.SUCCESS, SimulationStageStatus.TIMED_OUT,
+                                         SimulationStageStatus.PENDING]
+
+
+def test_cancelled_simulation_stops_running_stage(chapter_tasks, new_metadata):
+    chapter_tasks([cancellation_test_quick, cancellation_test_blocking, cancellation_test_cleanup])
+    simulation = simulation_configurator.configure_simulation(new_metadata("cancelled"))
+    executor = SimulationExecutor(max_workers=1)
+    try:
+        executor.submit(simulation)
+        _wait_until(lambda: _get_statuses(simulation)[1] == SimulationStageStatus.RUNNING)
+        executor.cancel(simulation, reason="Stopped by test")
+        _wait_until(simulation.is_finished, timeout=1.5)
+    finally:
+        executor.shutdown()
+    assert _get_statuses(simulation) == [SimulationStageStatus.SUCCESS, SimulationStageStatus.CANCELLED,
+                                         SimulationStageStatus.CANCELLED]
+
+
+def test_queued_simulation_is_cancelled_without_running(chapter_tasks, new_metadata):
+    chapter_tasks([cancellation_test_quick, cancellation_test_blocking, cancellation_test_cleanup])
+    running = simulation_configurator.configure_simulation(new_metadata("running"))
+    queued = simulation_configurator.configure_simulation(new_metadata("queued"))
+    executor = SimulationExecutor(max_workers=1)
+    try:
+        executor.submit(running)
+        executor.submit(queued)
+        executor.cancel(queued)
+        assert queued.is_finished()
+        executor.cancel(running)
+        _wait_until(running.is_finished)
+    finally:
+        executor.shutdown()
+    assert set(_get_statuses(queued)) == {SimulationStageStatus.CANCELLED}
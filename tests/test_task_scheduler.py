@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ..simulation.simulation_enums import SimulationResource, SimulationStageName
+from ..simulation.simulation_error import SimulationError
+from ..simulation.task_scheduler import DagScheduler, build_dependency_graph, tasks_conflict
+from ..simulation.tasks.hmse_task import hmse_task
+
+
+@hmse_task(stage_name=SimulationStageName.HYDRUS_SIMULATION,
+           reads=[SimulationResource.HYDRUS_MODELS], writes=[SimulationResource.HYDRUS_OUTPUT])
+def scheduler_test_hydrus(project_metadata):
+    pass
+
+
+@hmse_task(stage_name=SimulationStageName.MODFLOW_SIMULATION,
+           reads=[SimulationResource.MODFLOW_MODEL], writes=[SimulationResource.MODFLOW_OUTPUT])
+def scheduler_test_modflow(project_metadata):
+    pass
+
+
+@hmse_task(stage_name=SimulationStageName.HYDRUS_TO_MODFLOW_DATA_PASSING,
+           reads=[SimulationResource.HYDRUS_OUTPUT], writes=[SimulationResource.MODFLOW_MODEL])
+def scheduler_test_passing(project_metadata):
+    pass
+
+
+@hmse_task(stage_name=SimulationStageName.INITIALIZE_NEW_ITERATION_FILES,
+           reads=[SimulationResource.MODFLOW_OUTPUT], writes=[SimulationResource.ITERATION_FILES])
+def scheduler_test_iteration(project_metadata):
+    pass
+
+
+@hmse_task(stage_name=SimulationStageName.CLEANUP)
+def scheduler_test_undeclared(project_metadata):
+    pass
+
+
+def test_independent_tasks_have_no_dependencies():
+    assert build_dependency_graph([scheduler_test_hydrus, scheduler_test_modflow]) == [set(), set()]
+
+
+def test_reader_depends_on_writer_of_its_input():
+    graph = build_dependency_graph([scheduler_test_hydrus, scheduler_test_passing])
+    assert graph == [set(), {0}]
+
+
+def test_writer_depends_on_reader_of_its_output():
+    # Modflow reads the model which passing overwrites
+    graph = build_dependency_graph([scheduler_test_modflow, scheduler_test_hydrus, scheduler_test_passing])
+    assert graph == [set(), set(), {0, 1}]
+
+
+def test_undeclared_task_conflicts_with_all_tasks():
+    graph = build_dependency_graph([scheduler_test_hydrus, scheduler_test_undeclared, scheduler_test_modflow])
+    assert graph == [set(), {0}, {1}]
+
+
+def test_private_writes_do_not_conflict():
+    assert tasks_conflict(scheduler_test_iteration, scheduler_test_iteration)
+    assert not tasks_conflict(scheduler_test_iteration, scheduler_test_iteration,
+                              private_writes={SimulationResource.ITERATION_FILES})
+
+
+def test_dag_scheduler_starts_task_after_its_dependencies():
+    events = []
+    lock = threading.Lock()
+    # Tasks without dependencies must run concurrently, otherwise the barrier is broken
+    barrier = threading.Barrier(2, timeout=5)
+
+    def run_stage(i: int) -> None:
+        with lock:
+            events.append(("start", i))
+        if i < 2:
+            barrier.wait()
+            time.sleep(0.05 * (i + 1))
+        with lock:
+            events.append(("end", i))
+
+    DagScheduler().run([set(), set(), {0, 1}], run_stage)
+
+    assert events.index(("start", 2)) > max(events.index(("end", 0)), events.index(("end", 1)))
+
+
+def test_dag_scheduler_limits_parallel_tasks():
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def run_stage(i: int) -> None:
+        with lock:
+            running.append(i)
+            max_running.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(i)
+
+    DagScheduler(max_parallel_tasks=2).run([set()] * 6, run_stage)
+
+    assert max(max_running) == 2
+
+
+def test_dag_scheduler_starts_no_tasks_after_failure():
+    started = []
+
+    def run_stage(i: int) -> None:
+        started.append(i)
+        if i == 0:
+            raise ValueError("Stage failed")
+
+    with pytest.raises(SimulationError):
+        DagScheduler().run([set(), {0}], run_stage)
+    assert started == [0]
+
+
+def test_dag_scheduler_runs_coroutine_stages_in_dependency_order():
+    events = []
+
+    async def run_stage(i: int) -> None:
+        events.append(("start", i))
+        await asyncio.sleep(0.01 * (3 - i))
+        events.append(("end", i))
+
+    asyncio.run(DagScheduler().run_async([set(), set(), {1}], run_stage))
+
+    assert events.index(("start", 2)) > events.index(("end", 1))
+    # Stage 0 is still running when stage 1 ends
+    assert events.index(("end", 0)) > events.index(("end", 1))